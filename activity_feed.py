@@ -0,0 +1,245 @@
+# activity_feed.py
+# Recent activity of one episode: audit entries, comments and video
+# generations merged into a single newest-first feed.
+#
+# Pages are keyset-paginated on (timestamp, kind, id), so each source is an
+# index range scan (audit_log by target, comment and video_generation by
+# episode/scene and time) no matter how deep the page is. Rows without a
+# timestamp have no place in that order and are left out.
+#
+# Pages are kept in the shared cache (cache.py), so every worker process sees
+# the same copy, under a per-episode version. A commit that touches the
+# episode's audit log, comments, scenes or generations drops the version, and
+# with it all of the episode's pages. Pages also expire after
+# CACHE_PAGE_SECONDS, bounding how long a missed invalidation can show.
+
+import uuid
+from datetime import datetime
+
+from sqlalchemy import event
+
+from audit_query import parse_details
+from cache import shared_cache
+from models import db, AuditLog, Comment, Scene, VideoGeneration
+
+PAGE_SIZE = 30
+MAX_PAGE_SIZE = 100
+CACHE_PAGE_SECONDS = 300
+CACHE_VERSION_SECONDS = 24 * 3600
+
+# Comments are their own events; their audit entries would duplicate them.
+_SKIPPED_ACTIONS = ("add_comment",)
+
+# Tie-break order between sources at the same timestamp
+KIND_AUDIT = "audit"
+KIND_COMMENT = "comment"
+KIND_VIDEO = "video"
+_KIND_RANK = {KIND_AUDIT: 0, KIND_COMMENT: 1, KIND_VIDEO: 2}
+
+
+def encode_cursor(event_):
+    return f"{event_['timestamp']}|{event_['kind']}|{event_['id']}"
+
+
+def decode_cursor(cursor):
+    """(timestamp, kind rank, id), or None if missing or malformed."""
+    try:
+        timestamp, kind, event_id = cursor.split("|")
+        return datetime.fromisoformat(timestamp.rstrip("Z")), _KIND_RANK[kind], int(event_id)
+    except (AttributeError, KeyError, ValueError):
+        return None
+
+
+def _after(query, timestamp_column, id_column, kind, position):
+    """Restricts a source to events that sort after the cursor position."""
+    if position is None:
+        return query
+    timestamp, rank, event_id = position
+    if _KIND_RANK[kind] < rank:
+        return query.filter(timestamp_column <= timestamp)
+    if _KIND_RANK[kind] > rank:
+        return query.filter(timestamp_column < timestamp)
+    return query.filter(db.tuple_(timestamp_column, id_column) < (timestamp, event_id))
+
+
+def _event(kind, event_id, timestamp, user, action, details):
+    return {
+        "kind": kind,
+        "id": event_id,
+        "timestamp": timestamp.isoformat() + "Z" if timestamp else None,
+        "user": user.username if user else None,
+        "action": action,
+        "details": details,
+        "_sort": (timestamp or datetime.min, _KIND_RANK[kind], event_id),
+    }
+
+
+def _audit_events(episode_id, position, limit):
+    query = AuditLog.query.filter(
+        AuditLog.target_type == "Episode",
+        AuditLog.target_id == episode_id,
+        AuditLog.action.notin_(_SKIPPED_ACTIONS),
+        AuditLog.timestamp.isnot(None),
+    )
+    query = _after(query, AuditLog.timestamp, AuditLog.id, KIND_AUDIT, position)
+    logs = (
+        query.order_by(AuditLog.timestamp.desc(), AuditLog.id.desc())
+        .options(db.joinedload(AuditLog.user))
+        .limit(limit)
+        .all()
+    )
+    return [
+        _event(KIND_AUDIT, log.id, log.timestamp, log.user, log.action, parse_details(log.details))
+        for log in logs
+    ]
+
+
+def _comment_events(episode_id, position, limit):
+    query = Comment.query.filter(
+        Comment.episode_id == episode_id, Comment.timestamp.isnot(None)
+    )
+    query = _after(query, Comment.timestamp, Comment.id, KIND_COMMENT, position)
+    comments = (
+        query.order_by(Comment.timestamp.desc(), Comment.id.desc())
+        .options(db.joinedload(Comment.author))
+        .limit(limit)
+        .all()
+    )
+    return [
+        _event(
+            KIND_COMMENT,
+            comment.id,
+            comment.timestamp,
+            comment.author,
+            "comment",
+            {"block_index": comment.block_index, "text": comment.text[:200]},
+        )
+        for comment in comments
+    ]
+
+
+def _video_events(episode_id, position, limit):
+    query = (
+        db.session.query(VideoGeneration, Scene.number)
+        .join(Scene, VideoGeneration.scene_id == Scene.id)
+        .filter(Scene.episode_id == episode_id, VideoGeneration.created_at.isnot(None))
+    )
+    query = _after(
+        query, VideoGeneration.created_at, VideoGeneration.id, KIND_VIDEO, position
+    )
+    rows = (
+        query.order_by(VideoGeneration.created_at.desc(), VideoGeneration.id.desc())
+        .options(db.joinedload(VideoGeneration.creator))
+        .limit(limit)
+        .all()
+    )
+    return [
+        _event(
+            KIND_VIDEO,
+            generation.id,
+            generation.created_at,
+            generation.creator,
+            "video_generation",
+            {
+                "scene_number": scene_number,
+                "attempt_number": generation.attempt_number,
+                "model": generation.model,
+                "status": generation.status,
+            },
+        )
+        for generation, scene_number in rows
+    ]
+
+
+def load_activity(episode_id, cursor=None, limit=PAGE_SIZE):
+    """One page of the feed: {"events": [...], "next_cursor": str or None}."""
+    position = decode_cursor(cursor)
+    events = []
+    for source in (_audit_events, _comment_events, _video_events):
+        # Each source returns at most limit + 1, enough to fill the page and
+        # know whether another one follows.
+        events.extend(source(episode_id, position, limit + 1))
+    events.sort(key=lambda event_: event_["_sort"], reverse=True)
+    page = events[:limit]
+    next_cursor = encode_cursor(page[-1]) if len(events) > limit else None
+    for event_ in page:
+        del event_["_sort"]
+    return {"events": page, "next_cursor": next_cursor}
+
+
+# --- Cache (shared, per episode version, dropped on commit) ---
+class ActivityCache:
+    def __init__(self, cache=shared_cache):
+        self._cache = cache
+
+    @staticmethod
+    def _version_key(episode_id):
+        return f"activity:{episode_id}:version"
+
+    def _version(self, episode_id):
+        version = self._cache.peek(self._version_key(episode_id))
+        if version is None:
+            # Never reused, so pages loaded under a dropped version stay unread
+            version = uuid.uuid4().hex
+            self._cache.put(self._version_key(episode_id), version, CACHE_VERSION_SECONDS)
+        return version
+
+    def get(self, episode_id, cursor=None, limit=PAGE_SIZE):
+        if decode_cursor(cursor) is None:
+            cursor = None  # Malformed ones would each take a cache entry
+        key = f"activity:{episode_id}:{self._version(episode_id)}:{limit}:{cursor or ''}"
+        page = self._cache.peek(key)
+        if page is None:
+            page = load_activity(episode_id, cursor, limit)
+            self._cache.put(key, page, CACHE_PAGE_SECONDS)
+        return page
+
+    def invalidate(self, episode_ids):
+        for episode_id in episode_ids:
+            self._cache.invalidate(self._version_key(episode_id))
+
+
+activity_cache = ActivityCache()
+
+
+# --- Session hooks (collect touched episodes, invalidate after commit) ---
+def _episode_id_of(session, obj):
+    if isinstance(obj, AuditLog):
+        return obj.target_id if obj.target_type == "Episode" else None
+    if isinstance(obj, (Comment, Scene)):
+        return obj.episode_id
+    if isinstance(obj, VideoGeneration) and obj.scene_id is not None:
+        # Plain SQL: the session is mid-flush
+        return session.connection().execute(
+            db.select(Scene.episode_id).where(Scene.id == obj.scene_id)
+        ).scalar()
+    return None
+
+
+def _collect_touched(session, flush_context):
+    touched = session.info.setdefault("activity_episodes", set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (AuditLog, Comment, Scene, VideoGeneration)):
+            episode_id = _episode_id_of(session, obj)
+            if episode_id is not None:
+                touched.add(episode_id)
+
+
+def _invalidate_touched(session):
+    touched = session.info.pop("activity_episodes", None)
+    if touched:
+        activity_cache.invalidate(touched)
+
+
+def _forget_touched(session, previous_transaction):
+    session.info.pop("activity_episodes", None)
+
+
+def register_activity_hooks():
+    for name, listener in (
+        ("after_flush", _collect_touched),
+        ("after_commit", _invalidate_touched),
+        ("after_soft_rollback", _forget_touched),
+    ):
+        if not event.contains(db.session, name, listener):
+            event.listen(db.session, name, listener)
@@ -0,0 +1,338 @@
+# admin_views.py
+# Flask-Admin views (users, episodes, maslaks, audit log, scenes, videos, spend).
+# Imported by create_app() only for apps that serve requests; CLI commands
+# skip Flask-Admin and WTForms entirely.
+
+from flask import flash, redirect, request, url_for
+from flask_admin import Admin, AdminIndexView, BaseView, expose
+from flask_admin.contrib.sqla import ModelView
+from flask_login import current_user
+from flask_wtf import FlaskForm
+from werkzeug.security import generate_password_hash
+from wtforms import StringField, PasswordField, BooleanField, SelectField
+from wtforms.validators import DataRequired, EqualTo, Length, Optional
+
+from models import (
+    db,
+    User,
+    Episode,
+    Maslak,
+    AuditLog,
+    Scene,
+    VideoGeneration,
+    EPISODE_STATUS_CHOICES,
+)
+from collab import collab_hub
+from comment_anchors import reanchor_comments
+from revisions import REVISION_FIELDS, latest_numbers, record_revision
+from audit_archive import archive_periods, archived_entries
+from audit_query import log_activity
+from spend import report_args, spend_report
+
+
+# --- Custom Admin Forms ---
+class UserForm(FlaskForm):
+    username = StringField(
+        "اسم المستخدم", validators=[DataRequired(), Length(min=3, max=80)]
+    )
+    password = PasswordField(
+        "كلمة المرور (جديدة)",
+        validators=[
+            Optional(),
+            EqualTo("confirm_password", message="يجب أن تتطابق كلمتا المرور"),
+        ],
+    )
+    confirm_password = PasswordField("تأكيد كلمة المرور")
+    is_admin = BooleanField("مسؤول؟")
+
+
+class MaslakForm(FlaskForm):
+    name = StringField("اسم المسلك", validators=[DataRequired(), Length(max=100)])
+
+
+# --- Flask-Admin Setup ---
+class MyAdminIndexView(AdminIndexView):
+    def is_accessible(self):
+        return (
+            current_user.is_authenticated
+            and hasattr(current_user, "is_admin")
+            and current_user.is_admin
+        )
+
+    def inaccessible_callback(self, name, **kwargs):
+        flash("الرجاء تسجيل الدخول كمسؤول للوصول لهذه الصفحة.", "warning")
+        return redirect(url_for("main.login", next=request.url))
+
+
+class SecureModelView(ModelView):
+    def is_accessible(self):
+        return (
+            current_user.is_authenticated
+            and hasattr(current_user, "is_admin")
+            and current_user.is_admin
+        )
+
+    def inaccessible_callback(self, name, **kwargs):
+        flash("الرجاء تسجيل الدخول كمسؤول للوصول لهذه الصفحة.", "warning")
+        return redirect(url_for("main.login", next=request.url))
+
+
+class UserAdminView(SecureModelView):
+    form = UserForm
+    column_list = ("id", "username", "is_admin", "last_login", "assigned_episodes")
+    column_exclude_list = ("password", "audit_logs")
+    form_excluded_columns = (
+        "comments",
+        "assigned_episodes",
+        "password",
+        "last_login",
+        "audit_logs",
+    )
+    column_searchable_list = ("username",)
+    column_display_pk = True
+    column_sortable_list = ("id", "username", "is_admin", "last_login")
+
+    def on_model_change(self, form, model, is_created):
+        if form.password.data:
+            model.password = generate_password_hash(
+                form.password.data, method="pbkdf2:sha256"
+            )
+        elif is_created and not model.password:
+            flash("كلمة المرور مطلوبة للمستخدمين الجدد.", "error")
+            raise ValueError("Password required")
+
+    def after_model_change(self, form, model, is_created):
+        action = "create_user" if is_created else "edit_user"
+        log_activity(
+            action, target=model, details={"admin": current_user.username}
+        )
+
+    def on_model_delete(self, model):
+        log_activity(
+            "delete_user",
+            target=model,
+            details={"admin": current_user.username},
+        )
+
+
+class EpisodeAdminView(SecureModelView):
+    column_list = (
+        "id",
+        "title",
+        "maslak",
+        "status",
+        "display_order",
+        "last_updated",
+        "assignees",
+    )
+    column_searchable_list = ("title", "plan", "scenario", "maslak.name", "status")
+    column_filters = ("maslak", "status")
+    form_columns = ("title", "maslak", "status", "plan", "scenario", "display_order")
+    form_excluded_columns = ("comments", "assignees", "audit_logs")
+    column_display_pk = True
+    column_sortable_list = (
+        "id",
+        "title",
+        "maslak.name",
+        "status",
+        "last_updated",
+        "display_order",
+    )
+    form_overrides = {"status": SelectField}
+    form_args = {"status": {"label": "الحالة", "choices": EPISODE_STATUS_CHOICES}}
+
+    def on_model_change(self, form, model, is_created):
+        if is_created:
+            return
+        state = db.inspect(model)
+        model._live_changed_fields = []
+        for field in REVISION_FIELDS:
+            history = state.attrs[field].history
+            if not history.has_changes():
+                continue
+            old_value = history.deleted[0] if history.deleted else ""
+            record_revision(model, field, old_value, getattr(model, field), current_user)
+            if field == "scenario":
+                reanchor_comments(model.id, old_value, model.scenario)
+            model._live_changed_fields.append(field)
+
+    def after_model_change(self, form, model, is_created):
+        action = "create_episode_admin" if is_created else "edit_episode_admin"
+        for field in getattr(model, "_live_changed_fields", []):
+            collab_hub.reset_field(
+                model.id,
+                field,
+                getattr(model, field),
+                extra={"stored_revisions": latest_numbers(model.id)},
+            )
+        log_activity(
+            action, target=model, details={"admin": current_user.username}
+        )
+
+    def on_model_delete(self, model):
+        log_activity(
+            "delete_episode_admin",
+            target=model,
+            details={"admin": current_user.username},
+        )
+
+
+class MaslakAdminView(SecureModelView):
+    form = MaslakForm
+    column_list = ("id", "name", "episodes")
+    column_searchable_list = ("name",)
+    column_display_pk = True
+    form_excluded_columns = ("episodes",)
+
+    def after_model_change(self, form, model, is_created):
+        action = "create_maslak" if is_created else "edit_maslak"
+        log_activity(
+            action, target=model, details={"admin": current_user.username}
+        )
+
+    def on_model_delete(self, model):
+        log_activity(
+            "delete_maslak",
+            target=model,
+            details={"admin": current_user.username},
+        )
+
+
+class AuditLogAdminView(SecureModelView):
+    # Use custom template to add Clear button
+    list_template = "admin/auditlog_list.html"
+
+    can_create = False
+    can_edit = False
+    can_delete = False  # Read-only view
+    column_list = ("timestamp", "user", "action", "target_type", "target_id", "details")
+    column_searchable_list = ("action", "target_type", "details", "user.username")
+    column_filters = ("action", "user", "target_type", "timestamp")
+    column_default_sort = ("timestamp", True)
+    column_labels = {
+        "user": "المستخدم",
+        "timestamp": "الوقت",
+        "action": "الإجراء",
+        "target_type": "نوع الهدف",
+        "target_id": "معرف الهدف",
+        "details": "تفاصيل",
+    }
+
+
+class AuditArchiveAdminView(BaseView):
+    """Archived audit rows (see audit_archive.py), read only when opened."""
+
+    PER_PAGE = 100
+
+    def is_accessible(self):
+        return (
+            current_user.is_authenticated
+            and hasattr(current_user, "is_admin")
+            and current_user.is_admin
+        )
+
+    def inaccessible_callback(self, name, **kwargs):
+        flash("الرجاء تسجيل الدخول كمسؤول للوصول لهذه الصفحة.", "warning")
+        return redirect(url_for("main.login", next=request.url))
+
+    @expose("/")
+    def index(self):
+        period = request.args.get("period")
+        search = request.args.get("q", "").strip()
+        page = max(request.args.get("page", 1, type=int), 1)
+        entries = archived_entries(period, search) if period else []
+        return self.render(
+            "admin/audit_archive.html",
+            periods=archive_periods(),
+            period=period,
+            search=search,
+            page=page,
+            total=len(entries),
+            per_page=self.PER_PAGE,
+            entries=entries[(page - 1) * self.PER_PAGE : page * self.PER_PAGE],
+        )
+
+
+class SpendAdminView(BaseView):
+    """Video generation spend per day, episode, model or user (spend.py)."""
+
+    GROUP_LABELS = {"day": "اليوم", "episode": "الحلقة", "model": "النموذج", "user": "المستخدم"}
+
+    def is_accessible(self):
+        return (
+            current_user.is_authenticated
+            and hasattr(current_user, "is_admin")
+            and current_user.is_admin
+        )
+
+    def inaccessible_callback(self, name, **kwargs):
+        flash("الرجاء تسجيل الدخول كمسؤول للوصول لهذه الصفحة.", "warning")
+        return redirect(url_for("main.login", next=request.url))
+
+    @expose("/")
+    def index(self):
+        try:
+            kwargs = report_args(request.args)
+        except ValueError:
+            flash("معاملات التقرير غير صالحة.", "warning")
+            kwargs = {"group_by": "day"}
+        return self.render(
+            "admin/spend.html",
+            report=spend_report(**kwargs),
+            group_by=kwargs["group_by"],
+            group_labels=self.GROUP_LABELS,
+            since=request.args.get("since", ""),
+            until=request.args.get("until", ""),
+        )
+
+
+class SceneAdminView(SecureModelView):
+    column_list = ("id", "episode", "number", "created_at")
+    column_filters = ("episode",)
+    form_columns = ("episode", "number")
+    column_display_pk = True
+
+
+class VideoGenerationAdminView(SecureModelView):
+    column_list = (
+        "id", "scene", "model", "status", "resolution",
+        "aspect_ratio", "generate_audio", "cost", "created_at"
+    )
+    column_filters = ("status", "model", "scene")
+    form_columns = (
+        "scene", "prompt", "model", "resolution",
+        "aspect_ratio", "generate_audio", "duration",
+        "job_id", "polling_url", "status",
+        "unsigned_url", "drive_file_id", "drive_view_url",
+        "local_path", "cost", "error_message",
+        "created_by", "completed_at",
+    )
+    column_display_pk = True
+    can_create = True
+    can_edit = True
+    can_delete = True
+
+
+def init_admin(app):
+    admin = Admin(
+        app,
+        name="صالح - الكراسة الحمراء 📕",
+        template_mode="bootstrap4",
+        url="/admin",
+        index_view=MyAdminIndexView(),
+    )
+    admin.add_view(UserAdminView(User, db.session, name="المستخدمون"))
+    admin.add_view(EpisodeAdminView(Episode, db.session, name="الحلقات"))
+    admin.add_view(MaslakAdminView(Maslak, db.session, name="المسالك"))
+    admin.add_view(AuditLogAdminView(AuditLog, db.session, name="سجل النشاط"))
+    admin.add_view(
+        AuditArchiveAdminView(
+            name="أرشيف سجل النشاط", endpoint="auditarchive", url="/admin/audit-archive"
+        )
+    )
+    admin.add_view(SceneAdminView(Scene, db.session, name="المشاهد"))
+    admin.add_view(SpendAdminView(name="تكاليف التوليد", endpoint="spend", url="/admin/spend"))
+    admin.add_view(
+        VideoGenerationAdminView(VideoGeneration, db.session, name="عمليات التوليد")
+    )
+    return admin
@@ -0,0 +1,229 @@
+# assets.py
+# Fingerprinted static assets.
+#
+# `flask build-assets` compiles Tailwind to one purged, minified stylesheet
+# (the classes used in templates/ and static/js/, see tailwind.config.js),
+# minifies the app's own CSS and JS, and writes each file to
+# static/dist/ under a name holding a hash of its content, e.g.
+# dist/js/script.3f9a1c0b2e.js. static/dist/manifest.json maps the source
+# names to those files. Templates link assets with asset_url("js/script.js"),
+# which resolves through the manifest. A hashed file never changes, so it is
+# served with a one-year immutable Cache-Control.
+#
+# Without a build (a fresh checkout, development) asset_url() returns the
+# plain /static URL and base.html loads Tailwind from its CDN instead.
+#
+# The service worker (static/sw.js) is served at /sw.js so it controls every
+# page, with the manifest's version and URLs prepended: each build gives it
+# new bytes, so browsers install it and it drops the caches of the old build.
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+
+from flask import Response, current_app, request, url_for
+
+STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
+SERVICE_WORKER_PATH = os.path.join(STATIC_DIR, "sw.js")
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+MANIFEST_PATH = os.path.join(DIST_DIR, "manifest.json")
+TAILWIND_CONFIG = os.path.join(os.path.dirname(__file__), "tailwind.config.js")
+
+# Built by the Tailwind CLI, not copied from static/
+TAILWIND_ASSET = "css/tailwind.css"
+# Source files under static/ that get a fingerprinted copy
+SOURCES = ("css/style.css", "js/script.js", "js/video_section.js", "js/live_edit.js")
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+# --- Build ---
+def _minify(name, text):
+    # Imported here: only the build needs them
+    if name.endswith(".js"):
+        import rjsmin
+
+        return rjsmin.jsmin(text)
+    import rcssmin
+
+    return rcssmin.cssmin(text)
+
+
+def _fingerprinted(name, content):
+    """dist/ path of `name` holding `content`: js/script.js -> dist/js/script.<hash>.js"""
+    digest = hashlib.sha256(content).hexdigest()[:10]
+    stem, ext = os.path.splitext(name)
+    return f"dist/{stem}.{digest}{ext}"
+
+
+def _write(path, content):
+    target = os.path.join(STATIC_DIR, path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, "wb") as f:
+        f.write(content)
+
+
+def _tailwind_command():
+    """TAILWIND_CLI from the environment, else the standalone `tailwindcss`
+    binary, else the npm package through npx."""
+    if os.environ.get("TAILWIND_CLI"):
+        return os.environ["TAILWIND_CLI"].split()
+    if shutil.which("tailwindcss"):
+        return ["tailwindcss"]
+    return ["npx", "--yes", "tailwindcss@3"]
+
+
+def _build_tailwind():
+    """Runs the Tailwind CLI over the templates and scripts; returns the CSS."""
+    output = os.path.join(DIST_DIR, "tailwind.tmp.css")
+    command = [*_tailwind_command(), "-c", TAILWIND_CONFIG, "-o", output, "--minify"]
+    try:
+        subprocess.run(
+            command,
+            cwd=os.path.dirname(__file__),
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+    except FileNotFoundError:
+        raise RuntimeError(f"Tailwind CLI not found: {command[0]} (set TAILWIND_CLI)")
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Tailwind build failed:\n{e.stderr.strip()}")
+    try:
+        with open(output, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(output)
+
+
+def _read_manifest():
+    try:
+        with open(MANIFEST_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def build_assets(tailwind=True, out=print):
+    """Writes the fingerprinted assets and the manifest. Files of the
+    previous build are kept (pages already open still link them); older
+    ones are deleted. Returns the new manifest."""
+    os.makedirs(DIST_DIR, exist_ok=True)
+    previous = _read_manifest()
+    manifest = {}
+    if tailwind:
+        css = _build_tailwind()
+        manifest[TAILWIND_ASSET] = _fingerprinted(TAILWIND_ASSET, css)
+        _write(manifest[TAILWIND_ASSET], css)
+        out(f"{TAILWIND_ASSET:<24}{len(css):>10,} B  -> {manifest[TAILWIND_ASSET]}")
+    for name in SOURCES:
+        with open(os.path.join(STATIC_DIR, name), encoding="utf-8") as f:
+            source = f.read()
+        content = _minify(name, source).encode("utf-8")
+        manifest[name] = _fingerprinted(name, content)
+        _write(manifest[name], content)
+        out(f"{name:<24}{len(source.encode('utf-8')):>10,} B  -> {len(content):>8,} B  {manifest[name]}")
+
+    keep = {"dist/manifest.json", *manifest.values(), *previous.values()}
+    for directory, _, files in os.walk(DIST_DIR):
+        for filename in files:
+            path = os.path.join(directory, filename)
+            if os.path.relpath(path, STATIC_DIR).replace(os.sep, "/") not in keep:
+                os.remove(path)
+
+    temporary = MANIFEST_PATH + ".tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(temporary, MANIFEST_PATH)  # Readers never see half a manifest
+    return manifest
+
+
+# --- Runtime ---
+class _Manifest:
+    """The manifest as of the app's start; re-read on change in debug mode."""
+
+    def __init__(self):
+        self.entries = {}
+        self.version = "dev"  # No build
+        self.mtime = None
+
+    def load(self):
+        try:
+            mtime = os.path.getmtime(MANIFEST_PATH)
+        except OSError:
+            mtime = None
+        if mtime != self.mtime:
+            self.entries = _read_manifest() if mtime is not None else {}
+            self.version = (
+                hashlib.sha256(json.dumps(self.entries, sort_keys=True).encode()).hexdigest()[:10]
+                if self.entries
+                else "dev"
+            )
+            self.mtime = mtime
+        return self.entries
+
+
+def asset_built(name):
+    """Whether the last build produced `name` (e.g. "css/tailwind.css")."""
+    return name in _entries()
+
+
+def asset_url(name):
+    """URL of a static asset: its fingerprinted copy if built, else the plain file."""
+    return url_for("static", filename=_entries().get(name, name))
+
+
+def _manifest():
+    manifest = current_app.extensions["asset_manifest"]
+    if current_app.debug:
+        manifest.load()
+    return manifest
+
+
+def _entries():
+    return _manifest().entries
+
+
+def service_worker_view():
+    """static/sw.js with the asset version and the URLs to precache."""
+    manifest = _manifest()
+    names = [TAILWIND_ASSET, *SOURCES] if TAILWIND_ASSET in manifest.entries else SOURCES
+    with open(SERVICE_WORKER_PATH, encoding="utf-8") as f:
+        script = f.read()
+    header = (
+        f"const ASSET_VERSION = {json.dumps(manifest.version)};\n"
+        f"const PRECACHE_URLS = {json.dumps([asset_url(name) for name in names])};\n"
+    )
+    response = Response(header + script, mimetype="application/javascript")
+    # Browsers check for a new worker on navigation; never answer from a cache
+    response.cache_control.no_cache = True
+    return response
+
+
+def _cache_hashed_assets(response):
+    filename = (request.view_args or {}).get("filename", "")
+    if (
+        request.endpoint == "static"
+        and response.status_code in (200, 206, 304)
+        and filename.startswith("dist/")
+        and filename != "dist/manifest.json"
+    ):
+        response.cache_control.public = True
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+
+def init_assets(app):
+    """Loads the manifest, adds asset_url()/asset_built() to templates and
+    serves the service worker at /sw.js."""
+    manifest = _Manifest()
+    manifest.load()
+    app.extensions["asset_manifest"] = manifest
+    app.add_template_global(asset_url)
+    app.add_template_global(asset_built)
+    app.after_request(_cache_hashed_assets)
+    app.add_url_rule("/sw.js", "service_worker", service_worker_view)
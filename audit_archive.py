@@ -0,0 +1,274 @@
+# audit_archive.py
+# Keeps the live audit log small by moving old rows into archive segments.
+#
+# Rows older than AUDIT_ARCHIVE_AFTER_DAYS are grouped by month and stored
+# as gzip-compressed JSON lines in AuditArchiveSegment (one blob per month,
+# split at MAX_SEGMENT_ROWS). Moving a batch is a single transaction, so a
+# row is always either live or archived. The segments stay in the main
+# database and are therefore covered by backups.
+#
+# The app archives on its own every AUDIT_ARCHIVE_INTERVAL_HOURS (default 24,
+# 0 turns it off), from a daemon thread started by the first request; the
+# time of the last run is kept in instance/audit_archive.json so that all
+# worker processes share one schedule. Archiving also runs before each
+# scheduled backup, with `flask archive-audit-log` (e.g. from cron) and from
+# the audit log admin page. A lock file keeps two runs from overlapping.
+
+import gzip
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from models import db, AuditLog, AuditArchiveSegment, User
+
+try:
+    import fcntl  # Not available on Windows; the lock is skipped there
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get("AUDIT_ARCHIVE_AFTER_DAYS", "90"))
+BATCH_SIZE = 5000
+MAX_SEGMENT_ROWS = 50000
+CHECK_INTERVAL_SECONDS = 600
+
+
+def _entry(log, usernames):
+    # Usernames are copied in: the user may be deleted long before the row is read
+    return {
+        "id": log.id,
+        "timestamp": log.timestamp.isoformat(),
+        "user_id": log.user_id,
+        "username": usernames.get(log.user_id),
+        "action": log.action,
+        "target_type": log.target_type,
+        "target_id": log.target_id,
+        "details": log.details,
+    }
+
+
+def _pack(entries):
+    lines = "\n".join(
+        json.dumps(entry, ensure_ascii=False, separators=(",", ":")) for entry in entries
+    )
+    return gzip.compress(lines.encode("utf-8"), mtime=0)
+
+
+def _unpack(data):
+    text = gzip.decompress(data).decode("utf-8")
+    return [json.loads(line) for line in text.splitlines() if line]
+
+
+def _append_to_period(period, entries):
+    segment = (
+        AuditArchiveSegment.query.filter(
+            AuditArchiveSegment.period == period,
+            AuditArchiveSegment.row_count < MAX_SEGMENT_ROWS,
+        )
+        .order_by(AuditArchiveSegment.id.desc())
+        .first()
+    )
+    while entries:
+        if segment is None:
+            segment = AuditArchiveSegment(period=period, row_count=0)
+            db.session.add(segment)
+            existing = []
+        else:
+            existing = _unpack(segment.data)
+        room = MAX_SEGMENT_ROWS - len(existing)
+        merged = existing + entries[:room]
+        entries = entries[room:]
+        segment.data = _pack(merged)
+        segment.row_count = len(merged)
+        timestamps = [entry["timestamp"] for entry in merged]
+        segment.first_at = datetime.fromisoformat(min(timestamps))
+        segment.last_at = datetime.fromisoformat(max(timestamps))
+        segment = None
+
+
+@contextmanager
+def _archive_lock(blocking=True):
+    """Yields False instead of waiting when `blocking` is off and another
+    process holds the lock."""
+    os.makedirs(current_app.instance_path, exist_ok=True)
+    with open(os.path.join(current_app.instance_path, "audit_archive.lock"), "w") as lock_file:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except OSError:
+                yield False
+                return
+        yield True
+
+
+def _state_path():
+    return os.path.join(current_app.instance_path, "audit_archive.json")
+
+
+def last_run_at():
+    """When archiving last ran (local time), or None."""
+    try:
+        with open(_state_path(), encoding="utf-8") as f:
+            return datetime.fromisoformat(json.load(f)["last_run_at"])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _record_run(archived):
+    temporary = _state_path() + ".tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump({"last_run_at": datetime.now().isoformat(timespec="seconds"), "archived": archived}, f)
+    os.replace(temporary, _state_path())
+
+
+def archive_audit_log(older_than_days=None):
+    """Moves audit rows older than `older_than_days` into archive segments.
+    Waits for a run in another process to finish first. Returns the number
+    of rows archived."""
+    with _archive_lock():
+        archived = _archive(older_than_days)
+        _record_run(archived)
+    return archived
+
+
+def archive_if_due():
+    """Archives when AUDIT_ARCHIVE_INTERVAL_HOURS have passed since the last
+    run. Returns the number of rows archived, None when not due or when
+    another process is archiving."""
+    interval = current_app.config["AUDIT_ARCHIVE_INTERVAL_HOURS"]
+    with _archive_lock(blocking=False) as locked:
+        if not locked:
+            return None
+        last = last_run_at()
+        if last is not None and datetime.now() - last < timedelta(hours=interval):
+            return None
+        archived = _archive()
+        _record_run(archived)
+    if archived:
+        logger.info("Archived %d audit log rows.", archived)
+    return archived
+
+
+def _archive(older_than_days=None):
+    days = ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    total = 0
+    while True:
+        logs = (
+            AuditLog.query.filter(AuditLog.timestamp < cutoff)
+            .order_by(AuditLog.timestamp, AuditLog.id)
+            .limit(BATCH_SIZE)
+            .all()
+        )
+        if not logs:
+            return total
+        user_ids = {log.user_id for log in logs if log.user_id is not None}
+        usernames = dict(
+            db.session.query(User.id, User.username).filter(User.id.in_(user_ids))
+        )
+        by_period = {}
+        for log in logs:
+            by_period.setdefault(log.timestamp.strftime("%Y-%m"), []).append(
+                _entry(log, usernames)
+            )
+        try:
+            for period, entries in by_period.items():
+                _append_to_period(period, entries)
+            AuditLog.query.filter(AuditLog.id.in_([log.id for log in logs])).delete(
+                synchronize_session=False
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        total += len(logs)
+
+
+# --- Schedule ---
+class ArchiveSchedule:
+    """Daemon thread running archive_if_due() every CHECK_INTERVAL_SECONDS."""
+
+    def __init__(self):
+        self._app = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def init_app(self, app):
+        self._app = app
+        app.config.setdefault(
+            "AUDIT_ARCHIVE_INTERVAL_HOURS",
+            float(os.environ.get("AUDIT_ARCHIVE_INTERVAL_HOURS", "24")),
+        )
+        if app.config["AUDIT_ARCHIVE_INTERVAL_HOURS"] > 0:
+            # Started lazily so CLI commands and the reloader parent never run it
+            app.before_request(self._ensure_thread)
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            with self._app.app_context():
+                try:
+                    archive_if_due()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception("Scheduled audit log archiving failed")
+                finally:
+                    db.session.remove()
+            self._stop.wait(CHECK_INTERVAL_SECONDS)
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self.run_forever, name="audit-archive", daemon=True
+                )
+                self._thread.start()
+
+
+archive_schedule = ArchiveSchedule()
+
+
+def archive_periods():
+    """[(period, row_count, first_at, last_at)] newest month first."""
+    return (
+        db.session.query(
+            AuditArchiveSegment.period,
+            db.func.sum(AuditArchiveSegment.row_count),
+            db.func.min(AuditArchiveSegment.first_at),
+            db.func.max(AuditArchiveSegment.last_at),
+        )
+        .group_by(AuditArchiveSegment.period)
+        .order_by(AuditArchiveSegment.period.desc())
+        .all()
+    )
+
+
+def archived_entries(period, search=None):
+    """Archived rows of one month, newest first, optionally filtered by a
+    case-insensitive search over action, user, target and details."""
+    entries = []
+    for segment in AuditArchiveSegment.query.filter_by(period=period).order_by(
+        AuditArchiveSegment.id
+    ):
+        entries.extend(_unpack(segment.data))
+    if search:
+        needle = search.casefold()
+        entries = [
+            entry
+            for entry in entries
+            if needle
+            in " ".join(
+                str(entry.get(key) or "")
+                for key in ("action", "username", "target_type", "target_id", "details")
+            ).casefold()
+        ]
+    entries.sort(key=lambda entry: (entry["timestamp"], entry["id"]), reverse=True)
+    return entries
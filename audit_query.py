@@ -0,0 +1,153 @@
+# audit_query.py
+# Audit log entries: writing them with structured details and querying
+# them through indexes.
+#
+# `details` holds a JSON object. The keys below are exposed as SQLite
+# generated columns (json_extract) with indexes, so questions like "who
+# changed episode 42's scenario last week" are index lookups instead of
+# LIKE scans over the whole table.
+
+import json
+from datetime import datetime
+
+from flask import current_app
+from flask_login import current_user
+
+from models import db, AuditLog
+
+# details key -> generated column on AuditLog
+INDEXED_KEYS = {
+    "episode_id": "detail_episode_id",
+    "field": "detail_field",
+    "old_status": "detail_old_status",
+    "new_status": "detail_new_status",
+}
+
+
+def build_details(details, target=None):
+    """Normalizes `details` into a dict. Free text becomes {"message": ...};
+    the episode a target belongs to is added as "episode_id"."""
+    if details is None:
+        data = {}
+    elif isinstance(details, dict):
+        data = dict(details)
+    else:
+        data = {"message": str(details)}
+    if target is not None and "episode_id" not in data:
+        if target.__class__.__name__ == "Episode":
+            data["episode_id"] = target.id
+        elif getattr(target, "episode_id", None) is not None:
+            data["episode_id"] = target.episode_id
+    return data
+
+
+def serialize_details(details, target=None):
+    data = build_details(details, target)
+    # default=str for dates and other complex values
+    return json.dumps(data, ensure_ascii=False, default=str) if data else None
+
+
+def parse_details(text):
+    """The details dict of a stored row (tolerates legacy free text)."""
+    if not text:
+        return {}
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return {"message": text}
+    return data if isinstance(data, dict) else {"message": text}
+
+
+def log_activity(action, user=None, target=None, details=None):
+    """Logs an action to the AuditLog table. `details` is a dict stored as
+    JSON; keys such as field/old_status/new_status are indexed."""
+    try:
+        log_user = user or (current_user if current_user.is_authenticated else None)
+        user_id = log_user.id if log_user else None
+        target_type = target.__class__.__name__ if target else None
+        target_id = target.id if target and hasattr(target, "id") else None
+        details_str = serialize_details(details, target)
+
+        log_entry = AuditLog(
+            user_id=user_id,
+            action=action,
+            target_type=target_type,
+            target_id=target_id,
+            details=details_str,
+        )
+        db.session.add(log_entry)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error logging activity '{action}': {e}", exc_info=True)
+
+
+def encode_cursor(log):
+    return f"{log.timestamp.isoformat()},{log.id}"
+
+
+def decode_cursor(cursor):
+    """(timestamp, id) from a cursor, or None if it is missing or malformed."""
+    try:
+        timestamp, log_id = cursor.rsplit(",", 1)
+        return datetime.fromisoformat(timestamp), int(log_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def query_audit(
+    episode_id=None,
+    field=None,
+    action=None,
+    user_id=None,
+    old_status=None,
+    new_status=None,
+    since=None,
+    until=None,
+    before=None,
+):
+    """AuditLog rows matching the filters, newest first.
+
+    Args:
+        since/until: datetimes (UTC) bounding the timestamp.
+        before: a cursor from encode_cursor(); returns rows after it
+            (keyset pagination, stable while new rows are logged).
+    """
+    query = AuditLog.query
+    for key, value in (
+        ("episode_id", episode_id),
+        ("field", field),
+        ("old_status", old_status),
+        ("new_status", new_status),
+    ):
+        if value is not None:
+            query = query.filter(getattr(AuditLog, INDEXED_KEYS[key]) == value)
+    if action is not None:
+        query = query.filter(AuditLog.action == action)
+    if user_id is not None:
+        query = query.filter(AuditLog.user_id == user_id)
+    if since is not None:
+        query = query.filter(AuditLog.timestamp >= since)
+    if until is not None:
+        query = query.filter(AuditLog.timestamp < until)
+    position = decode_cursor(before)
+    if position is not None:
+        timestamp, log_id = position
+        query = query.filter(
+            db.tuple_(AuditLog.timestamp, AuditLog.id) < (timestamp, log_id)
+        )
+    return query.order_by(AuditLog.timestamp.desc(), AuditLog.id.desc())
+
+
+def audit_entry(log):
+    """JSON-ready form of an AuditLog row."""
+    return {
+        "id": log.id,
+        "timestamp": log.timestamp.isoformat() + "Z" if log.timestamp else None,
+        "user_id": log.user_id,
+        "username": log.user.username if log.user else None,
+        "action": log.action,
+        "target_type": log.target_type,
+        "target_id": log.target_id,
+        "details": parse_details(log.details),
+    }
@@ -1,12 +1,24 @@
-import requests
 import os
+import argparse
 import datetime
-import shutil
+import gzip
+import hashlib
 import logging
+import sqlite3
 import sys
+import tempfile
+import time
 import json # Import json for better error handling
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dotenv import load_dotenv
 
+from backup_storage import FanOutBackend, LocalBackend, build_storage
+
+try:
+    import zstandard  # Optional: better ratio and speed than gzip
+except ImportError:
+    zstandard = None
+
 # Load environment variables from .env file if it exists
 # This allows loading config locally, while PythonAnywhere env vars still take precedence
 load_dotenv()
@@ -21,239 +33,778 @@ DDOWNLOAD_API_KEY = os.environ.get("DDOWNLOAD_API_KEY", "YOUR_DDOWNLOAD_API_KEY"
 DATABASE_PATH = os.environ.get("DATABASE_PATH", "instance/app.db")
 BACKUP_DIR = os.environ.get("BACKUP_DIR", "tmp") # Temporary directory for the backup copy
 USER_TYPE = os.environ.get("DDOWNLOAD_USER_TYPE", "prem") # User type for upload ('prem' recommended)
+# Comma-separated storage targets, each gets every chunk: 'ddownload' and/or 'local:<directory>'
+BACKUP_TARGETS = os.environ.get("BACKUP_TARGETS", "ddownload")
+BACKUP_UPLOAD_WORKERS = int(os.environ.get("BACKUP_UPLOAD_WORKERS", "4")) # Chunks compressed/uploaded in parallel
+# Online backup copies this many pages per step, then yields to writers for BACKUP_STEP_SLEEP seconds.
+BACKUP_PAGES_PER_STEP = int(os.environ.get("BACKUP_PAGES_PER_STEP", "256"))
+BACKUP_STEP_SLEEP = float(os.environ.get("BACKUP_STEP_SLEEP", "0.05"))
+# Compression: 'zstd' (needs the zstandard package) or 'gzip'. Defaults to zstd when available.
+COMPRESSION = os.environ.get("BACKUP_COMPRESSION", "zstd" if zstandard else "gzip")
+if COMPRESSION == "zstd" and zstandard is None:
+    COMPRESSION = "gzip"
+ZSTD_LEVEL = int(os.environ.get("BACKUP_ZSTD_LEVEL", "10"))
+GZIP_LEVEL = int(os.environ.get("BACKUP_GZIP_LEVEL", "6"))
+# Content-defined chunks: a boundary after a page whose hash has these low bits clear
+# (about one page in 32, so ~128 KB chunks with 4 KB pages), within MIN/MAX pages.
+CHUNK_BOUNDARY_MASK = int(os.environ.get("BACKUP_CHUNK_BOUNDARY_MASK", "31"))
+CHUNK_MIN_PAGES = int(os.environ.get("BACKUP_CHUNK_MIN_PAGES", "8"))
+CHUNK_MAX_PAGES = int(os.environ.get("BACKUP_CHUNK_MAX_PAGES", "256"))
+RESUME_MAX_AGE_HOURS = float(os.environ.get("BACKUP_RESUME_MAX_AGE_HOURS", "24")) # Older interrupted uploads are discarded
+# Grandfather-father-son retention: the last N backups, plus the newest backup per day / ISO week / month.
+RETAIN_LAST = int(os.environ.get("BACKUP_RETAIN_LAST", "3"))
+RETAIN_DAILY = int(os.environ.get("BACKUP_RETAIN_DAILY", "7"))
+RETAIN_WEEKLY = int(os.environ.get("BACKUP_RETAIN_WEEKLY", "4"))
+RETAIN_MONTHLY = int(os.environ.get("BACKUP_RETAIN_MONTHLY", "12"))
 
 # --- Logging Setup ---
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    stream=sys.stdout # Log to standard output, which PythonAnywhere captures
-)
+def setup_logging() -> None:
+    """Script logging; when imported by the app (backup_scheduler.py) the app's logging applies."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        stream=sys.stdout # Log to standard output, which PythonAnywhere captures
+    )
 
 # --- Helper Functions ---
 
-def get_upload_details(api_key: str) -> tuple[str | None, str | None]:
+def create_snapshot(source_path: str, dest_path: str,
+                    pages_per_step: int = BACKUP_PAGES_PER_STEP,
+                    step_sleep: float = BACKUP_STEP_SLEEP) -> None:
     """
-    Gets an upload server URL and session ID from the DDownload API v2.
+    Copies a live SQLite database with the online backup API.
+
+    The copy is made in steps of `pages_per_step` pages. The source is only
+    read-locked during a step, so the app can keep writing in between; if it
+    does, SQLite restarts the copy so the result is always a consistent
+    snapshot of a single point in time.
 
     Args:
-        api_key: Your DDownload API key.
+        source_path: Path to the live database.
+        dest_path: Path of the snapshot to create (overwritten if present).
+    """
+    # Read-only URI: the backup must never create or modify the source.
+    source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True, timeout=30)
+    dest = sqlite3.connect(dest_path)
+    try:
+        def progress(status, remaining, total):
+            if remaining and step_sleep:
+                time.sleep(step_sleep)  # Let writers in between steps
+
+        source.backup(dest, pages=pages_per_step, progress=progress)
+    finally:
+        dest.close()
+        source.close()
+
+
+def check_integrity(db_path: str) -> bool:
+    """
+    Runs `PRAGMA integrity_check` on a snapshot.
 
     Returns:
-        A tuple containing (upload_url, session_id) if successful,
-        otherwise (None, None).
+        True if SQLite reports the database as 'ok', False otherwise.
     """
-    # Use the v2 API endpoint
-    api_url = f"https://api-v2.ddownload.com/api/upload/server?key={api_key}"
-    logging.info("Requesting upload server and session ID from DDownload API v2...")
     try:
-        response = requests.get(api_url, timeout=30) # 30 second timeout
-        response.raise_for_status() # Raise an exception for bad status codes (4xx or 5xx)
-
-        data = response.json()
-        # Check the response structure based on v2 docs
-        if data.get("msg") == "OK" and data.get("result") and data.get("sess_id"):
-            upload_url = data["result"]
-            session_id = data["sess_id"]
-            logging.info(f"Successfully obtained upload URL: {upload_url[:30]}... and session ID.")
-            return upload_url, session_id
-        else:
-            logging.error(f"Failed to get upload details. API Response: {data}")
-            return None, None
-
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Error requesting upload server: {e}")
-        return None, None
-    except json.JSONDecodeError as e:
-        logging.error(f"Error decoding JSON response from API: {e}")
-        logging.error(f"Response text: {response.text if 'response' in locals() else 'N/A'}")
-        return None, None
-    except Exception as e:
-        logging.error(f"An unexpected error occurred while getting upload details: {e}")
-        return None, None
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            rows = conn.execute("PRAGMA integrity_check").fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logging.error(f"Integrity check could not run on {db_path}: {e}")
+        return False
+    if rows == [("ok",)]:
+        return True
+    logging.error(f"Integrity check failed: {'; '.join(r[0] for r in rows[:10])}")
+    return False
+
 
-def upload_file(upload_url: str, session_id: str, user_type: str, file_path: str) -> bool:
+# --- Content-Defined Chunking ---
+
+def _sqlite_page_size(path: str) -> int:
+    """Reads the page size from the SQLite header (falls back to 4096)."""
+    with open(path, 'rb') as f:
+        header = f.read(100)
+    if len(header) < 18 or not header.startswith(b"SQLite format 3\x00"):
+        return 4096
+    size = int.from_bytes(header[16:18], "big")
+    return 65536 if size == 1 else size
+
+
+def iter_chunks(path: str, raw_hash=None):
     """
-    Uploads a file to the specified DDownload upload URL using API v2 parameters.
+    Splits a database file into content-defined chunks.
+
+    SQLite changes whole pages in place, so boundaries are only placed
+    between pages: a boundary falls after a page whose hash matches
+    CHUNK_BOUNDARY_MASK (with a minimum and maximum chunk length). Because
+    boundaries depend on content rather than offsets, a run of changed or
+    moved pages only alters the chunks around it and the rest deduplicate.
 
     Args:
-        upload_url: The URL obtained from get_upload_details.
-        session_id: The session ID obtained from get_upload_details.
-        user_type: The user type ('prem' or other, as required by API).
-        file_path: The path to the file to upload.
+        raw_hash: Optional hashlib object updated with the whole file.
+
+    Yields:
+        Raw chunk bytes.
+    """
+    page_size = _sqlite_page_size(path)
+    current = bytearray()
+    pages = 0
+    with open(path, 'rb') as f:
+        while True:
+            page = f.read(page_size)
+            if not page:
+                break
+            if raw_hash is not None:
+                raw_hash.update(page)
+            current += page
+            pages += 1
+            fingerprint = int.from_bytes(hashlib.blake2b(page, digest_size=8).digest(), "big")
+            if pages >= CHUNK_MAX_PAGES or (
+                pages >= CHUNK_MIN_PAGES and fingerprint & CHUNK_BOUNDARY_MASK == 0
+            ):
+                yield bytes(current)
+                current = bytearray()
+                pages = 0
+    if current:
+        yield bytes(current)
+
+
+def compress_chunk(data: bytes, compression: str) -> bytes:
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    # mtime=0 keeps the output deterministic.
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def decompress_chunk(data: bytes, compression: str) -> bytes:
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("This backup uses zstd; install the zstandard package to restore it.")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+# --- Local State (chunk index, manifests, resume markers) ---
+
+def _load_json(path: str, default):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except (OSError, json.JSONDecodeError) as e:
+        logging.warning(f"Ignoring unreadable file {path}: {e}")
+        return default
+
+
+def _write_json_atomic(path: str, data) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class ChunkIndex:
+    """
+    Local record of every chunk already stored remotely, keyed by the SHA-256
+    of its raw content. A backup run uploads only chunks missing from it.
+    Added chunks are saved in batches (every SAVE_EVERY_CHUNKS chunks or
+    SAVE_EVERY_SECONDS), so an interrupted run loses at most one batch and
+    re-uploads those chunks on resume; call flush() when a run ends.
+    """
+
+    SAVE_EVERY_CHUNKS = 64
+    SAVE_EVERY_SECONDS = 10
+
+    def __init__(self, backup_dir: str):
+        self.path = os.path.join(backup_dir, "chunk_index.json")
+        self.chunks = _load_json(self.path, {})
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+
+    def get(self, digest: str) -> dict | None:
+        return self.chunks.get(digest)
+
+    def add(self, digest: str, entry: dict) -> None:
+        self.chunks[digest] = entry
+        self._unsaved += 1
+        if (self._unsaved >= self.SAVE_EVERY_CHUNKS
+                or time.monotonic() - self._saved_at >= self.SAVE_EVERY_SECONDS):
+            self.save()
+
+    def remove(self, digest: str) -> None:
+        self.chunks.pop(digest, None)
+
+    def flush(self) -> None:
+        """Saves chunks added since the last save, if any."""
+        if self._unsaved:
+            self.save()
+
+    def save(self) -> None:
+        _write_json_atomic(self.path, self.chunks)
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+
+
+def _manifest_dir(backup_dir: str) -> str:
+    path = os.path.join(backup_dir, "manifests")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def list_manifests(backup_dir: str) -> list[dict]:
+    """All local manifests, oldest first."""
+    manifests = []
+    manifest_dir = _manifest_dir(backup_dir)
+    for name in os.listdir(manifest_dir):
+        if name.endswith(".manifest.json"):
+            manifest = _load_json(os.path.join(manifest_dir, name), None)
+            if manifest:
+                manifest["_path"] = os.path.join(manifest_dir, name)
+                manifests.append(manifest)
+    manifests.sort(key=lambda m: m["created_at"])
+    return manifests
+
+
+# --- Backup ---
+
+def chunk_locations(entry: dict) -> dict:
+    """
+    Where a chunk (or manifest) is stored, keyed by target spec. Entries
+    written before storage targets existed carry a bare DDownload filecode.
+    """
+    if "locations" in entry:
+        return entry["locations"]
+    if entry.get("filecode"):
+        return {"ddownload": {"filecode": entry["filecode"], "download": entry.get("download")}}
+    return {}
+
+
+def _store_chunk(storage: FanOutBackend, digest: str, data: bytes, entry: dict | None) -> dict | None:
+    """Compresses a chunk and writes it to the targets that lack it (runs in a worker)."""
+    if entry is None:
+        stored = compress_chunk(data, COMPRESSION)
+        entry = {"size": len(data), "stored_size": len(stored), "compression": COMPRESSION, "locations": {}}
+    else:
+        # Known chunk missing from a target: store it exactly as it was stored before
+        stored = compress_chunk(data, entry["compression"])
+        entry = {**entry, "locations": chunk_locations(entry)}
+        entry.pop("filecode", None)
+        entry.pop("download", None)
+    locations = storage.put(f"{digest}.chunk", stored, entry["locations"])
+    if locations is None:
+        return None
+    return {**entry, "locations": locations}
+
+
+def upload_backup(snapshot_path: str, storage: FanOutBackend, index: ChunkIndex,
+                  workers: int = BACKUP_UPLOAD_WORKERS) -> dict | None:
+    """
+    Chunks a snapshot, stores the chunks some target does not have yet
+    (compressed, named '<sha256>.chunk', `workers` at a time), then stores
+    the manifest on every target.
 
     Returns:
-        True if upload was successful (according to API response), False otherwise.
+        The manifest dict if every new chunk and the manifest were stored,
+        otherwise None (chunks that made it stay in the index, so the next
+        run picks up where this one stopped).
     """
-    # Upload URL does not need the API key according to v2 docs for the POST step
-    upload_api_url = upload_url
-    file_name = os.path.basename(file_path)
-    logging.info(f"Attempting to upload '{file_name}' to DDownload...")
-
-    # Prepare data payload with session ID and user type for v2
-    payload = {
-        'sess_id': session_id,
-        'utyp': user_type
-    }
+    backup_name = os.path.basename(snapshot_path)
+    raw_hash = hashlib.sha256()
+    digests = []
+    in_flight = {}  # future -> digest
+    new_chunks = new_bytes = 0
+    failed = False
+    started = time.monotonic()
+
+    def collect(block: bool) -> None:
+        nonlocal new_chunks, new_bytes, failed
+        done, _ = wait(in_flight, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in done:
+            digest = in_flight.pop(future)
+            try:
+                entry = future.result()
+            except Exception as e:
+                logging.error(f"Storing chunk {digest[:12]} failed: {e}")
+                entry = None
+            if entry is None:
+                failed = True
+                continue
+            index.add(digest, entry)  # Only this thread touches the index
+            new_chunks += 1
+            new_bytes += entry["stored_size"]
 
     try:
-        with open(file_path, 'rb') as f:
-            # Send file as multipart/form-data
-            files = {'files[]': (file_name, f)}
-            # Send sess_id and utyp in the 'data' part of the request
-            response = requests.post(upload_api_url, data=payload, files=files, timeout=300) # 5 minute timeout for upload
-            response.raise_for_status()
-
-        data = response.json()
-        # Log the raw response data to help with debugging
-        logging.info(f"Upload response received (raw JSON): {json.dumps(data)}")
-
-        # Check if the response data is a list and is not empty
-        if isinstance(data, list) and len(data) > 0:
-            # Assume the first element in the list contains the upload result info
-            first_item = data[0]
-            # --- FIX START v4 ---
-            # Check if the first item is a dictionary.
-            # Get file_status, provide default '', strip whitespace, and compare to 'OK'.
-            if isinstance(first_item, dict) and first_item.get('file_status', '').strip() == 'OK':
-            # --- FIX END v4 ---
-                # Consider successful if status is OK. Log filecode if available.
-                logging.info(f"Successfully uploaded file. Status: OK, File Code: {first_item.get('filecode', 'N/A')}, File URL: {first_item.get('download', 'N/A')}")
-                return True
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="backup-chunk") as pool:
+            for data in iter_chunks(snapshot_path, raw_hash):
+                digest = hashlib.sha256(data).hexdigest()
+                digests.append(digest)
+                entry = index.get(digest)
+                if entry is not None and not storage.missing(chunk_locations(entry)):
+                    continue
+                if digest in in_flight.values():
+                    continue  # Repeated within this snapshot
+                in_flight[pool.submit(_store_chunk, storage, digest, data, entry)] = digest
+                # Bound memory: never hold more than two chunks per worker
+                while len(in_flight) >= 2 * workers and not failed:
+                    collect(block=True)
+                if failed:
+                    break
+            while in_flight:
+                collect(block=True)
+    finally:
+        # Before the manifest, and also when the run stops early, so that
+        # the next one resumes from every chunk stored so far
+        index.flush()
+    if failed:
+        return None
+
+    manifest = {
+        "version": 3,
+        "backup_name": backup_name,
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "database_sha256": raw_hash.hexdigest(),
+        "database_size": os.path.getsize(snapshot_path),
+        "chunks": [{"sha256": digest, **index.get(digest)} for digest in digests],
+    }
+    manifest_bytes = json.dumps(manifest, indent=2).encode('utf-8')
+    manifest_locations = storage.put(f"{backup_name}.manifest.json", manifest_bytes)
+    if manifest_locations is None:
+        return None
+    # The local copy also records where the manifest itself went, for pruning
+    _write_json_atomic(
+        os.path.join(_manifest_dir(os.path.dirname(snapshot_path)), f"{backup_name}.manifest.json"),
+        {**manifest, "locations": manifest_locations},
+    )
+    manifest["_new_bytes"] = new_bytes  # Local only, like '_path'
+    elapsed = time.monotonic() - started
+    logging.info(
+        f"Backup {backup_name}: {len(digests)} chunks, {new_chunks} new "
+        f"({new_bytes} bytes stored for a {manifest['database_size']} byte database) "
+        f"in {elapsed:.1f}s ({_mb_per_s(manifest['database_size'], elapsed)})."
+    )
+    return manifest
+
+
+def _mb_per_s(size: int, seconds: float) -> str:
+    return f"{size / 1e6 / max(seconds, 1e-6):.1f} MB/s"
+
+
+def find_pending_snapshot(backup_dir: str) -> str | None:
+    """
+    Returns the newest snapshot left behind by an interrupted upload, if it is
+    recent enough to resume. Older leftovers are deleted. A snapshot is only
+    marked pending ('<snapshot>.pending') once it passed the integrity check.
+    """
+    pending = []
+    for name in os.listdir(backup_dir):
+        if name.endswith(".pending"):
+            snapshot_path = os.path.join(backup_dir, name[: -len(".pending")])
+            if os.path.exists(snapshot_path):
+                pending.append(snapshot_path)
             else:
-                # Status is not 'OK' or item is not a dict
-                logging.error(f"Upload response status is not OK or format is unexpected. Response item: {first_item}")
-                return False
-        # Fallback/Alternative: Check if the response is a dictionary (as previously assumed)
-        elif isinstance(data, dict) and data.get("msg") == "OK" and isinstance(data.get("result"), list) and len(data["result"]) > 0:
-             file_info = data["result"][0]
-             logging.info(f"Successfully uploaded file (dict format). File URL: {file_info.get('download', 'N/A')}, File Code: {file_info.get('filecode', 'N/A')}")
-             return True
-        # If neither list nor expected dictionary format, log as failure
-        else:
-            logging.error(f"Upload failed or API response format unexpected. Response: {data}")
-            return False
-
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Error during file upload request: {e}")
-        if hasattr(e, 'response') and e.response is not None:
-             # Attempt to log JSON error response if possible, otherwise text
+                os.remove(os.path.join(backup_dir, name))
+    pending.sort(key=os.path.getmtime, reverse=True)
+    resumable = None
+    for snapshot_path in pending:
+        age = time.time() - os.path.getmtime(snapshot_path)
+        if resumable is None and age < RESUME_MAX_AGE_HOURS * 3600:
+            resumable = snapshot_path
+            continue
+        logging.info(f"Discarding stale interrupted backup: {snapshot_path}")
+        for path in (snapshot_path, f"{snapshot_path}.pending"):
             try:
-                error_data = e.response.json()
-                logging.error(f"Upload Error Response Content: {json.dumps(error_data)}")
-            except json.JSONDecodeError:
-                logging.error(f"Upload Error Response Content (non-JSON): {e.response.text}")
-        return False
-    except FileNotFoundError:
-        logging.error(f"Backup file not found at: {file_path}")
-        return False
-    except json.JSONDecodeError as e:
-        # This catches errors if response.json() fails
-        logging.error(f"Error decoding JSON response after upload: {e}")
-        logging.error(f"Response text: {response.text if 'response' in locals() else 'N/A'}")
-        return False
-    except Exception as e:
-        # Catch any other unexpected errors during response processing
-        logging.error(f"An unexpected error occurred during upload response processing: {e}")
-        # Log the type of data that caused the error, if available
-        if 'data' in locals():
-            logging.error(f"Data type that caused error: {type(data)}, Data: {data}")
-        return False
+                os.remove(path)
+            except OSError:
+                pass
+    return resumable
 
-# --- Main Backup Logic ---
 
-def main():
+# --- Restore ---
+
+def restore_backup(manifest: dict, output_path: str, storage: FanOutBackend) -> None:
     """
-    Main function to perform the database backup and upload using API v2.
+    Streams the database of a manifest into `output_path` chunk by chunk,
+    verifying every chunk and the final file against their SHA-256.
+    Each chunk is read from the first target that has it.
     """
-    logging.info("--- Starting DDownload Backup Task (API v2) ---")
+    tmp_path = f"{output_path}.partial"
+    raw_hash = hashlib.sha256()
+    cache = {}
+    with open(tmp_path, 'wb') as out:
+        for position, entry in enumerate(manifest["chunks"], start=1):
+            digest = entry["sha256"]
+            data = cache.get(digest)
+            if data is None:
+                data = decompress_chunk(storage.get(chunk_locations(entry)), entry["compression"])
+                if hashlib.sha256(data).hexdigest() != digest:
+                    raise RuntimeError(f"Chunk {position} is corrupt (checksum mismatch)")
+                cache = {digest: data}  # Repeated chunks are usually adjacent
+            out.write(data)
+            raw_hash.update(data)
+    if raw_hash.hexdigest() != manifest["database_sha256"]:
+        os.remove(tmp_path)
+        raise RuntimeError("Restored database does not match the manifest checksum")
+    os.replace(tmp_path, output_path)
+    logging.info(f"Restored {manifest['backup_name']} to {output_path}.")
+
+
+# --- Retention ---
+
+def select_retained(manifests: list[dict], daily: int, weekly: int, monthly: int, last: int = 0) -> set[str]:
+    """
+    Grandfather-father-son retention: keeps the `last` most recent backups
+    and the newest backup of each of the last `daily` days, `weekly` ISO
+    weeks and `monthly` months.
 
-    # Resolve the absolute path for the database
-    # If DATABASE_PATH is relative (like 'instance/app.db'), it's resolved
-    # relative to the script's current working directory.
-    # Ensure this is the correct behavior for your setup.
-    abs_database_path = os.path.abspath(DATABASE_PATH)
-    logging.info(f"Attempting to back up database from: {abs_database_path}")
+    Returns:
+        The backup names to keep.
+    """
+    keep = set()
+    for count, period in (
+        (last, lambda d: d),
+        (daily, lambda d: d.date()),
+        (weekly, lambda d: d.isocalendar()[:2]),
+        (monthly, lambda d: (d.year, d.month)),
+    ):
+        seen = []
+        for manifest in sorted(manifests, key=lambda m: m["created_at"], reverse=True):
+            key = period(datetime.datetime.fromisoformat(manifest["created_at"]))
+            if key in seen:
+                continue
+            if len(seen) >= count:
+                break
+            seen.append(key)
+            keep.add(manifest["backup_name"])
+    return keep
+
+
+def prune_backups(backup_dir: str, index: ChunkIndex, storage: FanOutBackend,
+                  dry_run: bool = False) -> tuple[list[str], list[str]]:
+    """
+    Applies the retention policy to local manifests and drops chunks no
+    kept manifest references from the index.
 
+    Files of pruned backups are deleted from every target that supports
+    it; DDownload's API has no delete endpoint, so what remains there is
+    listed in 'pruned_files.json' for manual removal.
 
-    # 1. Validate Configuration
-    if DDOWNLOAD_API_KEY == "YOUR_DDOWNLOAD_API_KEY":
-        logging.error("DDownload API Key is not configured. Set DDOWNLOAD_API_KEY in environment or .env file.")
-        return
+    Returns:
+        (pruned backup names, pruned chunk digests)
+    """
+    manifests = list_manifests(backup_dir)
+    keep = select_retained(manifests, RETAIN_DAILY, RETAIN_WEEKLY, RETAIN_MONTHLY, RETAIN_LAST)
+    pruned = [m for m in manifests if m["backup_name"] not in keep]
+    referenced = {c["sha256"] for m in manifests if m["backup_name"] in keep for c in m["chunks"]}
+    orphaned = [digest for digest in index.chunks if digest not in referenced]
+    if dry_run:
+        return [m["backup_name"] for m in pruned], orphaned
+
+    pruned_files_path = os.path.join(backup_dir, "pruned_files.json")
+    pruned_files = _load_json(pruned_files_path, [])
+    for digest in orphaned:
+        left = storage.delete(chunk_locations(index.chunks[digest]))
+        if left:
+            pruned_files.append({"file": f"{digest}.chunk", "locations": left})
+        index.remove(digest)
+    index.save()
+    for manifest in pruned:
+        left = storage.delete(manifest.get("locations", {}))
+        if left or "locations" not in manifest:
+            pruned_files.append({"file": f"{manifest['backup_name']}.manifest.json", "locations": left})
+        os.remove(manifest["_path"])
+    _write_json_atomic(pruned_files_path, pruned_files)
+    logging.info(f"Retention: kept {len(keep)} backups, pruned {len(pruned)} backups and {len(orphaned)} chunks.")
+    return [m["backup_name"] for m in pruned], orphaned
 
-    if not os.path.exists(abs_database_path):
-        logging.error(f"Database file not found at resolved path: {abs_database_path}. Check DATABASE_PATH setting and script's working directory.")
-        return
 
-    # Use absolute path for backup dir if it's relative like 'tmp'
-    abs_backup_dir = os.path.abspath(BACKUP_DIR)
-    if not os.path.exists(abs_backup_dir):
-        try:
-            os.makedirs(abs_backup_dir)
-            logging.info(f"Created backup directory: {abs_backup_dir}")
-        except OSError as e:
-            logging.error(f"Could not create backup directory {abs_backup_dir}: {e}")
-            return
+# --- Main Backup Logic ---
+
+def _configured_storage(targets: str | None) -> FanOutBackend | None:
+    try:
+        return build_storage(targets or BACKUP_TARGETS, DDOWNLOAD_API_KEY, USER_TYPE,
+                             BACKUP_UPLOAD_WORKERS)
+    except ValueError as e:
+        logging.error(f"Invalid backup target configuration: {e}")
+        return None
+
+
+def read_status(backup_dir: str) -> dict:
+    """Outcome of recent runs ('backup_status.json'), for monitoring and scheduling."""
+    return _load_json(os.path.join(backup_dir, "backup_status.json"), {})
+
+
+def _write_status(backup_dir: str, started_at: datetime.datetime, duration: float,
+                  manifest: dict | None, error: str | None) -> None:
+    status = read_status(backup_dir)
+    status.update({
+        "last_attempt_at": started_at.isoformat(timespec="seconds"),
+        "last_attempt_ok": manifest is not None,
+        "last_attempt_duration_seconds": round(duration, 2),
+        "last_error": error,
+    })
+    if manifest is not None:
+        status.update({
+            "last_success_at": started_at.isoformat(timespec="seconds"),
+            "last_success_duration_seconds": round(duration, 2),
+            "last_backup_name": manifest["backup_name"],
+            "last_database_bytes": manifest["database_size"],
+            "last_stored_bytes": manifest["_new_bytes"],
+            "last_chunks": len(manifest["chunks"]),
+            "consecutive_failures": 0,
+        })
     else:
-        logging.info(f"Using existing backup directory: {abs_backup_dir}")
+        status["consecutive_failures"] = status.get("consecutive_failures", 0) + 1
+    try:
+        _write_json_atomic(os.path.join(backup_dir, "backup_status.json"), status)
+    except OSError as e:
+        logging.warning(f"Could not write backup status: {e}")
+
 
+def run_backup(database_path: str, backup_dir: str, targets: str | None = None) -> bool:
+    """
+    Takes, stores and prunes one backup; records the outcome in
+    'backup_status.json'.
 
-    # 2. Create Timestamped Backup Copy
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    # Use the original DATABASE_PATH to get the base filename
-    db_filename = os.path.basename(DATABASE_PATH)
-    backup_filename = f"{os.path.splitext(db_filename)[0]}_backup_{timestamp}{os.path.splitext(db_filename)[1]}"
-    backup_filepath = os.path.join(abs_backup_dir, backup_filename) # Use absolute path for backup dir
+    Args:
+        database_path: Absolute path of the live database.
+        backup_dir: Absolute path for snapshots, the chunk index and manifests.
+        targets: Storage target specs (default: BACKUP_TARGETS).
 
+    Returns:
+        True if the backup was stored on every target.
+    """
+    started_at = datetime.datetime.now()
+    started = time.monotonic()
+    manifest = None
+    error = None
     try:
-        logging.info(f"Creating temporary backup copy: {backup_filepath}")
-        # Copy from the resolved absolute database path
-        shutil.copy2(abs_database_path, backup_filepath) # Use copy2 to preserve metadata
-        logging.info("Backup copy created successfully.")
+        manifest = _run_backup(database_path, backup_dir, targets)
+        if manifest is None:
+            error = "backup failed, see log"
     except Exception as e:
-        logging.error(f"Failed to create backup copy: {e}")
-        # Clean up potentially partially created backup file
-        if os.path.exists(backup_filepath):
-             try:
-                 os.remove(backup_filepath)
-             except OSError:
-                 pass # Ignore error during cleanup after another error
-        return # Stop if we can't copy the file
-
-    # 3. Get DDownload Upload Details (URL and Session ID)
-    upload_url, session_id = get_upload_details(DDOWNLOAD_API_KEY)
-    if not upload_url or not session_id:
-        logging.error("Failed to get upload URL or session ID. Aborting backup.")
-        # Clean up temporary file even if API call fails
+        logging.error(f"Backup failed: {e}", exc_info=True)
+        error = str(e)
+    if os.path.isdir(backup_dir):
+        _write_status(backup_dir, started_at, time.monotonic() - started, manifest, error)
+    return manifest is not None
+
+
+def _run_backup(database_path: str, backup_dir: str, targets: str | None) -> dict | None:
+    logging.info("--- Starting Backup Task ---")
+    logging.info(f"Attempting to back up database from: {database_path}")
+
+    # 1. Validate Configuration
+    storage = _configured_storage(targets)
+    if storage is None:
+        return None
+    logging.info(f"Backup targets: {', '.join(storage.specs)}")
+
+    if not os.path.exists(database_path):
+        logging.error(f"Database file not found at resolved path: {database_path}. Check DATABASE_PATH setting and script's working directory.")
+        return None
+
+    if not os.path.exists(backup_dir):
         try:
-            if os.path.exists(backup_filepath): # Check if file exists before removing
-                 os.remove(backup_filepath)
-                 logging.info(f"Removed temporary backup file: {backup_filepath}")
+            os.makedirs(backup_dir)
+            logging.info(f"Created backup directory: {backup_dir}")
         except OSError as e:
-            logging.warning(f"Could not remove temporary backup file {backup_filepath}: {e}")
-        return
+            logging.error(f"Could not create backup directory {backup_dir}: {e}")
+            return None
+    else:
+        logging.info(f"Using existing backup directory: {backup_dir}")
 
-    # 4. Upload the Backup File using API v2 details
-    upload_successful = upload_file(upload_url, session_id, USER_TYPE, backup_filepath)
 
-    # 5. Clean Up Temporary Backup File
-    try:
-        if os.path.exists(backup_filepath): # Check if file exists before removing
-            os.remove(backup_filepath)
+    # 2. Resume an interrupted upload, or create a new timestamped snapshot
+    backup_filepath = find_pending_snapshot(backup_dir)
+    if backup_filepath:
+        logging.info(f"Found interrupted backup to resume: {backup_filepath}")
+    else:
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        db_filename = os.path.basename(database_path)
+        backup_filename = f"{os.path.splitext(db_filename)[0]}_backup_{timestamp}{os.path.splitext(db_filename)[1]}"
+        backup_filepath = os.path.join(backup_dir, backup_filename)
+        try:
+            logging.info(f"Creating temporary backup snapshot: {backup_filepath}")
+            started = time.monotonic()
+            create_snapshot(database_path, backup_filepath)
+            logging.info(f"Backup snapshot created in {time.monotonic() - started:.1f}s.")
+            if not check_integrity(backup_filepath):
+                raise RuntimeError("snapshot failed the integrity check")
+            logging.info("Backup snapshot passed the integrity check.")
+            open(f"{backup_filepath}.pending", 'w').close() # Resumable from here on
+        except Exception as e:
+            logging.error(f"Failed to create backup snapshot: {e}")
+            # Clean up potentially partially created backup file
+            if os.path.exists(backup_filepath):
+                 try:
+                     os.remove(backup_filepath)
+                 except OSError:
+                     pass # Ignore error during cleanup after another error
+            return None # Stop if we can't copy the file
+
+    # 3. Chunk and store the chunks some target does not have yet (in parallel, with retries)
+    index = ChunkIndex(backup_dir)
+    manifest = upload_backup(backup_filepath, storage, index)
+    upload_successful = manifest is not None
+
+    # 4. Clean Up Temporary Backup File (kept after a failure so the next run can resume)
+    if upload_successful:
+        try:
+            for path in (backup_filepath, f"{backup_filepath}.pending"):
+                if os.path.exists(path): # Check if file exists before removing
+                    os.remove(path)
             logging.info(f"Removed temporary backup file: {backup_filepath}")
-    except OSError as e:
-        # Log a warning if cleanup fails, but don't treat it as a critical error
-        logging.warning(f"Could not remove temporary backup file {backup_filepath}: {e}")
+        except OSError as e:
+            # Log a warning if cleanup fails, but don't treat it as a critical error
+            logging.warning(f"Could not remove temporary backup file {backup_filepath}: {e}")
+    else:
+        logging.info(f"Keeping {backup_filepath} so the next run can resume the upload.")
 
-    # 6. Final Status Log
+    # 5. Final Status Log
     if upload_successful:
-        logging.info("--- DDownload Backup Task (API v2) Completed Successfully ---")
+        logging.info("--- Backup Task Completed Successfully ---")
     else:
-        logging.error("--- DDownload Backup Task (API v2) Failed ---")
+        logging.error("--- Backup Task Failed ---")
+
+    # 6. Retention (only after a successful backup, so a failing job never prunes)
+    if upload_successful:
+        try:
+            prune_backups(backup_dir, index, storage)
+        except Exception as e:
+            logging.warning(f"Retention failed (the backup itself is stored): {e}")
+    return manifest
+
+
+def main():
+    """
+    Script entry point. Relative DATABASE_PATH / BACKUP_DIR are resolved
+    against the working directory; `flask backup run` uses the app's paths.
+    """
+    run_backup(os.path.abspath(DATABASE_PATH), os.path.abspath(BACKUP_DIR))
+
+
+def restore_main(manifest_path: str, output_path: str, targets: str | None = None) -> bool:
+    """Restores a database from a manifest file (local or downloaded)."""
+    manifest = _load_json(manifest_path, None)
+    if not manifest:
+        logging.error(f"Manifest not found or unreadable: {manifest_path}")
+        return False
+    if os.path.exists(output_path):
+        logging.error(f"Refusing to overwrite existing file: {output_path}")
+        return False
+    storage = _configured_storage(targets)
+    if storage is None:
+        return False
+    started = time.monotonic()
+    try:
+        restore_backup(manifest, output_path, storage)
+    except Exception as e:
+        logging.error(f"Restore failed: {e}")
+        return False
+    logging.info(f"Restore took {time.monotonic() - started:.1f}s "
+                 f"({_mb_per_s(manifest['database_size'], time.monotonic() - started)}).")
+    return check_integrity(output_path)
+
+
+def verify_main(manifest_path: str | None, targets: str | None = None) -> bool:
+    """
+    Restores a backup (the newest one by default) into a temporary file and
+    runs the integrity check on it, proving the stored copy is usable.
+    """
+    if manifest_path is None:
+        manifests = list_manifests(os.path.abspath(BACKUP_DIR))
+        if not manifests:
+            logging.error("No backups to verify.")
+            return False
+        manifest_path = manifests[-1]["_path"]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        ok = restore_main(manifest_path, os.path.join(tmp_dir, "verify.db"), targets)
+    logging.info(f"Verification of {os.path.basename(manifest_path)} {'passed' if ok else 'FAILED'}.")
+    return ok
+
+
+def bench_main(workers: int = BACKUP_UPLOAD_WORKERS) -> bool:
+    """
+    Measures the pipeline on this machine without touching real targets:
+    snapshot, chunk + compress + store into a temporary local target, then
+    restore and compare checksums. A second backup of the unchanged
+    database shows the deduplicated (incremental) cost.
+    """
+    abs_database_path = os.path.abspath(DATABASE_PATH)
+    if not os.path.exists(abs_database_path):
+        logging.error(f"Database file not found: {abs_database_path}")
+        return False
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = FanOutBackend([LocalBackend("local:bench", os.path.join(tmp_dir, "target"))], workers)
+        index = ChunkIndex(tmp_dir)
+        snapshot_path = os.path.join(tmp_dir, os.path.basename(abs_database_path))
+        size = os.path.getsize(abs_database_path)
+
+        started = time.monotonic()
+        create_snapshot(abs_database_path, snapshot_path, step_sleep=0)
+        print(f"snapshot        {time.monotonic() - started:7.2f}s  {_mb_per_s(size, time.monotonic() - started)}")
+        size = os.path.getsize(snapshot_path)
+
+        for label in ("full backup", "incremental"):
+            started = time.monotonic()
+            manifest = upload_backup(snapshot_path, storage, index, workers)
+            elapsed = time.monotonic() - started
+            if manifest is None:
+                logging.error(f"Bench {label} failed.")
+                return False
+            print(f"{label:<15} {elapsed:7.2f}s  {_mb_per_s(size, elapsed)}")
 
-    # --- Placeholder for Cleanup Logic ---
-    # TODO: Implement cleanup logic here if/when the delete file API endpoint is known.
-    # Requires: list_files(), parse filenames, sort by date, delete_file(file_code)
+        stored = sum(entry["stored_size"] for entry in index.chunks.values())
+        print(f"stored          {stored} of {size} bytes ({COMPRESSION}, {len(index.chunks)} chunks, {workers} workers)")
+
+        restored_path = os.path.join(tmp_dir, "restored.db")
+        started = time.monotonic()
+        restore_backup(manifest, restored_path, storage)
+        elapsed = time.monotonic() - started
+        ok = check_integrity(restored_path)
+        print(f"restore         {elapsed:7.2f}s  {_mb_per_s(size, elapsed)}  {'OK' if ok else 'INTEGRITY CHECK FAILED'}")
+    return ok
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Back up the SQLite database to the configured storage targets.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("backup", help="Take and store a backup (default)")
+    restore_parser = subparsers.add_parser("restore", help="Rebuild a database from a manifest")
+    restore_parser.add_argument("manifest", help="Path to a .manifest.json file")
+    restore_parser.add_argument("output", help="Where to write the restored database")
+    restore_parser.add_argument("--targets", help="Targets to read from (default: BACKUP_TARGETS)")
+    verify_parser = subparsers.add_parser("verify", help="Restore a backup to a temporary file and check it")
+    verify_parser.add_argument("manifest", nargs="?", help="Manifest to verify (default: newest)")
+    verify_parser.add_argument("--targets", help="Targets to read from (default: BACKUP_TARGETS)")
+    bench_parser = subparsers.add_parser("bench", help="Measure backup and restore throughput locally")
+    bench_parser.add_argument("--workers", type=int, default=BACKUP_UPLOAD_WORKERS)
+    prune_parser = subparsers.add_parser("prune", help="Apply the retention policy")
+    prune_parser.add_argument("--dry-run", action="store_true", help="Only list what would be pruned")
+    subparsers.add_parser("list", help="List local backup manifests")
+    args = parser.parse_args()
+    setup_logging()
+
+    if args.command == "restore":
+        sys.exit(0 if restore_main(args.manifest, args.output, args.targets) else 1)
+    elif args.command == "verify":
+        sys.exit(0 if verify_main(args.manifest, args.targets) else 1)
+    elif args.command == "bench":
+        sys.exit(0 if bench_main(args.workers) else 1)
+    elif args.command == "prune":
+        backup_dir = os.path.abspath(BACKUP_DIR)
+        storage = _configured_storage(None)
+        if storage is None:
+            sys.exit(1)
+        pruned, orphaned = prune_backups(backup_dir, ChunkIndex(backup_dir), storage, dry_run=args.dry_run)
+        for name in pruned:
+            print(f"{'would prune' if args.dry_run else 'pruned'}: {name}")
+        print(f"{len(orphaned)} unreferenced chunks")
+    elif args.command == "list":
+        for manifest in list_manifests(os.path.abspath(BACKUP_DIR)):
+            print(f"{manifest['created_at']}  {manifest['backup_name']}  "
+                  f"{manifest['database_size']} bytes  {len(manifest['chunks'])} chunks  {manifest['_path']}")
+    else:
+        main()
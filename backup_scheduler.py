@@ -0,0 +1,278 @@
+# backup_scheduler.py
+# Runs backup.py from the app: `flask backup ...` commands and a scheduler
+# that waits for a write-quiet window before taking the snapshot.
+#
+# Write activity is read from the audit log (every content change, comment,
+# assignment and live-edit flush writes a row). A backup becomes due
+# BACKUP_INTERVAL_HOURS after the last success; it then starts as soon as no
+# write has been logged for BACKUP_QUIET_SECONDS, or after
+# BACKUP_MAX_DELAY_HOURS of waiting when the app never goes quiet.
+#
+# The scheduler runs as a daemon thread inside the app (BACKUP_SCHEDULER=thread)
+# or as a sidecar process (`flask backup scheduler`). A lock file in the
+# backup directory keeps two processes from backing up at the same time.
+
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import func
+
+import backup
+from models import db, AuditLog
+
+try:
+    import fcntl  # Not available on Windows; the lock is skipped there
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Audit actions that do not change data worth backing up
+READ_ONLY_ACTIONS = ("login", "login_failed", "logout")
+
+CHECK_INTERVAL_SECONDS = 60
+RETRY_BASE_MINUTES = 15
+
+
+def last_write_at():
+    """Time (UTC) of the newest audit entry that records a write, or None."""
+    return (
+        db.session.query(func.max(AuditLog.timestamp))
+        .filter(AuditLog.action.notin_(READ_ONLY_ACTIONS))
+        .scalar()
+    )
+
+
+class BackupScheduler:
+    def __init__(self):
+        self._app = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+        self._running = threading.Lock()
+        self.waiting_since = None  # When the current due backup started waiting for quiet
+        self._tasks = []
+
+    def init_app(self, app):
+        self._app = app
+        app.config.setdefault("BACKUP_SCHEDULER", os.environ.get("BACKUP_SCHEDULER", "off"))
+        app.config.setdefault("BACKUP_INTERVAL_HOURS", float(os.environ.get("BACKUP_INTERVAL_HOURS", "24")))
+        app.config.setdefault("BACKUP_QUIET_SECONDS", int(os.environ.get("BACKUP_QUIET_SECONDS", "300")))
+        app.config.setdefault("BACKUP_MAX_DELAY_HOURS", float(os.environ.get("BACKUP_MAX_DELAY_HOURS", "6")))
+        # Relative BACKUP_DIR is taken relative to the instance folder, not the working directory
+        app.config.setdefault(
+            "BACKUP_DIR",
+            os.path.join(app.instance_path, os.environ.get("BACKUP_DIR", "backups")),
+        )
+        app.extensions["backup_scheduler"] = self
+        app.cli.add_command(backup_cli)
+        if app.config["BACKUP_SCHEDULER"] == "thread":
+            # Started lazily so CLI commands and the reloader parent never run it
+            app.before_request(self._ensure_thread)
+
+    def add_task(self, name, func):
+        """Registers maintenance work that runs (in an app context) right
+        before each backup, so it uses the same quiet window and its writes
+        are part of the backup. Registering a name again replaces it."""
+        self._tasks = [task for task in self._tasks if task[0] != name]
+        self._tasks.append((name, func))
+
+    def _run_tasks(self):
+        for name, func in self._tasks:
+            try:
+                func()
+            except Exception:
+                db.session.rollback()
+                logger.exception("Maintenance task %s failed", name)
+
+    # --- Paths ---
+    @property
+    def backup_dir(self):
+        return self._app.config["BACKUP_DIR"]
+
+    def database_path(self):
+        return os.path.abspath(db.engine.url.database)
+
+    # --- Scheduling ---
+    def next_due_at(self, status):
+        """When the next backup is due; None when none was ever taken (due now)."""
+        last = status.get("last_success_at")
+        due = (
+            datetime.fromisoformat(last)
+            + timedelta(hours=self._app.config["BACKUP_INTERVAL_HOURS"])
+            if last
+            else None
+        )
+        failures = status.get("consecutive_failures", 0)
+        if failures and status.get("last_attempt_at"):
+            # Back off after failures instead of retrying every check
+            retry = timedelta(minutes=RETRY_BASE_MINUTES * 2 ** min(failures - 1, 5))
+            retry_at = datetime.fromisoformat(status["last_attempt_at"]) + retry
+            due = max(due, retry_at) if due else retry_at
+        return due
+
+    def quiet_for(self):
+        """Seconds since the last logged write (None when nothing was ever written)."""
+        last = last_write_at()
+        db.session.remove()
+        if last is None:
+            return None
+        return (datetime.utcnow() - last).total_seconds()
+
+    def should_run(self, now=None):
+        """True when a backup is due and the app is quiet (or has waited too long)."""
+        now = now or datetime.now()
+        due = self.next_due_at(backup.read_status(self.backup_dir))
+        if due is not None and now < due:
+            self.waiting_since = None
+            return False
+        if self.waiting_since is None:
+            self.waiting_since = now
+        quiet = self.quiet_for()
+        if quiet is None or quiet >= self._app.config["BACKUP_QUIET_SECONDS"]:
+            return True
+        waited = (now - self.waiting_since).total_seconds()
+        if waited >= self._app.config["BACKUP_MAX_DELAY_HOURS"] * 3600:
+            logger.warning(
+                "No quiet window for %.1f hours; backing up during write activity.",
+                waited / 3600,
+            )
+            return True
+        return False
+
+    def run_once(self):
+        """
+        Runs one backup unless another thread or process is running one.
+
+        Returns:
+            True/False for the backup result, None if it was skipped.
+        """
+        os.makedirs(self.backup_dir, exist_ok=True)
+        if not self._running.acquire(blocking=False):
+            return None
+        try:
+            with open(os.path.join(self.backup_dir, "backup.lock"), "w") as lock_file:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        logger.info("Another process is taking a backup; skipping.")
+                        return None
+                self._run_tasks()
+                ok = backup.run_backup(self.database_path(), self.backup_dir)
+            self.waiting_since = None
+            return ok
+        finally:
+            self._running.release()
+
+    def tick(self):
+        with self._app.app_context():
+            if self.should_run():
+                self.run_once()
+
+    def run_forever(self):
+        while True:
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("Backup scheduler check failed")
+            if self._stop.wait(CHECK_INTERVAL_SECONDS):
+                return
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self.run_forever, name="backup-scheduler", daemon=True
+                )
+                self._thread.start()
+
+    # --- Metrics ---
+    def status(self):
+        """Last run outcome plus scheduler state, for the admin metrics endpoint."""
+        status = backup.read_status(self.backup_dir)
+        last_write = last_write_at()
+        next_due = self.next_due_at(status)
+        status.update(
+            {
+                "scheduler": self._app.config["BACKUP_SCHEDULER"],
+                "next_due_at": next_due.isoformat(timespec="seconds") if next_due else None,
+                "waiting_since": self.waiting_since.isoformat(timespec="seconds")
+                if self.waiting_since
+                else None,
+                "last_write_at": last_write.isoformat(timespec="seconds") + "Z"
+                if last_write
+                else None,
+                "running": self._running.locked(),
+            }
+        )
+        if status.get("last_success_at"):
+            status["seconds_since_success"] = int(
+                (datetime.now() - datetime.fromisoformat(status["last_success_at"])).total_seconds()
+            )
+        return status
+
+
+backup_scheduler = BackupScheduler()
+
+
+# --- CLI: flask backup ... ---
+backup_cli = AppGroup("backup", help="Database backups (see backup.py).")
+
+
+@backup_cli.command("run")
+@click.option("--wait-quiet", is_flag=True, help="Wait for a write-quiet window first.")
+def backup_run_command(wait_quiet):
+    """Takes a backup now."""
+    backup.setup_logging()
+    while wait_quiet:
+        quiet = backup_scheduler.quiet_for()
+        needed = current_app.config["BACKUP_QUIET_SECONDS"]
+        if quiet is None or quiet >= needed:
+            break
+        click.echo(f"Last write {quiet:.0f}s ago; waiting for {needed}s of quiet...")
+        time.sleep(min(CHECK_INTERVAL_SECONDS, needed - quiet))
+    result = backup_scheduler.run_once()
+    if result is None:
+        raise click.ClickException("Another backup is already running.")
+    if not result:
+        raise click.ClickException("Backup failed, see the log above.")
+    click.echo("Backup stored.")
+
+
+@backup_cli.command("scheduler")
+def backup_scheduler_command():
+    """Runs the scheduler in the foreground (sidecar process)."""
+    backup.setup_logging()
+    click.echo(
+        f"Backup scheduler: every {current_app.config['BACKUP_INTERVAL_HOURS']}h, "
+        f"after {current_app.config['BACKUP_QUIET_SECONDS']}s without writes."
+    )
+    backup_scheduler.run_forever()
+
+
+@backup_cli.command("status")
+def backup_status_command():
+    """Prints the last backup outcome and scheduler state as JSON."""
+    click.echo(json.dumps(backup_scheduler.status(), indent=2, ensure_ascii=False))
+
+
+@backup_cli.command("verify")
+def backup_verify_command():
+    """Restores the newest backup to a temporary file and checks it."""
+    backup.setup_logging()
+    manifests = backup.list_manifests(backup_scheduler.backup_dir)
+    if not manifests:
+        raise click.ClickException("No backups to verify.")
+    if not backup.verify_main(manifests[-1]["_path"]):
+        raise click.ClickException("Verification failed.")
+    click.echo(f"{manifests[-1]['backup_name']} verified.")
@@ -0,0 +1,402 @@
+# backup_storage.py
+# Storage targets for backup.py: where chunks and manifests are written to
+# and read back from.
+#
+# A backend stores named blobs and returns a small JSON-serializable
+# "location" for each; manifests and the chunk index keep one location per
+# target, keyed by the target's spec string ("ddownload", "local:/mnt/nas").
+
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+UPLOAD_TIMEOUT = int(os.environ.get("BACKUP_UPLOAD_TIMEOUT", "120")) # Per chunk
+UPLOAD_RETRIES = int(os.environ.get("BACKUP_UPLOAD_RETRIES", "5"))
+UPLOAD_RETRY_BASE_DELAY = float(os.environ.get("BACKUP_UPLOAD_RETRY_DELAY", "5"))
+
+
+class StorageBackend:
+    """Interface of a backup target."""
+
+    def __init__(self, spec: str):
+        self.spec = spec
+
+    def put(self, name: str, data: bytes) -> dict | None:
+        """Stores a blob. Returns its location, or None on failure."""
+        raise NotImplementedError
+
+    def get(self, location: dict) -> bytes:
+        """Reads a blob back. Raises on failure."""
+        raise NotImplementedError
+
+    def delete(self, location: dict) -> bool:
+        """Removes a blob. Returns False when the target cannot delete."""
+        return False
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.spec}>"
+
+
+# --- Local directory (disk, NAS mount) ---
+
+class LocalBackend(StorageBackend):
+    def __init__(self, spec: str, root: str):
+        super().__init__(spec)
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        # Blob names are generated by backup.py; never let one escape the root.
+        if os.path.basename(name) != name or name in ("", ".", ".."):
+            raise ValueError(f"Invalid blob name: {name!r}")
+        return os.path.join(self.root, name)
+
+    def put(self, name: str, data: bytes) -> dict | None:
+        path = self._path(name)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.error(f"Could not write {path}: {e}")
+            return None
+        return {"name": name}
+
+    def get(self, location: dict) -> bytes:
+        with open(self._path(location["name"]), 'rb') as f:
+            return f.read()
+
+    def delete(self, location: dict) -> bool:
+        try:
+            os.remove(self._path(location["name"]))
+        except FileNotFoundError:
+            pass
+        return True
+
+
+# --- DDownload (API v2) ---
+
+def get_upload_details(api_key: str) -> tuple[str | None, str | None]:
+    """
+    Gets an upload server URL and session ID from the DDownload API v2.
+
+    Args:
+        api_key: Your DDownload API key.
+
+    Returns:
+        A tuple containing (upload_url, session_id) if successful,
+        otherwise (None, None).
+    """
+    # Use the v2 API endpoint
+    api_url = f"https://api-v2.ddownload.com/api/upload/server?key={api_key}"
+    logging.info("Requesting upload server and session ID from DDownload API v2...")
+    try:
+        response = requests.get(api_url, timeout=30) # 30 second timeout
+        response.raise_for_status() # Raise an exception for bad status codes (4xx or 5xx)
+
+        data = response.json()
+        # Check the response structure based on v2 docs
+        if data.get("msg") == "OK" and data.get("result") and data.get("sess_id"):
+            upload_url = data["result"]
+            session_id = data["sess_id"]
+            logging.info(f"Successfully obtained upload URL: {upload_url[:30]}... and session ID.")
+            return upload_url, session_id
+        else:
+            logging.error(f"Failed to get upload details. API Response: {data}")
+            return None, None
+
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Error requesting upload server: {e}")
+        return None, None
+    except json.JSONDecodeError as e:
+        logging.error(f"Error decoding JSON response from API: {e}")
+        logging.error(f"Response text: {response.text if 'response' in locals() else 'N/A'}")
+        return None, None
+    except Exception as e:
+        logging.error(f"An unexpected error occurred while getting upload details: {e}")
+        return None, None
+
+
+def upload_blob(upload_url: str, session_id: str, user_type: str, file_name: str, data: bytes) -> dict | None:
+    """
+    Uploads in-memory data as one file to the specified DDownload upload URL using API v2 parameters.
+
+    Args:
+        upload_url: The URL obtained from get_upload_details.
+        session_id: The session ID obtained from get_upload_details.
+        user_type: The user type ('prem' or other, as required by API).
+        file_name: Name the file gets on DDownload.
+        data: File contents.
+
+    Returns:
+        A dict with 'filecode' and 'download' if the upload was successful
+        (according to API response), None otherwise.
+    """
+    # Upload URL does not need the API key according to v2 docs for the POST step
+    upload_api_url = upload_url
+    logging.info(f"Attempting to upload '{file_name}' ({len(data)} bytes) to DDownload...")
+
+    # Prepare data payload with session ID and user type for v2
+    payload = {
+        'sess_id': session_id,
+        'utyp': user_type
+    }
+
+    try:
+        # Send file as multipart/form-data
+        files = {'files[]': (file_name, data)}
+        # Send sess_id and utyp in the 'data' part of the request
+        response = requests.post(upload_api_url, data=payload, files=files, timeout=UPLOAD_TIMEOUT)
+        response.raise_for_status()
+
+        data = response.json()
+        # Log the raw response data to help with debugging
+        logging.info(f"Upload response received (raw JSON): {json.dumps(data)}")
+
+        # Check if the response data is a list and is not empty
+        if isinstance(data, list) and len(data) > 0:
+            # Assume the first element in the list contains the upload result info
+            first_item = data[0]
+            # --- FIX START v4 ---
+            # Check if the first item is a dictionary.
+            # Get file_status, provide default '', strip whitespace, and compare to 'OK'.
+            if isinstance(first_item, dict) and first_item.get('file_status', '').strip() == 'OK':
+            # --- FIX END v4 ---
+                # Consider successful if status is OK. Log filecode if available.
+                logging.info(f"Successfully uploaded file. Status: OK, File Code: {first_item.get('filecode', 'N/A')}, File URL: {first_item.get('download', 'N/A')}")
+                return {'filecode': first_item.get('filecode'), 'download': first_item.get('download')}
+            else:
+                # Status is not 'OK' or item is not a dict
+                logging.error(f"Upload response status is not OK or format is unexpected. Response item: {first_item}")
+                return None
+        # Fallback/Alternative: Check if the response is a dictionary (as previously assumed)
+        elif isinstance(data, dict) and data.get("msg") == "OK" and isinstance(data.get("result"), list) and len(data["result"]) > 0:
+             file_info = data["result"][0]
+             logging.info(f"Successfully uploaded file (dict format). File URL: {file_info.get('download', 'N/A')}, File Code: {file_info.get('filecode', 'N/A')}")
+             return {'filecode': file_info.get('filecode'), 'download': file_info.get('download')}
+        # If neither list nor expected dictionary format, log as failure
+        else:
+            logging.error(f"Upload failed or API response format unexpected. Response: {data}")
+            return None
+
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Error during file upload request: {e}")
+        if hasattr(e, 'response') and e.response is not None:
+             # Attempt to log JSON error response if possible, otherwise text
+            try:
+                error_data = e.response.json()
+                logging.error(f"Upload Error Response Content: {json.dumps(error_data)}")
+            except json.JSONDecodeError:
+                logging.error(f"Upload Error Response Content (non-JSON): {e.response.text}")
+        return None
+    except json.JSONDecodeError as e:
+        # This catches errors if response.json() fails
+        logging.error(f"Error decoding JSON response after upload: {e}")
+        logging.error(f"Response text: {response.text if 'response' in locals() else 'N/A'}")
+        return None
+    except Exception as e:
+        # Catch any other unexpected errors during response processing
+        logging.error(f"An unexpected error occurred during upload response processing: {e}")
+        # Log the type of data that caused the error, if available
+        if 'data' in locals():
+            logging.error(f"Data type that caused error: {type(data)}")
+        return None
+
+
+class DDownloadBackend(StorageBackend):
+    """
+    Uploads files to DDownload with retries, fetching a fresh upload server
+    and session whenever an attempt fails. The API has no delete endpoint.
+    Chunks are uploaded from several threads, which share the upload server.
+    """
+
+    def __init__(self, spec: str, api_key: str, user_type: str):
+        super().__init__(spec)
+        self.api_key = api_key
+        self.user_type = user_type
+        self.upload_url = None
+        self.session_id = None
+        self._server_lock = threading.Lock()
+
+    def _upload_server(self) -> tuple[str | None, str | None]:
+        """The shared upload server and session, fetched once for all threads."""
+        with self._server_lock:
+            if not self.upload_url:
+                self.upload_url, self.session_id = get_upload_details(self.api_key)
+            return self.upload_url, self.session_id
+
+    def _drop_upload_server(self, upload_url: str):
+        with self._server_lock:
+            # Unless another thread has already moved on to a fresh one
+            if self.upload_url == upload_url:
+                self.upload_url = self.session_id = None
+
+    def put(self, name: str, data: bytes) -> dict | None:
+        for attempt in range(1, UPLOAD_RETRIES + 1):
+            upload_url, session_id = self._upload_server()
+            if upload_url:
+                result = upload_blob(upload_url, session_id, self.user_type, name, data)
+                if result:
+                    return result
+                self._drop_upload_server(upload_url)  # Retry on a fresh server
+            if attempt < UPLOAD_RETRIES:
+                delay = UPLOAD_RETRY_BASE_DELAY * 2 ** (attempt - 1)
+                logging.warning(f"Upload of '{name}' failed (attempt {attempt}/{UPLOAD_RETRIES}); retrying in {delay:.0f}s.")
+                time.sleep(delay)
+        logging.error(f"Giving up on '{name}' after {UPLOAD_RETRIES} attempts.")
+        return None
+
+    def get(self, location: dict) -> bytes:
+        file_code = location["filecode"]
+        for attempt in range(1, UPLOAD_RETRIES + 1):
+            url = get_download_link(self.api_key, file_code)
+            if url:
+                try:
+                    response = requests.get(url, timeout=UPLOAD_TIMEOUT)
+                    response.raise_for_status()
+                    return response.content
+                except requests.exceptions.RequestException as e:
+                    logging.warning(f"Download of {file_code} failed: {e}")
+            if attempt < UPLOAD_RETRIES:
+                time.sleep(UPLOAD_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+        raise RuntimeError(f"Could not download {file_code}")
+
+
+def get_download_link(api_key: str, file_code: str) -> str | None:
+    """Asks DDownload for a direct download link of an uploaded file."""
+    api_url = f"https://api-v2.ddownload.com/api/file/direct_link?key={api_key}&file_code={file_code}"
+    try:
+        response = requests.get(api_url, timeout=30)
+        response.raise_for_status()
+        data = response.json()
+        if data.get("msg") == "OK" and isinstance(data.get("result"), dict):
+            return data["result"].get("url")
+        logging.error(f"Failed to get a download link for {file_code}. API Response: {data}")
+    except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
+        logging.error(f"Error requesting a download link for {file_code}: {e}")
+    return None
+
+
+# --- Several targets at once ---
+
+class FanOutBackend:
+    """
+    Writes every blob to all targets in parallel. Locations are kept per
+    target spec, so a blob missing from one target (new target, earlier
+    failure) is written only there; reads try the targets in order.
+
+    `workers` is the number of blobs put at once (backup.py's upload
+    workers); the pool has a thread per worker and target so that they do
+    not queue behind each other.
+    """
+
+    def __init__(self, targets: list[StorageBackend], workers: int = 1):
+        if not targets:
+            raise ValueError("At least one backup target is required")
+        self.targets = targets
+        self._pool = ThreadPoolExecutor(
+            max_workers=max(1, workers) * len(targets), thread_name_prefix="backup-target"
+        )
+
+    @property
+    def specs(self) -> list[str]:
+        return [target.spec for target in self.targets]
+
+    def missing(self, locations: dict | None) -> list[StorageBackend]:
+        locations = locations or {}
+        return [target for target in self.targets if target.spec not in locations]
+
+    def put(self, name: str, data: bytes, locations: dict | None = None) -> dict | None:
+        """
+        Stores a blob on every target that does not have it yet.
+
+        Returns:
+            All locations (old and new) if every target succeeded, else None.
+        """
+        locations = dict(locations or {})
+        targets = self.missing(locations)
+        if len(targets) == 1:
+            # Nothing to run alongside: store it from the calling thread
+            results = [(targets[0], lambda: targets[0].put(name, data))]
+        else:
+            results = [
+                (target, self._pool.submit(target.put, name, data).result) for target in targets
+            ]
+        ok = True
+        for target, result in results:
+            try:
+                location = result()
+            except Exception as e:
+                logging.error(f"{target.spec}: storing {name} failed: {e}")
+                location = None
+            if location is None:
+                ok = False
+            else:
+                locations[target.spec] = location
+        return locations if ok else None
+
+    def get(self, locations: dict) -> bytes:
+        errors = []
+        for target in self._readers(locations):
+            try:
+                return target.get(locations[target.spec])
+            except Exception as e:
+                errors.append(f"{target.spec}: {e}")
+        raise RuntimeError(f"No target could return the blob ({'; '.join(errors) or 'no locations'})")
+
+    def _readers(self, locations: dict) -> list[StorageBackend]:
+        """Configured targets first, then any other target the blob lives on."""
+        readers = [target for target in self.targets if target.spec in locations]
+        known = {target.spec for target in readers}
+        for spec in locations:
+            if spec not in known:
+                try:
+                    readers.append(backend_from_spec(spec))
+                except ValueError:
+                    pass
+        return readers
+
+    def delete(self, locations: dict) -> dict:
+        """Deletes a blob everywhere possible. Returns the locations left behind."""
+        left = {}
+        for target in self._readers(locations):
+            try:
+                deleted = target.delete(locations[target.spec])
+            except Exception as e:
+                logging.warning(f"{target.spec}: delete failed: {e}")
+                deleted = False
+            if not deleted:
+                left[target.spec] = locations[target.spec]
+        return left
+
+
+def backend_from_spec(spec: str, api_key: str | None = None, user_type: str | None = None) -> StorageBackend:
+    """
+    Builds a backend from its spec: 'ddownload' or 'local:<directory>'.
+    """
+    spec = spec.strip()
+    if spec == "ddownload":
+        api_key = api_key or os.environ.get("DDOWNLOAD_API_KEY", "YOUR_DDOWNLOAD_API_KEY")
+        if api_key == "YOUR_DDOWNLOAD_API_KEY":
+            raise ValueError("DDownload API Key is not configured. Set DDOWNLOAD_API_KEY in environment or .env file.")
+        return DDownloadBackend(spec, api_key, user_type or os.environ.get("DDOWNLOAD_USER_TYPE", "prem"))
+    if spec.startswith("local:") and len(spec) > len("local:"):
+        return LocalBackend(spec, spec[len("local:"):])
+    raise ValueError(f"Unknown backup target: {spec!r}")
+
+
+def build_storage(specs: str, api_key: str | None = None, user_type: str | None = None,
+                  workers: int = 1) -> FanOutBackend:
+    """Builds the fan-out over a comma-separated list of target specs."""
+    return FanOutBackend(
+        [backend_from_spec(spec, api_key, user_type) for spec in specs.split(",") if spec.strip()],
+        workers,
+    )
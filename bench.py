@@ -0,0 +1,215 @@
+# bench.py
+# Query-count budgets and latency of the app's routes on a realistic dataset.
+#
+# `flask bench` builds a throwaway database (hundreds of episodes, scenes,
+# video generations and comments), calls each route in ROUTES through the
+# test client as the admin, and reports the SQL queries of each call and the
+# latency percentiles. A route that runs more queries than its budget fails
+# the run (exit status 1), so a route that starts doing one query per row
+# shows up before deploy instead of in production.
+#
+#   flask bench                   # default dataset, 20 calls per route
+#   flask bench --scale 3 -r 50   # three times the data, more samples
+#   flask bench -k episode        # only routes whose name contains "episode"
+#
+# Budgets are per request and must not grow with the dataset: run with a
+# larger --scale to check that a route's count stays put.
+
+import contextlib
+import io
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+from sqlalchemy import event
+
+from config import TestingConfig
+from models import (
+    db,
+    Assignment,
+    Comment,
+    Episode,
+    Maslak,
+    Scene,
+    User,
+    VideoGeneration,
+    EPISODE_STATUS_CHOICES,
+    EPISODE_STATUS_REVIEW,
+)
+
+# Dataset size at --scale 1
+EPISODES = 300
+SCENES_PER_EPISODE = 4
+GENERATIONS_PER_SCENE = 3
+COMMENTS_PER_EPISODE = 10
+ASSIGNEES_PER_EPISODE = 2
+
+# name, method, path, query budget, JSON body. Paths are filled in with the
+# ids of the seeded dataset: {episode} is the busiest episode (the one with
+# the most comments), {scene} one of its scenes.
+ROUTES = (
+    ("dashboard", "GET", "/", 5, None),
+    ("dashboard_filtered", "GET", f"/?status={quote(EPISODE_STATUS_REVIEW)}", 5, None),
+    ("view_episode", "GET", "/episode/{episode}", 9, None),  # 9th: stored revisions
+    ("block_comments", "GET", "/episode/{episode}/comments?block=0", 5, None),
+    ("episode_activity", "GET", "/api/episodes/{episode}/activity", 6, None),
+    ("revisions", "GET", "/api/episode/{episode}/revisions/scenario", 4, None),
+    ("search", "GET", "/api/search?q=scenario", 3, None),
+    ("audit", "GET", "/api/audit?episode_id={episode}", 3, None),
+    ("spend", "GET", "/api/spend?group_by=episode", 4, None),
+    ("add_comment", "POST", "/episode/{episode}/comments", 10, {"block_index": 0, "text": "bench"}),
+    ("update_episode_order", "POST", "/api/update_episode_order", 5, "episode_order"),
+    ("save_scene_draft", "PUT", "/api/scenes/{scene}/draft", 5, {"prompt": "bench"}),
+)
+
+
+class BenchConfig(TestingConfig):
+    WARM_UP_REMOTE = False
+    SLOW_REQUEST_MS = 10**9  # The report shows the timings; don't log them too
+
+
+def _seed(scale):
+    """Fills an empty database. Returns the ids the route paths use."""
+    from commands import _create_db_and_seed
+
+    rng = random.Random(42)
+    with contextlib.redirect_stdout(io.StringIO()):
+        _create_db_and_seed()
+    users = User.query.all()
+    maslaks = Maslak.query.all()
+    statuses = [choice[0] for choice in EPISODE_STATUS_CHOICES]
+    started = datetime.utcnow() - timedelta(days=60)
+
+    episodes = []
+    for i in range(EPISODES * scale):
+        episode = Episode(
+            title=f"Episode {i}",
+            scenario="\n\n".join(f"scenario block {b} of episode {i}" for b in range(8)),
+            maslak_id=rng.choice(maslaks).id,
+            status=rng.choice(statuses),
+            display_order=i,
+        )
+        db.session.add(episode)
+        episodes.append(episode)
+    db.session.flush()
+
+    for episode in episodes:
+        for user in rng.sample(users, ASSIGNEES_PER_EPISODE):
+            db.session.add(Assignment(user_id=user.id, episode_id=episode.id))
+        for n in range(COMMENTS_PER_EPISODE):
+            db.session.add(
+                Comment(
+                    episode_id=episode.id,
+                    user_id=rng.choice(users).id,
+                    block_index=n % 8,
+                    text=f"comment {n}",
+                    timestamp=started + timedelta(minutes=rng.randrange(60 * 24 * 60)),
+                )
+            )
+        for number in range(1, SCENES_PER_EPISODE + 1):
+            scene = Scene(episode_id=episode.id, number=number)
+            db.session.add(scene)
+            for attempt in range(GENERATIONS_PER_SCENE):
+                created_at = started + timedelta(minutes=rng.randrange(60 * 24 * 60))
+                db.session.add(
+                    VideoGeneration(
+                        scene=scene,
+                        prompt=f"scene {number} attempt {attempt}",
+                        model=rng.choice(["google/veo-3", "openai/sora-2"]),
+                        status="completed",
+                        cost=round(rng.uniform(0.1, 2.0), 2),
+                        created_by=rng.choice(users).id,
+                        created_at=created_at,
+                        completed_at=created_at + timedelta(minutes=3),
+                    )
+                )
+    db.session.commit()
+
+    busiest = episodes[len(episodes) // 2]
+    # More comments on one block and assign the admin, so every route has work
+    admin = User.query.filter_by(username="admin").one()
+    db.session.add(Assignment(user_id=admin.id, episode_id=busiest.id))
+    for n in range(50):
+        db.session.add(Comment(episode_id=busiest.id, user_id=admin.id, block_index=0, text=f"thread {n}"))
+    db.session.commit()
+    return {
+        "episode": busiest.id,
+        "scene": busiest.scenes.order_by(Scene.number).first().id,
+        "episode_order": {"ordered_ids": [str(e.id) for e in reversed(episodes)]},
+    }
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+def run_bench(scale=1, repeat=20, only=None, out=print):
+    """Seeds a temporary database, calls every route and prints the report.
+    Returns the names of the routes over budget."""
+    from app import create_app
+
+    with tempfile.TemporaryDirectory() as directory:
+        config = type(
+            "BenchConfig",
+            (BenchConfig,),
+            {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(directory, 'bench.db')}"},
+        )
+        app = create_app(config, with_admin=True)
+        with app.app_context():
+            started = time.perf_counter()
+            ids = _seed(scale)
+            out(
+                f"Seeded {Episode.query.count()} episodes, {Scene.query.count()} scenes, "
+                f"{VideoGeneration.query.count()} generations, {Comment.query.count()} comments "
+                f"in {time.perf_counter() - started:.1f}s"
+            )
+            engine = db.engine
+
+        queries = [0]
+
+        def count_query(*args):
+            queries[0] += 1
+
+        client = app.test_client()
+        client.post("/login", data={"username": "admin", "password": "adminpassword"})
+        event.listen(engine, "after_cursor_execute", count_query)
+        failed = []
+        out(f"{'route':<24}{'queries':>8}{'budget':>8}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}  ")
+        try:
+            for name, method, path, budget, body in ROUTES:
+                if only and only not in name:
+                    continue
+                url = path.format(**ids)
+                json_body = ids[body] if isinstance(body, str) else body
+                counts, timings, statuses = [], [], set()
+                for _ in range(repeat):
+                    queries[0] = 0
+                    call_started = time.perf_counter()
+                    response = client.open(url, method=method, json=json_body)
+                    timings.append((time.perf_counter() - call_started) * 1000)
+                    counts.append(queries[0])
+                    statuses.add(response.status_code)
+                most = max(counts)
+                problems = []
+                if most > budget:
+                    problems.append("OVER BUDGET")
+                bad = sorted(status for status in statuses if status >= 400)
+                if bad:
+                    problems.append(f"HTTP {','.join(map(str, bad))}")
+                if problems:
+                    failed.append(name)
+                out(
+                    f"{name:<24}{most:>8}{budget:>8}{statistics.median(timings):>9.1f}"
+                    f"{_percentile(timings, 0.95):>9.1f}{max(timings):>9.1f}  {' '.join(problems)}"
+                )
+        finally:
+            event.remove(engine, "after_cursor_execute", count_query)
+            with app.app_context():
+                db.session.remove()
+                engine.dispose()
+    return failed
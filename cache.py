@@ -0,0 +1,352 @@
+# cache.py
+# Shared cache for values fetched from upstream APIs (the OpenRouter model
+# list, the FX rate), so all worker processes share one copy instead of each
+# fetching its own.
+#
+# An entry is fresh for `ttl`, then served stale for up to `stale_ttl` while
+# one process refreshes it in the background (stale-while-revalidate). Only
+# the holder of a short lease fetches (single flight across processes); on a
+# cold miss the others wait for its result. A failed fetch is remembered for
+# `error_ttl` (negative caching): callers get the last good value or the
+# fallback instead of calling upstream again on every request.
+#
+# Backends, chosen with the CACHE_URL setting (config.py, read by
+# shared_cache.init_app in create_app): "sqlite:///path" (the default,
+# instance/cache.db, shared by every process on the host), "redis://..."
+# (needs the redis package) and "memory" (this process only). If the backend
+# fails, values are fetched directly: slower, never wrong.
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(__file__), "instance", "cache.db")
+LEASE_SECONDS = 30  # Longer than any upstream timeout
+WAIT_POLL_SECONDS = 0.1
+
+
+class CacheBackend:
+    """Interface of a cache store. Entries are JSON-serializable dicts."""
+
+    def __init__(self, url: str):
+        self.url = url
+
+    def get(self, key: str) -> dict | None:
+        raise NotImplementedError
+
+    def set(self, key: str, entry: dict, expire_seconds: float):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def acquire(self, key: str, owner: str, seconds: float) -> bool:
+        """Takes the refresh lease of `key` unless someone else holds it."""
+        raise NotImplementedError
+
+    def release(self, key: str, owner: str):
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.url}>"
+
+
+# --- In-process (tests, single-process development) ---
+
+class MemoryBackend(CacheBackend):
+    def __init__(self, url: str = "memory"):
+        super().__init__(url)
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> (expires_at, entry)
+        self._leases = {}  # key -> (owner, expires_at)
+
+    def get(self, key):
+        with self._lock:
+            expires_at, entry = self._entries.get(key, (0, None))
+            return entry if expires_at > time.time() else None
+
+    def set(self, key, entry, expire_seconds):
+        with self._lock:
+            self._entries[key] = (time.time() + expire_seconds, entry)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def acquire(self, key, owner, seconds):
+        now = time.time()
+        with self._lock:
+            holder = self._leases.get(key)
+            if holder is not None and holder[1] > now:
+                return False
+            self._leases[key] = (owner, now + seconds)
+            return True
+
+    def release(self, key, owner):
+        with self._lock:
+            if self._leases.get(key, (None,))[0] == owner:
+                del self._leases[key]
+
+
+# --- SQLite file (shared by the processes of one host) ---
+
+class SQLiteBackend(CacheBackend):
+    def __init__(self, url: str, path: str):
+        super().__init__(url)
+        self.path = os.path.abspath(path)
+        self._ready = False
+
+    def _connect(self):
+        # One short-lived connection per call: safe across threads and forks
+        connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        if not self._ready:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entry "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache_lease "
+                "(key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._ready = True
+        return connection
+
+    def get(self, key):
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT value FROM cache_entry WHERE key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, entry, expire_seconds):
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO cache_entry (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(entry, ensure_ascii=False), time.time() + expire_seconds),
+            )
+
+    def delete(self, key):
+        with closing(self._connect()) as connection:
+            connection.execute("DELETE FROM cache_entry WHERE key = ?", (key,))
+
+    def acquire(self, key, owner, seconds):
+        now = time.time()
+        with closing(self._connect()) as connection:
+            # Takes a free or expired lease in one statement
+            cursor = connection.execute(
+                "INSERT INTO cache_lease (key, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, "
+                "expires_at = excluded.expires_at WHERE cache_lease.expires_at <= ?",
+                (key, owner, now + seconds, now),
+            )
+            return cursor.rowcount == 1
+
+    def release(self, key, owner):
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "DELETE FROM cache_lease WHERE key = ? AND owner = ?", (key, owner)
+            )
+
+
+# --- Redis (or a compatible server) ---
+
+class RedisBackend(CacheBackend):
+    # Deletes the lease only if this owner still holds it
+    _RELEASE_SCRIPT = (
+        "if redis.call('get', KEYS[1]) == ARGV[1] then "
+        "return redis.call('del', KEYS[1]) else return 0 end"
+    )
+
+    def __init__(self, url: str):
+        super().__init__(url)
+        import redis  # Optional dependency, only needed for this backend
+
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        raw = self._client.get(f"cache:{key}")
+        return json.loads(raw) if raw else None
+
+    def set(self, key, entry, expire_seconds):
+        self._client.set(
+            f"cache:{key}",
+            json.dumps(entry, ensure_ascii=False),
+            px=max(int(expire_seconds * 1000), 1),
+        )
+
+    def delete(self, key):
+        self._client.delete(f"cache:{key}")
+
+    def acquire(self, key, owner, seconds):
+        return bool(self._client.set(f"lease:{key}", owner, nx=True, px=int(seconds * 1000)))
+
+    def release(self, key, owner):
+        self._client.eval(self._RELEASE_SCRIPT, 1, f"lease:{key}", owner)
+
+
+def backend_from_url(url: str | None) -> CacheBackend:
+    """Backend for a CACHE_URL value; None means the default SQLite file."""
+    if not url:
+        return SQLiteBackend(f"sqlite:///{DEFAULT_CACHE_PATH}", DEFAULT_CACHE_PATH)
+    if url == "memory":
+        return MemoryBackend(url)
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url, url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url)
+    raise ValueError(f"Unknown cache backend: {url!r}")
+
+
+# --- Cache ---
+
+class SharedCache:
+    def __init__(self, backend: CacheBackend | None = None):
+        self._backend = backend
+        self._backend_lock = threading.Lock()
+
+    def init_app(self, app):
+        """Uses the backend named by app.config["CACHE_URL"]."""
+        with self._backend_lock:
+            self._backend = backend_from_url(app.config.get("CACHE_URL"))
+        app.extensions["shared_cache"] = self
+
+    @property
+    def backend(self) -> CacheBackend:
+        # Outside an app (init_app not called): the default SQLite file
+        if self._backend is None:
+            with self._backend_lock:
+                if self._backend is None:
+                    self._backend = backend_from_url(None)
+        return self._backend
+
+    def get_or_fetch(self, key, fetch, ttl, stale_ttl=0, error_ttl=60, fallback=None):
+        """
+        The cached value of `key`, calling `fetch()` when it is missing or old.
+
+        Args:
+            ttl: seconds a fetched value is fresh.
+            stale_ttl: seconds after that it is still served while one
+                process refreshes it in the background.
+            error_ttl: seconds a failed fetch is remembered before retrying.
+            fallback: returned when there is no value (cold miss that failed,
+                or the fetching process took too long).
+        """
+        entry = self._call("get", key)
+        if entry is not None:
+            if time.time() >= entry["fresh_until"]:
+                self._refresh_in_background(key, fetch, ttl, stale_ttl, error_ttl, entry)
+            return entry.get("value", fallback)
+
+        owner = uuid.uuid4().hex
+        acquired = self._call("acquire", key, owner, LEASE_SECONDS)
+        if acquired or acquired is None:  # None: backend down, fetch directly
+            try:
+                entry = self._fetch(key, fetch, ttl, stale_ttl, error_ttl)
+            finally:
+                if acquired:
+                    self._call("release", key, owner)
+            return entry.get("value", fallback)
+
+        # Another process is fetching it; wait for its result
+        deadline = time.time() + LEASE_SECONDS
+        while time.time() < deadline:
+            time.sleep(WAIT_POLL_SECONDS)
+            entry = self._call("get", key)
+            if entry is not None:
+                return entry.get("value", fallback)
+        return fallback
+
+    def refresh(self, key, fetch, ttl, stale_ttl=0, error_ttl=60):
+        """Fetches `key` now, unless another process already is, keeping the
+        old value if the fetch fails. Returns the stored value or None."""
+        previous = self._call("get", key)
+        owner = uuid.uuid4().hex
+        acquired = self._call("acquire", key, owner, LEASE_SECONDS)
+        if acquired is False:
+            return previous.get("value") if previous else None
+        try:
+            return self._fetch(key, fetch, ttl, stale_ttl, error_ttl, previous).get("value")
+        finally:
+            if acquired:
+                self._call("release", key, owner)
+
+    def put(self, key, value, ttl, stale_ttl=0):
+        """Stores a value directly (e.g. one computed locally)."""
+        self._store(key, {"value": value, "fresh_until": time.time() + ttl}, ttl + stale_ttl)
+
+    def update(self, key, func):
+        """Replaces the stored value with func(value), keeping its freshness.
+        Not atomic across processes: meant for optimistic adjustments that
+        the next fetch overwrites anyway."""
+        entry = self._call("get", key)
+        if entry is None or "value" not in entry:
+            return
+        entry["value"] = func(entry["value"])
+        self._store(key, entry, entry.get("expires_at", 0) - time.time())
+
+    def peek(self, key):
+        """The stored value of `key` (fresh or stale) or None, without fetching."""
+        entry = self._call("get", key)
+        return entry.get("value") if entry else None
+
+    def invalidate(self, key):
+        self._call("delete", key)
+
+    def _fetch(self, key, fetch, ttl, stale_ttl, error_ttl, previous=None):
+        now = time.time()
+        try:
+            value = fetch()
+        except Exception as e:
+            logger.warning("Fetching %s failed: %s", key, e)
+            if previous is not None and "value" in previous:
+                # Keep serving the last good value; try again after error_ttl
+                entry = dict(previous, fresh_until=now + error_ttl, error=str(e))
+                expire = error_ttl + stale_ttl
+            else:
+                entry = {"error": str(e), "fresh_until": now + error_ttl}
+                expire = error_ttl
+        else:
+            entry = {"value": value, "fresh_until": now + ttl}
+            expire = ttl + stale_ttl
+        self._store(key, entry, expire)
+        return entry
+
+    def _store(self, key, entry, expire):
+        if expire <= 0:
+            return
+        entry["expires_at"] = time.time() + expire
+        self._call("set", key, entry, expire)
+
+    def _refresh_in_background(self, key, fetch, ttl, stale_ttl, error_ttl, previous):
+        owner = uuid.uuid4().hex
+        if not self._call("acquire", key, owner, LEASE_SECONDS):
+            return  # Someone else is refreshing it (or the backend is down)
+
+        def refresh():
+            try:
+                self._fetch(key, fetch, ttl, stale_ttl, error_ttl, previous)
+            finally:
+                self._call("release", key, owner)
+
+        threading.Thread(target=refresh, name=f"cache-refresh-{key}", daemon=True).start()
+
+    def _call(self, method, *args):
+        """Runs a backend method; logs and returns None when the backend fails."""
+        try:
+            return getattr(self.backend, method)(*args)
+        except Exception as e:
+            logger.warning("Cache backend %r failed on %s: %s", self._backend, method, e)
+            return None
+
+
+shared_cache = SharedCache()
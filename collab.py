@@ -0,0 +1,576 @@
+# collab.py
+# Live co-editing of episode plan/scenario (operational transform over SSE).
+#
+# Edits travel as text operations in the ot.js format: a list where a
+# positive int retains characters, a string inserts it and a negative int
+# deletes characters. Each (episode, field) document keeps its current text,
+# a revision number and the operations since it was loaded. A client sends
+# its operation together with the revision it was based on; the server
+# transforms it against everything applied since, applies it and broadcasts
+# it to every open page (the sender treats its own broadcast as the ack).
+#
+# Changes are written to the database in batches by a background thread.
+# A document remembers the stored text it was loaded from; when the stored
+# text has changed since (a whole-field save), the write is refused and the
+# document is rebased onto the stored text before it is tried again.
+# State lives in this process: run a single (threaded) worker when live
+# editing is enabled. Each open event stream holds one of that worker's
+# threads, so at most LIVE_MAX_STREAMS are served at a time; the others are
+# refused and their pages retry, saving whole fields meanwhile.
+
+import atexit
+import difflib
+import itertools
+import json
+import queue
+import secrets
+import threading
+import time
+
+EDITABLE_FIELDS = ("plan", "scenario")
+
+FLUSH_INTERVAL_SECONDS = 5
+PRESENCE_TIMEOUT_SECONDS = 45
+HEARTBEAT_SECONDS = 15
+# Operations kept per document for transforming late edits; clients further
+# behind than this resync from a fresh snapshot.
+MAX_HISTORY = 1000
+_SUBSCRIBER_QUEUE_SIZE = 500
+
+
+class CollabError(ValueError):
+    """Raised for operations that do not fit the document they target."""
+
+
+class StreamLimitReached(RuntimeError):
+    """Raised when this process already serves LIVE_MAX_STREAMS streams."""
+
+
+class StaleDocument(RuntimeError):
+    """Raised by the persist callback when the stored text is no longer the
+    one the live document was loaded from. `stored` is {field: stored text}."""
+
+    def __init__(self, stored):
+        super().__init__(f"stored text changed: {', '.join(sorted(stored))}")
+        self.stored = stored
+
+
+# --- Text operations ---
+def _is_retain(component):
+    return isinstance(component, int) and component > 0
+
+
+def _is_delete(component):
+    return isinstance(component, int) and component < 0
+
+
+def _push(ops, component):
+    """Appends a component, merging it with the previous one when possible."""
+    if component == 0 or component == "":
+        return
+    if ops:
+        last = ops[-1]
+        if isinstance(component, str) and isinstance(last, str):
+            ops[-1] = last + component
+            return
+        if _is_retain(component) and _is_retain(last):
+            ops[-1] = last + component
+            return
+        if _is_delete(component) and _is_delete(last):
+            ops[-1] = last + component
+            return
+        if isinstance(component, str) and _is_delete(last):
+            # Keep inserts before deletes so equal operations compare equal.
+            if len(ops) > 1 and isinstance(ops[-2], str):
+                ops[-2] = ops[-2] + component
+            else:
+                ops.insert(len(ops) - 1, component)
+            return
+    ops.append(component)
+
+
+def validate_operation(operation):
+    if not isinstance(operation, list):
+        raise CollabError("operation must be a list")
+    ops = []
+    for component in operation:
+        if isinstance(component, bool) or not isinstance(component, (int, str)):
+            raise CollabError("invalid operation component")
+        _push(ops, component)
+    return ops
+
+
+def base_length(operation):
+    return sum(c if c > 0 else -c for c in operation if isinstance(c, int))
+
+
+def apply_operation(text, operation):
+    if base_length(operation) != len(text):
+        raise CollabError("operation does not match document length")
+    parts = []
+    position = 0
+    for component in operation:
+        if isinstance(component, str):
+            parts.append(component)
+        elif component > 0:
+            parts.append(text[position : position + component])
+            position += component
+        else:
+            position -= component
+    return "".join(parts)
+
+
+def diff_operation(old_text, new_text):
+    """An operation turning old_text into new_text, line by line inside the
+    changed middle so that it merges with concurrent edits elsewhere."""
+    prefix = 0
+    limit = min(len(old_text), len(new_text))
+    while prefix < limit and old_text[prefix] == new_text[prefix]:
+        prefix += 1
+    suffix = 0
+    limit -= prefix
+    while suffix < limit and old_text[-1 - suffix] == new_text[-1 - suffix]:
+        suffix += 1
+    old_lines = old_text[prefix : len(old_text) - suffix].splitlines(keepends=True)
+    new_lines = new_text[prefix : len(new_text) - suffix].splitlines(keepends=True)
+    ops = []
+    _push(ops, prefix)
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            _push(ops, sum(map(len, old_lines[i1:i2])))
+            continue
+        _push(ops, "".join(new_lines[j1:j2]))
+        _push(ops, -sum(map(len, old_lines[i1:i2])))
+    _push(ops, suffix)
+    return ops
+
+
+def transform(a, b):
+    """Transforms concurrent operations a and b (same base text) into
+    (a', b') so that apply(apply(t, a), b') == apply(apply(t, b), a').
+    Inserts of `a` go first when both insert at the same position."""
+    if base_length(a) != base_length(b):
+        raise CollabError("concurrent operations have different base lengths")
+    a_prime, b_prime = [], []
+    ia = ib = 0
+    ca = a[0] if a else None
+    cb = b[0] if b else None
+    while ca is not None or cb is not None:
+        if isinstance(ca, str):
+            _push(a_prime, ca)
+            _push(b_prime, len(ca))
+            ia += 1
+            ca = a[ia] if ia < len(a) else None
+            continue
+        if isinstance(cb, str):
+            _push(a_prime, len(cb))
+            _push(b_prime, cb)
+            ib += 1
+            cb = b[ib] if ib < len(b) else None
+            continue
+        if ca is None or cb is None:
+            raise CollabError("operations could not be transformed")
+        if _is_retain(ca) and _is_retain(cb):
+            step = min(ca, cb)
+            _push(a_prime, step)
+            _push(b_prime, step)
+        elif _is_delete(ca) and _is_delete(cb):
+            step = min(-ca, -cb)
+        elif _is_delete(ca):  # b retains
+            step = min(-ca, cb)
+            _push(a_prime, -step)
+        else:  # a retains, b deletes
+            step = min(ca, -cb)
+            _push(b_prime, -step)
+        ca = ca - step if ca > 0 else ca + step
+        cb = cb - step if cb > 0 else cb + step
+        if ca == 0:
+            ia += 1
+            ca = a[ia] if ia < len(a) else None
+        if cb == 0:
+            ib += 1
+            cb = b[ib] if ib < len(b) else None
+    return a_prime, b_prime
+
+
+# --- Documents and subscribers ---
+class CollabDocument:
+    def __init__(self, text):
+        self.text = text
+        # Changes whenever the document is reloaded, so a page never replays
+        # history from an older copy with coincidentally equal revisions.
+        self.epoch = secrets.token_hex(4)
+        self.revision = 0
+        self.history = []  # (operation, client_id) applied since load
+        self.history_start = 0  # revision of history[0]'s base
+        self.persisted_text = text
+        self.last_editor_id = None
+        self.last_edit_at = 0.0
+
+    @property
+    def dirty(self):
+        return self.text != self.persisted_text
+
+    def apply_client_operation(self, revision, operation, client_id):
+        if revision < self.history_start or revision > self.revision:
+            raise CollabError("revision out of range")
+        for concurrent, _ in self.history[revision - self.history_start :]:
+            operation, _ = transform(operation, concurrent)
+        self.apply(operation, client_id)
+        return operation
+
+    def apply(self, operation, client_id):
+        self.text = apply_operation(self.text, operation)
+        self.history.append((operation, client_id))
+        self.revision += 1
+        if len(self.history) > MAX_HISTORY:
+            drop = len(self.history) - MAX_HISTORY
+            del self.history[:drop]
+            self.history_start += drop
+
+    def operations_since(self, since):
+        """Operations after `since` ("epoch:revision"), or None when they are
+        no longer kept."""
+        epoch, _, revision = (since or "").partition(":")
+        if epoch != self.epoch or not revision.isdigit():
+            return None
+        revision = int(revision)
+        if not self.history_start <= revision <= self.revision:
+            return None
+        return [
+            {"operation": operation, "client_id": client_id}
+            for operation, client_id in self.history[revision - self.history_start :]
+        ]
+
+
+class _Subscriber:
+    def __init__(self, client_id, user_id, username):
+        self.client_id = client_id
+        self.user_id = user_id
+        self.username = username
+        self.field = None
+        self.last_seen = time.monotonic()
+        self.queue = queue.Queue(maxsize=_SUBSCRIBER_QUEUE_SIZE)
+        self.closed = False
+
+
+def _format_event(event, data):
+    payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+class CollabHub:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._documents = {}  # (episode_id, field) -> CollabDocument
+        self._subscribers = {}  # episode_id -> {client_id: _Subscriber}
+        self._client_ids = itertools.count(1)
+        self._app = None
+        self._load = None
+        self._persist = None
+        self._flusher = None
+        self._flush_lock = threading.Lock()  # One batch write at a time
+        self._stop = threading.Event()
+        self._max_streams = None
+
+    def init_app(self, app, load, persist):
+        """`load(episode_id, field)` returns the stored text;
+        `persist(episode_id, changes, user_id)` saves {field: (old, new)} and
+        may return extra data for the "saved" event; it raises StaleDocument
+        when a stored text is no longer `old`."""
+        self._app = app
+        self._load = load
+        self._persist = persist
+        self._max_streams = app.config.get("LIVE_MAX_STREAMS")
+        app.extensions["collab_hub"] = self
+        atexit.register(self.flush_all)
+
+    def new_client_id(self, user_id):
+        return f"u{user_id}-{next(self._client_ids)}-{secrets.token_hex(4)}"
+
+    # --- Documents ---
+    def _document(self, episode_id, field):
+        key = (episode_id, field)
+        document = self._documents.get(key)
+        if document is None:
+            document = CollabDocument(self._load(episode_id, field) or "")
+            self._documents[key] = document
+        return document
+
+    def snapshot(self, episode_id, since=None):
+        """Current text and revision per field. With `since` ({field: "epoch:rev"})
+        the operations a reconnecting page missed are included when still kept."""
+        since = since or {}
+        with self._lock:
+            fields = {}
+            for field in EDITABLE_FIELDS:
+                document = self._document(episode_id, field)
+                fields[field] = {
+                    "text": document.text,
+                    "epoch": document.epoch,
+                    "revision": document.revision,
+                    "missed": document.operations_since(since.get(field)),
+                }
+            return fields
+
+    def submit(self, episode_id, field, client_id, revision, operation, user_id):
+        """Applies a client operation and broadcasts it. Returns the new revision."""
+        if field not in EDITABLE_FIELDS:
+            raise CollabError("unknown field")
+        operation = validate_operation(operation)
+        with self._lock:
+            document = self._document(episode_id, field)
+            applied = document.apply_client_operation(revision, operation, client_id)
+            document.last_editor_id = user_id
+            document.last_edit_at = time.monotonic()
+            subscriber = self._subscribers.get(episode_id, {}).get(client_id)
+            if subscriber is not None:
+                subscriber.field = field
+                subscriber.last_seen = time.monotonic()
+            self._broadcast(
+                episode_id,
+                "op",
+                {
+                    "field": field,
+                    "revision": document.revision,
+                    "client_id": client_id,
+                    "operation": applied,
+                },
+            )
+            self._ensure_flusher()
+            return document.revision
+
+    def reset_field(self, episode_id, field, text, extra=None):
+        """Replaces a live document after a save made outside the channel
+        (full-document save, admin edit); open editors reload it. `extra` is
+        added to the "reset" event."""
+        with self._lock:
+            key = (episode_id, field)
+            document = self._documents.get(key)
+            if document is None:
+                return
+            document.text = document.persisted_text = text or ""
+            document.history = []
+            document.revision += 1
+            document.history_start = document.revision
+            self._broadcast(
+                episode_id,
+                "reset",
+                {
+                    "field": field,
+                    "text": document.text,
+                    "revision": document.revision,
+                    **(extra or {}),
+                },
+            )
+
+    # --- Subscribers and presence ---
+    def subscribe(self, episode_id, client_id, user_id, username):
+        subscriber = _Subscriber(client_id, user_id, username)
+        with self._lock:
+            subscribers = self._subscribers.setdefault(episode_id, {})
+            previous = subscribers.get(client_id)
+            if (
+                previous is None
+                and self._max_streams
+                and sum(map(len, self._subscribers.values())) >= self._max_streams
+            ):
+                if not subscribers:
+                    del self._subscribers[episode_id]
+                raise StreamLimitReached(f"{self._max_streams} live streams open")
+            if previous is not None:
+                previous.closed = True  # The page reconnected before we noticed
+            subscribers[client_id] = subscriber
+            self._broadcast_presence(episode_id)
+        return subscriber
+
+    def unsubscribe(self, episode_id, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(episode_id, {})
+            if subscribers.get(subscriber.client_id) is subscriber:
+                subscribers.pop(subscriber.client_id)
+            if not subscribers:
+                self._subscribers.pop(episode_id, None)
+            self._broadcast_presence(episode_id)
+
+    def touch(self, episode_id, client_id, field=None):
+        with self._lock:
+            subscriber = self._subscribers.get(episode_id, {}).get(client_id)
+            if subscriber is None:
+                return False
+            subscriber.last_seen = time.monotonic()
+            if field != subscriber.field:
+                subscriber.field = field
+                self._broadcast_presence(episode_id)
+            return True
+
+    def presence(self, episode_id):
+        with self._lock:
+            return self._presence_list(episode_id)
+
+    def _presence_list(self, episode_id):
+        now = time.monotonic()
+        return [
+            {"client_id": s.client_id, "username": s.username, "field": s.field}
+            for s in self._subscribers.get(episode_id, {}).values()
+            if now - s.last_seen < PRESENCE_TIMEOUT_SECONDS
+        ]
+
+    def _broadcast_presence(self, episode_id):
+        self._broadcast(episode_id, "presence", {"users": self._presence_list(episode_id)})
+
+    def _broadcast(self, episode_id, event, data):
+        message = _format_event(event, data)
+        for subscriber in list(self._subscribers.get(episode_id, {}).values()):
+            try:
+                subscriber.queue.put_nowait(message)
+            except queue.Full:
+                # A stalled page: drop it, the browser reconnects and resyncs.
+                subscriber.closed = True
+                self._subscribers[episode_id].pop(subscriber.client_id, None)
+
+    def open_stream(self, episode_id, client_id, user_id, username, since=None, extra=None):
+        """Registers a page and returns its SSE generator: a snapshot (with
+        `extra` added), then broadcasts. The snapshot is built here, inside the
+        request, so the long-lived generator itself never touches the
+        database. Raises StreamLimitReached when LIVE_MAX_STREAMS are already
+        open."""
+        subscriber = self.subscribe(episode_id, client_id, user_id, username)
+        first = _format_event(
+            "snapshot",
+            {
+                "client_id": client_id,
+                "fields": self.snapshot(episode_id, since),
+                "users": self.presence(episode_id),
+                **(extra or {}),
+            },
+        )
+        return self._stream(episode_id, subscriber, first)
+
+    def _stream(self, episode_id, subscriber, first):
+        try:
+            yield first
+            while not self._stop.is_set() and not subscriber.closed:
+                try:
+                    message = subscriber.queue.get(timeout=HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield message
+        finally:
+            self.unsubscribe(episode_id, subscriber)
+
+    # --- Batched persistence ---
+    def _ensure_flusher(self):
+        if self._flusher is None or not self._flusher.is_alive():
+            self._flusher = threading.Thread(
+                target=self._flush_loop, name="collab-flush", daemon=True
+            )
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._stop.wait(FLUSH_INTERVAL_SECONDS):
+            try:
+                self.flush_all()
+            except Exception:
+                self._app.logger.exception("Collaborative flush failed")
+
+    def _take_changes(self, episode_id=None):
+        """Collects dirty documents as {episode_id: ({field: (old, new)}, user)}.
+        They stay dirty until their own write succeeds (_mark_persisted)."""
+        pending = {}
+        with self._lock:
+            for (doc_episode_id, field), document in list(self._documents.items()):
+                if episode_id is not None and doc_episode_id != episode_id:
+                    continue
+                if document.dirty:
+                    changes, _ = pending.setdefault(
+                        doc_episode_id, ({}, document.last_editor_id)
+                    )
+                    changes[field] = (document.persisted_text, document.text)
+                elif doc_episode_id not in self._subscribers:
+                    # Nobody has the page open and nothing is unsaved.
+                    del self._documents[(doc_episode_id, field)]
+        return pending
+
+    def flush(self, episode_id=None):
+        """Writes unsaved live edits to the database. Returns {episode_id: fields}.
+
+        An episode whose write fails keeps its edits for the next batch; the
+        others are still written. With `episode_id`, its failure is raised."""
+        if self._persist is None:
+            return {}
+        saved = {}
+        with self._flush_lock:
+            for doc_episode_id, (changes, user_id) in self._take_changes(episode_id).items():
+                try:
+                    changes, extra = self._persist_episode(doc_episode_id, changes, user_id)
+                except Exception:
+                    if episode_id is not None:
+                        raise
+                    self._app.logger.exception(
+                        f"Saving live edits of episode {doc_episode_id} failed; retrying next batch"
+                    )
+                    continue
+                if not changes:
+                    continue
+                self._mark_persisted(doc_episode_id, changes)
+                saved[doc_episode_id] = sorted(changes)
+                with self._lock:
+                    self._broadcast(
+                        doc_episode_id, "saved", {"fields": sorted(changes), **extra}
+                    )
+        return saved
+
+    def _persist_episode(self, episode_id, changes, user_id):
+        """Persists one episode's changes, rebasing once onto stored texts that
+        changed under the live documents. Returns (changes, extra)."""
+        with self._app.app_context():
+            try:
+                return changes, self._persist(episode_id, changes, user_id) or {}
+            except StaleDocument as e:
+                self._app.logger.info(f"Rebasing live edits of episode {episode_id}: {e}")
+                self._rebase(episode_id, e.stored)
+            changes, user_id = self._take_changes(episode_id).get(episode_id, ({}, user_id))
+            if not changes:
+                return {}, {}
+            return changes, self._persist(episode_id, changes, user_id) or {}
+
+    def flush_all(self):
+        return self.flush()
+
+    def _rebase(self, episode_id, stored):
+        """Moves live documents onto the stored text: the change made to it
+        since the document was loaded is transformed past the live edits and
+        broadcast like any other operation."""
+        with self._lock:
+            for field, stored_text in stored.items():
+                document = self._documents.get((episode_id, field))
+                if document is None or document.persisted_text == stored_text:
+                    continue
+                external = diff_operation(document.persisted_text, stored_text)
+                local = diff_operation(document.persisted_text, document.text)
+                _, operation = transform(local, external)
+                document.apply(operation, "server")
+                document.persisted_text = stored_text
+                self._broadcast(
+                    episode_id,
+                    "op",
+                    {
+                        "field": field,
+                        "revision": document.revision,
+                        "client_id": "server",
+                        "operation": operation,
+                    },
+                )
+
+    def _mark_persisted(self, episode_id, changes):
+        with self._lock:
+            for field, (old_text, new_text) in changes.items():
+                document = self._documents.get((episode_id, field))
+                # Unless reset_field() replaced it while the write was running
+                if document is not None and document.persisted_text == old_text:
+                    document.persisted_text = new_text
+
+collab_hub = CollabHub()
@@ -0,0 +1,207 @@
+# commands.py
+# flask CLI commands (create-db, update-plans, ...). Registered by
+# create_app(); each runs inside an app context.
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from werkzeug.security import generate_password_hash
+
+from models import DEFAULT_PLAN_MARKDOWN, db, User, Episode, Maslak
+from search_service import SearchService
+from comment_anchors import repair_episode_anchors
+from revisions import record_revision
+from audit_archive import archive_audit_log
+from spend import rebuild_spend_rollup
+
+
+# --- Database Initialization Command ---
+@click.command("create-db")
+@with_appcontext
+def create_db_command():
+    _create_db_and_seed()
+
+
+def _create_db_and_seed():
+    # Needs an app context (the command provides one)
+    database = db or current_app.extensions["sqlalchemy"].db
+    database.create_all()
+    SearchService.ensure_index()
+    database.session.commit()
+    print("Database tables created.")
+    if not User.query.first():
+        print("Seeding initial users and Maslaks...")
+        admin_user = User(
+            username="admin",
+            password=generate_password_hash(
+                "adminpassword", method="pbkdf2:sha256"
+            ),
+            is_admin=True,
+        )
+        database.session.add(admin_user)
+        new_users = ["ahmed_a", "ahmed_s", "hakim", "jawhar", "mohamed", "yassine"]
+        user_objects = {}
+        for username in new_users:
+            password = f"{username}2023"
+            hashed_password = generate_password_hash(
+                password, method="pbkdf2:sha256"
+            )
+            new_user = User(
+                username=username, password=hashed_password, is_admin=False
+            )
+            user_objects[username] = new_user
+            database.session.add(new_user)
+            print(f"  Added user: {username} (password: {password})")
+        maslak1 = Maslak(name="المسلك الأول: الأساسيات")
+        maslak2 = Maslak(name="المسلك الثاني: المتقدم")
+        database.session.add_all([maslak1, maslak2])
+        print("  Added Maslaks.")
+        database.session.commit()
+        print(f"Initial users (admin + {len(new_users)}) and Maslaks seeded.")
+    else:
+        print("Database already contains data.")
+
+
+# --- NEW: Custom CLI Command to Update Empty Plans ---
+@click.command("update-plans")
+@with_appcontext
+def update_plans():
+    """Updates the 'plan' field for episodes where it is currently empty or NULL."""
+    print("Checking for episodes with non empty plans...")
+    # Query episodes where plan is NULL or an empty string
+    episodes_to_update = Episode.query.all()
+
+    if not episodes_to_update:
+        print("No episodes found with empty plans. Nothing to update.")
+        return
+
+    updated_count = 0
+    try:
+        for episode in episodes_to_update:
+            old_plan = episode.plan
+            episode.plan = DEFAULT_PLAN_MARKDOWN
+            if old_plan != DEFAULT_PLAN_MARKDOWN:
+                record_revision(episode, "plan", old_plan, DEFAULT_PLAN_MARKDOWN)
+            db.session.add(episode)  # Add to session to mark as dirty
+            updated_count += 1
+            print(
+                f"  Updating plan for Episode ID: {episode.id}, Title: {episode.title}"
+            )
+
+        db.session.commit()
+        print(f"Successfully updated plans for {updated_count} episodes.")
+    except Exception as e:
+        db.session.rollback()
+        print(f"An error occurred during update: {e}")
+        print("Database changes rolled back.")
+
+
+# --- End Custom CLI Command ---
+
+
+@click.command("reanchor-comments")
+@with_appcontext
+def reanchor_comments_command():
+    """Fills missing comment anchors and re-attaches comments whose block moved."""
+    moved = 0
+    for episode in Episode.query.all():
+        moved += repair_episode_anchors(episode)
+    db.session.commit()
+    print(f"Comment anchors checked; {moved} comments re-attached.")
+
+
+@click.command("search-reindex")
+@with_appcontext
+def search_reindex_command():
+    """Rebuilds the full-text search index from all episodes and comments."""
+    episode_count, comment_count = SearchService.rebuild_index()
+    print(
+        f"Search index rebuilt: {episode_count} episodes, {comment_count} comments."
+    )
+
+
+@click.command("archive-audit-log")
+@click.option("--days", type=int, default=None, help="Archive rows older than this many days.")
+@with_appcontext
+def archive_audit_log_command(days):
+    """Moves old audit log rows into compressed monthly archive segments."""
+    archived = archive_audit_log(days)
+    print(f"Archived {archived} audit log rows.")
+
+
+@click.command("rebuild-spend-rollup")
+@with_appcontext
+def rebuild_spend_rollup_command():
+    """Recomputes the spend rollup from the video generations in the database."""
+    rows = rebuild_spend_rollup()
+    print(f"Spend rollup rebuilt: {rows} rows.")
+
+
+@click.command("bench")
+@click.option("--scale", type=int, default=1, help="Multiplies the size of the seeded dataset.")
+@click.option("-r", "--repeat", type=int, default=20, help="Calls per route.")
+@click.option("-k", "only", default=None, help="Only routes whose name contains this.")
+def bench_command(scale, repeat, only):
+    """Checks the SQL query budget and latency of each route on a seeded
+    throwaway database (see bench.py). Fails if a route is over budget."""
+    from bench import run_bench
+
+    failed = run_bench(scale=scale, repeat=repeat, only=only)
+    if failed:
+        raise click.ClickException(f"Over budget or failing: {', '.join(failed)}")
+    print("All routes within budget.")
+
+
+@click.command("upstream-report")
+@click.option("--hours", type=float, default=None, help="Only spans from the last N hours.")
+@click.option("--path", default=None, help="Trace log to read (default: TRACE_LOG_PATH).")
+@with_appcontext
+def upstream_report_command(hours, path):
+    """Latency of upstream calls per endpoint, from the trace log (tracing.py)."""
+    from tracing import upstream_report
+
+    path = path or current_app.config["TRACE_LOG_PATH"]
+    if not path or path == "-":
+        raise click.ClickException("TRACE_LOG_PATH is not a file; pass --path.")
+    rows = upstream_report(path, hours)
+    if not rows:
+        print(f"No upstream spans in {path}.")
+        return
+    print(
+        f"{'host':<24}{'method':<7}{'endpoint':<36}{'calls':>7}{'errors':>7}"
+        f"{'retries':>8}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}{'bytes':>10}"
+    )
+    for row in rows:
+        print(
+            f"{row['host'] or '':<24}{row['method'] or '':<7}{row['endpoint'] or '':<36}"
+            f"{row['calls']:>7}{row['errors']:>7}{row['retries']:>8}{row['p50_ms']:>9.0f}"
+            f"{row['p95_ms']:>9.0f}{row['max_ms']:>9.0f}{row['median_bytes'] or '':>10}"
+        )
+
+
+@click.command("build-assets")
+@click.option("--no-tailwind", is_flag=True, help="Skip Tailwind; pages keep loading it from the CDN.")
+def build_assets_command(no_tailwind):
+    """Minifies and fingerprints the static CSS/JS and writes static/dist/manifest.json."""
+    from assets import build_assets
+
+    try:
+        build_assets(tailwind=not no_tailwind)
+    except RuntimeError as e:
+        raise click.ClickException(f"{e}\nRun with --no-tailwind to build the other assets only.")
+    print("Assets built; restart the app to serve them.")
+
+
+def register_commands(app):
+    for command in (
+        create_db_command,
+        update_plans,
+        reanchor_comments_command,
+        search_reindex_command,
+        archive_audit_log_command,
+        rebuild_spend_rollup_command,
+        bench_command,
+        upstream_report_command,
+        build_assets_command,
+    ):
+        app.cli.add_command(command)
@@ -0,0 +1,238 @@
+# comment_anchors.py
+# Keeps scenario comments attached to their paragraph when the scenario is edited.
+#
+# The scenario page numbers the top-level Markdown blocks (paragraphs, headings,
+# lists, tables, code blocks...) and comments point at a block by position.
+# On save we diff the old and new block lists and move only the comments that
+# sit in or after the changed region.
+
+import difflib
+import hashlib
+import re
+
+from sqlalchemy import case, update
+
+from models import db, Comment
+
+_FENCE_RE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+_HEADING_RE = re.compile(r"^ {0,3}#{1,6}(\s|$)")
+_HR_RE = re.compile(r"^ {0,3}([-*_])( *\1){2,} *$")
+_SETEXT_RE = re.compile(r"^ {0,3}(=+|-+) *$")
+_LIST_ITEM_RE = re.compile(r"^ {0,3}([-*+]|\d{1,9}[.)])( +|$)")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# Below this similarity an edited paragraph is treated as a different one.
+_FUZZY_MATCH_THRESHOLD = 0.4
+
+
+def split_blocks(markdown_text):
+    """Splits Markdown into top-level blocks, mirroring how marked.js lays
+    them out as children of the scenario display."""
+    blocks = []
+    current = []
+    kind = None  # 'para', 'list', 'quote', 'code'
+    fence = None
+    blank_in_list = False
+
+    def flush():
+        nonlocal current, kind, blank_in_list
+        if current:
+            blocks.append("\n".join(current))
+        current, kind, blank_in_list = [], None, False
+
+    for line in (markdown_text or "").replace("\r\n", "\n").split("\n"):
+        if fence:
+            current.append(line)
+            if line.strip().startswith(fence):
+                fence = None
+                flush()
+            continue
+        stripped = line.strip()
+        fence_match = _FENCE_RE.match(line)
+        if fence_match:
+            flush()
+            fence = fence_match.group(1)[0] * 3
+            current, kind = [line], "code"
+            continue
+        if not stripped:
+            if kind == "list":
+                blank_in_list = True  # Loose lists stay one block
+            else:
+                flush()
+            continue
+        if _HEADING_RE.match(line):
+            flush()
+            blocks.append(line)
+            continue
+        if kind == "para" and _SETEXT_RE.match(line):
+            current.append(line)  # Setext heading underline
+            flush()
+            continue
+        if _HR_RE.match(line):
+            flush()
+            blocks.append(line)
+            continue
+        if _LIST_ITEM_RE.match(line):
+            if kind != "list":
+                flush()
+                kind = "list"
+            current.append(line)
+            blank_in_list = False
+            continue
+        if kind == "list":
+            if blank_in_list and not line.startswith((" ", "\t")):
+                flush()
+            else:
+                current.append(line)
+                continue
+        if stripped.startswith(">"):
+            if kind != "quote":
+                flush()
+                kind = "quote"
+            current.append(line)
+            continue
+        if kind is None:
+            kind = "para"
+        current.append(line)
+    flush()
+    return blocks
+
+
+def block_hash(block_text):
+    """Content hash of a block, insensitive to whitespace changes."""
+    normalized = _WHITESPACE_RE.sub(" ", block_text or "").strip()
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+def _best_fuzzy_match(old_block, new_blocks, j1, j2, fallback):
+    best_index, best_ratio = fallback, _FUZZY_MATCH_THRESHOLD
+    for j in range(j1, j2):
+        ratio = difflib.SequenceMatcher(None, old_block, new_blocks[j]).ratio()
+        if ratio > best_ratio:
+            best_index, best_ratio = j, ratio
+    return best_index
+
+
+def compute_block_moves(old_text, new_text):
+    """Diffs two scenario versions.
+
+    Returns (prefix, old_tail_start, shift, moves, new_hashes) where blocks
+    before `prefix` are unchanged, blocks from `old_tail_start` on moved by
+    `shift`, and `moves` maps the old indices in between to
+    (new_index, content_changed).
+    Only the changed middle region is diffed, so the cost follows the size
+    of the edit rather than the length of the scenario.
+    """
+    old_blocks = split_blocks(old_text)
+    new_blocks = split_blocks(new_text)
+    old_hashes = [block_hash(b) for b in old_blocks]
+    new_hashes = [block_hash(b) for b in new_blocks]
+
+    prefix = 0
+    limit = min(len(old_hashes), len(new_hashes))
+    while prefix < limit and old_hashes[prefix] == new_hashes[prefix]:
+        prefix += 1
+    suffix = 0
+    while (
+        suffix < limit - prefix
+        and old_hashes[-1 - suffix] == new_hashes[-1 - suffix]
+    ):
+        suffix += 1
+    old_tail_start = len(old_hashes) - suffix
+    new_tail_start = len(new_hashes) - suffix
+    shift = new_tail_start - old_tail_start
+
+    moves = {}
+    matcher = difflib.SequenceMatcher(
+        None,
+        old_hashes[prefix:old_tail_start],
+        new_hashes[prefix:new_tail_start],
+        autojunk=False,
+    )
+    opcodes = [
+        (tag, i1 + prefix, i2 + prefix, j1 + prefix, j2 + prefix)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+    ]
+    # A moved paragraph shows up as a delete plus an insert: new blocks that
+    # are not plain copies, by hash, so a removed block can follow its text
+    arrived = {}
+    for tag, _, _, j1, j2 in opcodes:
+        if tag in ("insert", "replace"):
+            for j in range(j1, j2):
+                arrived.setdefault(new_hashes[j], []).append(j)
+    last_new_index = max(len(new_blocks) - 1, 0)
+    for tag, i1, i2, j1, j2 in opcodes:
+        for i in range(i1, i2):
+            if tag == "equal":
+                moves[i] = (j1 + (i - i1), False)
+                continue
+            if arrived.get(old_hashes[i]):
+                moves[i] = (arrived[old_hashes[i]].pop(0), False)
+            elif tag == "replace":
+                fallback = min(j1 + (i - i1), j2 - 1)
+                moves[i] = (
+                    _best_fuzzy_match(old_blocks[i], new_blocks, j1, j2, fallback),
+                    True,
+                )
+            elif tag == "delete":
+                # Paragraph removed: keep the thread on the block now in its place.
+                moves[i] = (min(j1, last_new_index), True)
+    return prefix, old_tail_start, shift, moves, new_hashes
+
+
+def reanchor_comments(episode_id, old_text, new_text):
+    """Moves the episode's comments to follow a scenario edit. Runs a single
+    UPDATE in the current transaction; the caller commits."""
+    if (old_text or "") == (new_text or ""):
+        return
+    prefix, old_tail_start, shift, moves, new_hashes = compute_block_moves(
+        old_text, new_text
+    )
+    index_whens = []
+    hash_whens = []
+    if shift:
+        index_whens.append(
+            (Comment.block_index >= old_tail_start, Comment.block_index + shift)
+        )
+    for old_index, (new_index, content_changed) in moves.items():
+        if new_index != old_index:
+            index_whens.append((Comment.block_index == old_index, new_index))
+        if content_changed and new_index < len(new_hashes):
+            hash_whens.append((Comment.block_index == old_index, new_hashes[new_index]))
+    if not index_whens and not hash_whens:
+        return
+
+    values = {}
+    if index_whens:
+        values["block_index"] = case(*index_whens, else_=Comment.block_index)
+    if hash_whens:
+        values["anchor_hash"] = case(*hash_whens, else_=Comment.anchor_hash)
+    db.session.execute(
+        update(Comment)
+        .where(Comment.episode_id == episode_id, Comment.block_index >= prefix)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def repair_episode_anchors(episode):
+    """Re-attaches comments whose stored hash no longer matches their block
+    (e.g. after edits made outside the app). Returns the number moved."""
+    blocks = split_blocks(episode.scenario)
+    hashes = [block_hash(b) for b in blocks]
+    positions = {}
+    for index, value in enumerate(hashes):
+        positions.setdefault(value, []).append(index)
+    moved = 0
+    for comment in episode.comments:
+        current = hashes[comment.block_index] if comment.block_index < len(hashes) else None
+        if comment.anchor_hash is None:
+            comment.anchor_hash = current
+            continue
+        if comment.anchor_hash == current:
+            continue
+        candidates = positions.get(comment.anchor_hash)
+        if candidates:
+            comment.block_index = min(candidates, key=lambda i: abs(i - comment.block_index))
+            moved += 1
+    return moved
@@ -0,0 +1,152 @@
+# compression.py
+# gzip/brotli compression of text responses (HTML, JSON, CSS, JS, ...), as
+# WSGI middleware around the app so it sees each response as sent.
+#
+# A response is compressed when the client accepts gzip or br, it is a
+# complete 200 response of a text type, and its Content-Length is at least
+# COMPRESS_MIN_SIZE bytes (smaller bodies fit in a packet anyway). Everything
+# else passes through untouched and unbuffered: Server-Sent Events and other
+# streams (no Content-Length), the Drive video proxy, ranges, HEAD requests,
+# 304s, bodies that are already encoded and responses whose app only calls
+# start_response once its body is iterated. Brotli is used when the client
+# accepts it and the optional `brotli` package is installed.
+#
+# A compressed response's ETag becomes weak: the bytes differ from the
+# uncompressed body, but If-None-Match still matches it (conditional.py).
+
+import gzip
+
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli  # Optional: smaller than gzip for text
+except ImportError:
+    brotli = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # Higher levels cost far more CPU per response
+MAX_SIZE = 8 * 1024 * 1024  # Larger bodies are sent as they are
+
+COMPRESSIBLE_TYPES = {
+    "application/javascript",
+    "application/json",
+    "application/manifest+json",
+    "application/xml",
+    "image/svg+xml",
+}
+
+
+def _compressible_type(content_type):
+    mimetype = content_type.split(";")[0].strip().lower()
+    if mimetype == "text/event-stream":
+        return False
+    return mimetype.startswith("text/") or mimetype in COMPRESSIBLE_TYPES
+
+
+def _choose_encoding(accept_encoding):
+    accepted = parse_accept_header(accept_encoding)
+    if brotli is not None and accepted.quality("br") > 0 and accepted.quality("br") >= accepted.quality("gzip"):
+        return "br"
+    if accepted.quality("gzip") > 0:
+        return "gzip"
+    return None
+
+
+def _compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    def __init__(self, app, min_size=1024):
+        self.app = app
+        self.min_size = min_size
+
+    def _should_compress(self, status, headers):
+        if not status.startswith("200") or "Content-Encoding" in headers:
+            return False
+        if "no-transform" in headers.get("Cache-Control", ""):
+            return False
+        if not _compressible_type(headers.get("Content-Type", "")):
+            return False
+        length = headers.get("Content-Length")
+        return length is not None and length.isdigit() and self.min_size <= int(length) <= MAX_SIZE
+
+    def __call__(self, environ, start_response):
+        encoding = _choose_encoding(environ.get("HTTP_ACCEPT_ENCODING", ""))
+        if encoding is None or environ["REQUEST_METHOD"] == "HEAD":
+            return self.app(environ, start_response)
+
+        response = {}
+        written = []
+
+        def capture(status, headers, exc_info=None):
+            if exc_info is not None:
+                # An error after the start: let the server handle it
+                return start_response(status, headers, exc_info)
+            response["status"] = status
+            response["headers"] = Headers(headers)
+            return written.append
+
+        body_iter = self.app(environ, capture)
+        if "status" not in response:
+            # Not started yet (an app that starts once its body is iterated)
+            # or started with exc_info. Flask starts before returning.
+            return _start_deferred(response, written, body_iter, start_response)
+        status, headers = response["status"], response["headers"]
+        if not self._should_compress(status, headers):
+            start_response(status, headers.to_wsgi_list())
+            if not written:
+                return body_iter
+            return _prepend(written, body_iter)
+
+        try:
+            body = b"".join(written) + b"".join(body_iter)
+        finally:
+            if hasattr(body_iter, "close"):
+                body_iter.close()
+        body = _compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+        headers["Content-Length"] = str(len(body))
+        vary = headers.get("Vary")
+        if not vary:
+            headers["Vary"] = "Accept-Encoding"
+        elif "accept-encoding" not in vary.lower():
+            headers["Vary"] = f"{vary}, Accept-Encoding"
+        etag = headers.get("ETag")
+        if etag and not etag.startswith("W/"):
+            headers["ETag"] = f"W/{etag}"
+        start_response(status, headers.to_wsgi_list())
+        return [body]
+
+
+def _prepend(chunks, body_iter):
+    try:
+        yield from chunks
+        yield from body_iter
+    finally:
+        if hasattr(body_iter, "close"):
+            body_iter.close()
+
+
+def _start_deferred(response, written, body_iter, start_response):
+    """Passes on, uncompressed, a response whose app calls start_response
+    while its body is iterated: the captured status and headers are sent
+    before the first chunk."""
+    started = False
+    try:
+        for chunk in body_iter:
+            if not started and "status" in response:
+                start_response(response["status"], response["headers"].to_wsgi_list())
+                started = True
+            while written:  # From the write() callable
+                yield written.pop(0)
+            yield chunk
+        if not started and "status" in response:
+            start_response(response["status"], response["headers"].to_wsgi_list())
+        yield from written
+    finally:
+        if hasattr(body_iter, "close"):
+            body_iter.close()
@@ -0,0 +1,180 @@
+# conditional.py
+# HTTP validators (ETag and Last-Modified), so that repeat views and polls
+# are answered with an empty 304 Not Modified.
+#
+# Views whose body is expensive to build declare a version with
+# @conditional(version_of). version_of(**view_args) runs one aggregate query
+# over the rows the body is built from: the episode's last_updated, and the
+# count, highest id and latest timestamp of its comments, scenes and video
+# generations. When the request's If-None-Match (or If-Modified-Since) still
+# matches, the view is not called: no queries beyond that one, no template
+# rendering. Otherwise the view runs and its response gets the validators.
+#
+# Every other HTML or JSON GET gets a weak ETag hashed from its body. That
+# saves the transfer of an unchanged body (e.g. a generation status poll),
+# not the work of building it.
+#
+# Both kinds are sent with "Cache-Control: private, no-cache": the browser
+# keeps the body and asks again every time. Version ETags include the user
+# (pages differ per user) and the process start: after a deploy or an asset
+# build (both need a restart) no page linking old scripts is revalidated.
+# Renaming a user or a maslak does not change a version; those pages refresh
+# on the next other change.
+
+import functools
+import hashlib
+import time
+
+from flask import current_app, request, session
+from flask.globals import request_ctx
+from flask_login import current_user
+from werkzeug.http import is_resource_modified
+
+from models import db, Assignment, Comment, Episode, Maslak, Scene, User, VideoGeneration
+
+
+def _count_and_newest(model, *where, newest=None):
+    """Scalar subqueries: row count, highest id and (optionally) the newest
+    value of a timestamp column."""
+    columns = [db.func.count(model.id), db.func.max(model.id)]
+    if newest is not None:
+        columns.append(db.func.max(newest))
+    return [db.select(column).where(*where).scalar_subquery() for column in columns]
+
+
+def _latest(*timestamps):
+    known = [ts for ts in timestamps if ts is not None]
+    return max(known) if known else None
+
+
+# --- Versions ---
+def episode_version(episode_id):
+    """Version of the episode page: the episode row, its comments, scenes,
+    generations and assignees, and the user and maslak lists it offers."""
+    generation_filter = (
+        VideoGeneration.scene_id.in_(db.select(Scene.id).where(Scene.episode_id == episode_id)),
+    )
+    row = db.session.execute(
+        db.select(
+            Episode.last_updated,
+            *_count_and_newest(Comment, Comment.episode_id == episode_id, newest=Comment.timestamp),
+            *_count_and_newest(Scene, Scene.episode_id == episode_id, newest=Scene.updated_at),
+            *_count_and_newest(VideoGeneration, *generation_filter, newest=VideoGeneration.updated_at),
+            *_count_and_newest(Assignment, Assignment.episode_id == episode_id),
+            db.select(db.func.total(Assignment.user_id))
+            .where(Assignment.episode_id == episode_id)
+            .scalar_subquery(),
+            *_count_and_newest(User),
+            *_count_and_newest(Maslak),
+        ).where(Episode.id == episode_id)
+    ).first()
+    if row is None:
+        return None  # The view answers 404
+    last_modified = _latest(row[0], row[3], row[6], row[9])
+    return tuple(row), last_modified
+
+
+def dashboard_version():
+    """Version of the dashboard: every episode (filters only narrow it), the
+    assignments and the user and maslak lists."""
+    row = db.session.execute(
+        db.select(
+            *_count_and_newest(Episode, newest=Episode.last_updated),
+            *_count_and_newest(Assignment),
+            db.select(db.func.total(Assignment.user_id)).scalar_subquery(),
+            *_count_and_newest(User),
+            *_count_and_newest(Maslak),
+        )
+    ).one()
+    return tuple(row), row[2]
+
+
+def block_comments_version(episode_id):
+    """Version of one block's comment thread. Re-anchoring moves comments
+    between blocks only on scenario saves, which bump last_updated."""
+    block_index = request.args.get("block", type=int)
+    row = db.session.execute(
+        db.select(
+            Episode.last_updated,
+            *_count_and_newest(
+                Comment,
+                Comment.episode_id == episode_id,
+                Comment.block_index == block_index,
+                newest=Comment.timestamp,
+            ),
+        ).where(Episode.id == episode_id)
+    ).first()
+    if row is None:
+        return None
+    return tuple(row), _latest(row[0], row[3])
+
+
+# --- Validators ---
+def _etag(version):
+    user = (current_user.id, current_user.is_admin) if current_user.is_authenticated else None
+    key = repr((version, user, request.full_path, current_app.extensions["release"]))
+    return hashlib.sha1(key.encode()).hexdigest()[:24]
+
+
+def _set_validators(response, etag, last_modified=None):
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def conditional(version_of):
+    """Answers 304 before the view runs when version_of(**view_args) (a
+    (version, last_modified) pair, or None to skip) still matches."""
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            # A pending flashed message must be rendered, not skipped; with
+            # templates reloading (development) an edit changes no version
+            if session.get("_flashes") or current_app.jinja_env.auto_reload:
+                return view(**kwargs)
+            version = version_of(**kwargs)
+            if version is None:
+                return view(**kwargs)
+            parts, last_modified = version
+            etag = _etag(parts)
+            if last_modified is not None:
+                last_modified = last_modified.replace(microsecond=0)
+            if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                return _set_validators(current_app.response_class(status=304), etag, last_modified)
+            response = current_app.make_response(view(**kwargs))
+            if response.status_code == 200:
+                _set_validators(response, etag, last_modified)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def _finish_conditional(response):
+    if request_ctx.flashes:
+        # A page showing flashed messages must not come back from a cache
+        # (the browser's or the service worker's)
+        response.cache_control.no_store = True
+        return response
+    if (
+        request.method not in ("GET", "HEAD")
+        or response.status_code != 200
+        or response.mimetype not in ("text/html", "application/json")
+        or response.is_streamed
+        or response.headers.get("ETag")
+        or response.cache_control.no_store
+    ):
+        return response
+    _set_validators(response, hashlib.sha1(response.get_data()).hexdigest()[:24])
+    return response.make_conditional(request)
+
+
+def init_conditional(app):
+    """Adds body ETags and 304 answers to the app's HTML and JSON GETs."""
+    app.extensions["release"] = str(time.time())
+    app.after_request(_finish_conditional)
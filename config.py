@@ -0,0 +1,88 @@
+# config.py
+# Configuration classes for create_app(). Pick one by name with the APP_CONFIG
+# environment variable (development, production, testing) or pass it directly:
+# create_app("production").
+
+import os
+from dotenv import load_dotenv
+
+# The classes read the environment when this module is imported
+load_dotenv()
+
+DB_PATH = os.path.join(os.path.dirname(__file__), "instance", "app.db")
+DEFAULT_TRACE_LOG_PATH = os.path.join(os.path.dirname(__file__), "instance", "logs", "upstream.jsonl")
+
+
+class Config:
+    SECRET_KEY = os.environ.get("SECRET_KEY", "your_default_secret_key_arabic")
+    SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL", f"sqlite:///{DB_PATH}")
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    FLASK_ADMIN_SWATCH = "cerulean"
+    # warm_up() also fills the OpenRouter model list and the FX rate, which
+    # takes network calls; off where startup should stay local.
+    WARM_UP_REMOTE = False
+    # Requests slower than this are logged with their SQL and upstream time
+    SLOW_REQUEST_MS = int(os.environ.get("SLOW_REQUEST_MS", "1000"))
+    # /metrics answers "Authorization: Bearer <token>" and admin logins only
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+    # Serve /metrics to anyone: only for a local run that asks for it
+    METRICS_PUBLIC = os.environ.get("METRICS_PUBLIC") == "1"
+    # Upstream call spans (tracing.py): JSON lines file, "-" for stderr, "" off
+    TRACE_LOG_PATH = os.environ.get("TRACE_LOG_PATH", DEFAULT_TRACE_LOG_PATH)
+    TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0.1"))
+    TRACE_SLOW_MS = int(os.environ.get("TRACE_SLOW_MS", "2000"))  # Always traced
+    TRACE_LOG_MAX_MB = int(os.environ.get("TRACE_LOG_MAX_MB", "20"))
+    # Live co-editing (collab.py) keeps its state in the process: turn it off
+    # to run several workers (gunicorn.conf.py refuses them while it is on)
+    LIVE_EDITING = os.environ.get("LIVE_EDITING", "1") == "1"
+    # Live editing event streams served at once by one process; each holds a
+    # thread (gunicorn.conf.py sets it to GUNICORN_THREADS - 4)
+    LIVE_MAX_STREAMS = int(os.environ.get("LIVE_MAX_STREAMS", "12"))
+    # Shared upstream/activity cache (cache.py): "sqlite:///path" (default
+    # instance/cache.db), "redis://..." or "memory"
+    CACHE_URL = os.environ.get("CACHE_URL")
+    # gzip/brotli of text responses (compression.py); off behind a proxy that compresses
+    COMPRESS_RESPONSES = os.environ.get("COMPRESS_RESPONSES", "1") == "1"
+    COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", "1024"))  # Bytes
+
+
+class DevelopmentConfig(Config):
+    TEMPLATES_AUTO_RELOAD = True
+
+
+class ProductionConfig(Config):
+    SECRET_KEY = os.environ.get("SECRET_KEY")
+    SESSION_COOKIE_SECURE = os.environ.get("SESSION_COOKIE_SECURE", "1") == "1"
+    REMEMBER_COOKIE_SECURE = SESSION_COOKIE_SECURE
+    WARM_UP_REMOTE = True
+
+
+class TestingConfig(Config):
+    TESTING = True
+    # In memory: a test run never touches instance/app.db
+    SQLALCHEMY_DATABASE_URI = os.environ.get("TEST_DATABASE_URL", "sqlite://")
+    TRACE_LOG_PATH = ""
+    AUDIT_ARCHIVE_INTERVAL_HOURS = 0  # No archiving thread
+    CACHE_URL = "memory"  # Nothing shared with (or left in) instance/cache.db
+    WTF_CSRF_ENABLED = False
+
+
+CONFIGS = {
+    "development": DevelopmentConfig,
+    "production": ProductionConfig,
+    "testing": TestingConfig,
+}
+
+
+def get_config(config=None):
+    """The config class for a name, a class, or APP_CONFIG (default development)."""
+    if config is None:
+        config = os.environ.get("APP_CONFIG", "development")
+    if isinstance(config, str):
+        try:
+            return CONFIGS[config]
+        except KeyError:
+            raise ValueError(
+                f"Unknown config {config!r}; expected one of {', '.join(CONFIGS)}."
+            ) from None
+    return config
@@ -0,0 +1,56 @@
+# gunicorn.conf.py
+# gunicorn -c gunicorn.conf.py wsgi:application
+#
+# The app is loaded and warmed up once in the master (preload_app), then
+# forked: every worker starts with imports, compiled templates and SQL, and
+# the OpenRouter caches already in memory, so adding workers costs little
+# memory (copy-on-write) and no extra startup work. Because the code is
+# loaded by the master, deploy new code with a restart (or USR2), not HUP.
+#
+# Live editing (collab.py) keeps its state in the worker's memory, so the
+# default is one worker with many threads. Each
+# open episode page holds one thread for its event stream, so the worker
+# serves at most LIVE_MAX_STREAMS streams (default: all threads but
+# RESERVED_THREADS, which stay free for normal requests); further pages are
+# refused with a 503 and retry. Raise GUNICORN_THREADS for more open pages.
+# More workers (WEB_CONCURRENCY) need LIVE_EDITING=0: with live editing on,
+# startup is refused.
+
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()  # As config.py does, so LIVE_EDITING may come from .env
+
+bind = os.environ.get("GUNICORN_BIND", "127.0.0.1:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+if workers > 1 and os.environ.get("LIVE_EDITING", "1") == "1":
+    raise RuntimeError(
+        f"WEB_CONCURRENCY={workers} with live editing on: live edits are kept "
+        "in one process. Run one worker or set LIVE_EDITING=0."
+    )
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "16"))
+RESERVED_THREADS = 4
+# Read by config.py when the app is loaded, after this file
+os.environ.setdefault("LIVE_MAX_STREAMS", str(max(threads - RESERVED_THREADS, 1)))
+preload_app = True
+# PDF export and Drive uploads can take a while
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+accesslog = "-"
+
+
+def post_fork(server, worker):
+    from wsgi import application
+    from app import init_worker
+
+    init_worker(application)
+    server.log.info("Worker %s ready", worker.pid)
+
+
+def worker_exit(server, worker):
+    from wsgi import application
+    from app import shutdown_worker
+
+    shutdown_worker(application)
@@ -0,0 +1,362 @@
+# loadtest/fake_upstream.py
+# Local stand-in for the services the video flow calls: OpenRouter (video
+# jobs, polling, downloads, credits), Google OAuth token refresh, the Drive v3
+# file, upload, permission and media endpoints, and frankfurter's FX rate.
+# Every response waits a configurable latency and fails (503) at a
+# configurable rate, so load tests can size workers without spending credits
+# or touching the real Drive.
+#
+#   python loadtest/fake_upstream.py --port 8090 --latency 0.3 --fail-rate 0.02
+#
+# It prints the environment to start the app with ("Load testing" in README.md).
+# State lives in memory: run it as a single process.
+
+import argparse
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+
+from flask import Flask, Response, abort, jsonify, request
+
+MODELS = [
+    {
+        "id": "fake/video-fast",
+        "name": "Fake video (fast)",
+        "supported_resolutions": ["480p", "720p"],
+        "supported_aspect_ratios": ["16:9", "9:16"],
+        "supported_durations": [4, 8],
+    },
+    {
+        "id": "fake/video-hd",
+        "name": "Fake video (HD)",
+        "supported_resolutions": ["720p", "1080p"],
+        "supported_aspect_ratios": ["16:9", "1:1", "9:16"],
+        "supported_durations": [5, 10],
+    },
+]
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+DRIVE_SCOPE = "https://www.googleapis.com/auth/drive"
+
+DEFAULTS = {
+    "latency": 0.2,  # seconds, all services unless overridden below
+    "openrouter_latency": None,
+    "drive_latency": None,
+    "fx_latency": None,
+    "token_latency": None,
+    "jitter": 0.5,  # latency varies by +/- this fraction
+    "fail_rate": 0.0,  # share of requests answered with 503
+    "render_seconds": 20.0,  # until a job completes
+    "render_fail_rate": 0.05,  # share of jobs that end "failed"
+    "video_bytes": 2 * 1024 * 1024,
+    "cost_per_second": 0.1,  # USD per second of video
+    "total_credits": 1000.0,
+}
+
+
+class UpstreamState:
+    def __init__(self, settings):
+        self.settings = settings
+        self.lock = threading.Lock()
+        self.jobs = {}  # job id -> job dict
+        self.files = {}  # Drive file id -> metadata dict (+ "size")
+        self.uploads = {}  # upload session id -> {"metadata", "received"}
+        self.usage = 0.0
+        self.requests = {}  # service -> count
+        self.failures = {}  # service -> count
+        self._ids = itertools.count(1)
+
+    def new_id(self, prefix):
+        return f"{prefix}{next(self._ids)}{uuid.uuid4().hex[:6]}"
+
+
+def create_app(settings=None):
+    settings = dict(DEFAULTS, **(settings or {}))
+    state = UpstreamState(settings)
+    app = Flask(__name__)
+    app.extensions["fake_upstream"] = state
+    video = bytes(range(256)) * (settings["video_bytes"] // 256 + 1)
+    video = video[: settings["video_bytes"]]
+
+    def service_of(path):
+        if path.startswith("/api/v1/"):
+            return "openrouter"
+        if path.startswith(("/drive/", "/upload/drive/")):
+            return "drive"
+        if path.startswith("/fx/"):
+            return "fx"
+        if path == "/token":
+            return "token"
+        return None
+
+    @app.before_request
+    def simulate_network():
+        service = service_of(request.path)
+        if service is None:
+            return None
+        with state.lock:
+            state.requests[service] = state.requests.get(service, 0) + 1
+        latency = settings[f"{service}_latency"]
+        if latency is None:
+            latency = settings["latency"]
+        jitter = settings["jitter"]
+        time.sleep(max(0.0, latency * random.uniform(1 - jitter, 1 + jitter)))
+        if random.random() < settings["fail_rate"]:
+            with state.lock:
+                state.failures[service] = state.failures.get(service, 0) + 1
+            return jsonify({"error": {"code": 503, "message": "Simulated upstream failure"}}), 503
+        return None
+
+    def base_url():
+        return request.host_url.rstrip("/")
+
+    # --- OpenRouter ---
+    @app.route("/api/v1/videos/models")
+    def models():
+        return jsonify({"data": MODELS})
+
+    @app.route("/api/v1/videos", methods=["POST"])
+    def submit_job():
+        payload = request.get_json(silent=True) or {}
+        if not payload.get("prompt") or not payload.get("model"):
+            return jsonify({"error": {"code": 400, "message": "prompt and model are required"}}), 400
+        job_id = state.new_id("job-")
+        with state.lock:
+            state.jobs[job_id] = {
+                "id": job_id,
+                "model": payload["model"],
+                "duration": int(payload.get("duration") or 5),
+                "submitted": time.time(),
+                "fails": random.random() < settings["render_fail_rate"],
+                "charged": False,
+            }
+        return jsonify(
+            {"id": job_id, "polling_url": f"{base_url()}/api/v1/videos/{job_id}", "status": "pending"}
+        )
+
+    @app.route("/api/v1/videos/<job_id>")
+    def poll_job(job_id):
+        job = state.jobs.get(job_id) or abort(404)
+        elapsed = time.time() - job["submitted"]
+        render = settings["render_seconds"]
+        body = {"id": job_id, "model": job["model"]}
+        if elapsed < render * 0.2:
+            body["status"] = "pending"
+        elif elapsed < render:
+            body["status"] = "in_progress"
+        elif job["fails"]:
+            body.update(status="failed", error="Simulated render failure")
+        else:
+            cost = round(job["duration"] * settings["cost_per_second"], 4)
+            with state.lock:
+                if not job["charged"]:
+                    job["charged"] = True
+                    state.usage += cost
+            body.update(
+                status="completed",
+                unsigned_urls=[f"{base_url()}/api/v1/videos/{job_id}/content"],
+                usage={"cost": cost},
+            )
+        return jsonify(body)
+
+    @app.route("/api/v1/videos/<job_id>/content")
+    def download_job(job_id):
+        if job_id not in state.jobs:
+            abort(404)
+        return Response(video, mimetype="video/mp4")
+
+    @app.route("/api/v1/credits")
+    def credits():
+        return jsonify(
+            {"data": {"total_credits": settings["total_credits"], "total_usage": round(state.usage, 4)}}
+        )
+
+    # --- frankfurter ---
+    @app.route("/fx/latest")
+    def fx_rate():
+        return jsonify({"amount": 1.0, "base": "USD", "rates": {"EUR": 0.92}})
+
+    # --- Google OAuth ---
+    @app.route("/token", methods=["POST"])
+    def token():
+        return jsonify(
+            {
+                "access_token": f"fake-{uuid.uuid4().hex}",
+                "expires_in": 3600,
+                "token_type": "Bearer",
+                "scope": DRIVE_SCOPE,
+            }
+        )
+
+    # --- Drive v3 ---
+    def drive_file(metadata, size=0):
+        file_id = state.new_id("file-")
+        entry = {
+            "id": file_id,
+            "name": metadata.get("name", "untitled"),
+            "mimeType": metadata.get("mimeType", "application/octet-stream"),
+            "parents": metadata.get("parents") or [],
+            "shared": False,
+            "owners": [{"emailAddress": "loadtest@example.com"}],
+            "webViewLink": f"{base_url()}/drive/view/{file_id}",
+            "size": str(size),
+        }
+        with state.lock:
+            state.files[file_id] = entry
+        return entry
+
+    @app.route("/drive/v3/files", methods=["GET"])
+    def list_files():
+        query = request.args.get("q", "")
+        name = re.search(r"name='((?:\\'|[^'])*)'", query)
+        parent = re.search(r"'([^']+)' in parents", query)
+        folders_only = f"mimeType='{FOLDER_MIME_TYPE}'" in query
+        matches = [
+            entry
+            for entry in list(state.files.values())
+            if (name is None or entry["name"] == name.group(1).replace("\\'", "'"))
+            and (parent is None or parent.group(1) in entry["parents"])
+            and (not folders_only or entry["mimeType"] == FOLDER_MIME_TYPE)
+        ]
+        page_size = request.args.get("pageSize", 100, type=int)
+        return jsonify({"files": matches[:page_size]})
+
+    @app.route("/drive/v3/files", methods=["POST"])
+    def create_file():
+        return jsonify(drive_file(request.get_json(silent=True) or {}))
+
+    @app.route("/upload/drive/v3/files", methods=["POST"])
+    def start_upload():
+        upload_type = request.args.get("uploadType")
+        if upload_type != "resumable":
+            # multipart/media uploads: the whole file in this request
+            return jsonify(drive_file({"name": "upload.mp4"}, len(request.get_data())))
+        session_id = state.new_id("upload-")
+        with state.lock:
+            state.uploads[session_id] = {
+                "metadata": request.get_json(silent=True) or {},
+                "received": 0,
+            }
+        response = Response(status=200)
+        response.headers["Location"] = f"{base_url()}/upload/drive/v3/files?upload_id={session_id}"
+        return response
+
+    @app.route("/upload/drive/v3/files", methods=["PUT"])
+    def continue_upload():
+        session = state.uploads.get(request.args.get("upload_id")) or abort(404)
+        chunk = len(request.get_data())
+        content_range = request.headers.get("Content-Range", "")
+        total = re.search(r"/(\d+)$", content_range)
+        with state.lock:
+            session["received"] += chunk
+            received = session["received"]
+        if total is not None and received < int(total.group(1)):
+            response = Response(status=308)
+            response.headers["Range"] = f"bytes=0-{received - 1}"
+            return response
+        with state.lock:
+            state.uploads.pop(request.args.get("upload_id"), None)
+        return jsonify(drive_file(session["metadata"], received))
+
+    @app.route("/drive/v3/files/<file_id>", methods=["GET"])
+    def get_file(file_id):
+        entry = state.files.get(file_id) or abort(404)
+        if request.args.get("alt") != "media":
+            return jsonify(entry)
+        size = min(int(entry["size"]) or len(video), len(video))
+        match = re.match(r"bytes=(\d+)-(\d*)", request.headers.get("Range", ""))
+        if match is None:
+            return Response(video[:size], mimetype="video/mp4")
+        start = int(match.group(1))
+        end = min(int(match.group(2)) if match.group(2) else size - 1, size - 1)
+        response = Response(video[start : end + 1], status=206, mimetype="video/mp4")
+        response.headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        return response
+
+    @app.route("/drive/v3/files/<file_id>", methods=["DELETE"])
+    def delete_file(file_id):
+        with state.lock:
+            state.files.pop(file_id, None)
+        return Response(status=204)
+
+    @app.route("/drive/v3/files/<file_id>/permissions", methods=["POST"])
+    def create_permission(file_id):
+        if file_id not in state.files:
+            abort(404)
+        return jsonify({"kind": "drive#permission", "id": "anyoneWithLink", "type": "anyone", "role": "reader"})
+
+    # --- Inspection ---
+    @app.route("/__stats")
+    def stats():
+        with state.lock:
+            return jsonify(
+                {
+                    "requests": state.requests,
+                    "failures": state.failures,
+                    "jobs": len(state.jobs),
+                    "drive_files": len(state.files),
+                    "usage_usd": round(state.usage, 4),
+                }
+            )
+
+    return app
+
+
+def write_credentials(directory, base_url):
+    """Writes Drive OAuth client config and tokens that refresh against this
+    server. Returns the environment the app needs."""
+    os.makedirs(directory, exist_ok=True)
+    client_path = os.path.join(directory, "drive-client.json")
+    tokens_path = os.path.join(directory, "drive-tokens.json")
+    with open(client_path, "w") as f:
+        json.dump(
+            {
+                "installed": {
+                    "client_id": "loadtest",
+                    "client_secret": "loadtest",
+                    "auth_uri": f"{base_url}/auth",
+                    "token_uri": f"{base_url}/token",
+                }
+            },
+            f,
+        )
+    with open(tokens_path, "w") as f:
+        json.dump({"refresh_token": "loadtest"}, f)
+    return {
+        "OPENROUTER_BASE_URL": f"{base_url}/api/v1",
+        "OPENROUTER_API_KEY": "loadtest",
+        "FX_API_URL": f"{base_url}/fx/latest",
+        "GOOGLE_API_ROOT_URL": f"{base_url}/",
+        "GOOGLE_DRIVE_CREDENTIALS_PATH": os.path.abspath(client_path),
+        "GOOGLE_DRIVE_OAUTH_TOKENS_PATH": os.path.abspath(tokens_path),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in for OpenRouter, Google Drive and frankfurter.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    for name, default in DEFAULTS.items():
+        option = "--" + name.replace("_", "-")
+        parser.add_argument(option, type=float if name != "video_bytes" else int, default=default)
+    parser.add_argument(
+        "--credentials-dir",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "credentials"),
+        help="Where to write the Drive credentials the app should use.",
+    )
+    args = parser.parse_args()
+    settings = {name: getattr(args, name) for name in DEFAULTS}
+    base_url = f"http://{args.host}:{args.port}"
+    environment = write_credentials(args.credentials_dir, base_url)
+    print("Start the app with:")
+    for key, value in environment.items():
+        print(f"  export {key}={value}")
+    create_app(settings).run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+# loadtest/locustfile.py
+# Load-test scenarios for the app (https://locust.io). Three kinds of users,
+# each logged in as one of the accounts in fixture.json (loadtest/seed.py):
+#
+#   EditorUser     reads the dashboard and episodes, saves the scenario,
+#                  comments, opens comment threads, the activity feed, search
+#   PollerUser     an open episode page: polls the credit balance and the
+#                  status of generations in progress, as video_section.js does
+#   GeneratorUser  submits video generations and follows each one through
+#                  polling, download, upload to Drive and playback
+#
+# Point the app at loadtest/fake_upstream.py first, or the generators spend
+# real OpenRouter credits. See "Load testing" in README.md.
+#
+#   locust -f loadtest/locustfile.py --host http://127.0.0.1:8000
+
+import itertools
+import json
+import os
+import random
+import threading
+import time
+
+from locust import HttpUser, between, constant, task
+
+FIXTURE_PATH = os.environ.get(
+    "LOADTEST_FIXTURE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixture.json")
+)
+MODEL = os.environ.get("LOADTEST_MODEL", "fake/video-fast")
+TERMINAL_STATUSES = {"completed", "failed", "cancelled", "expired"}
+
+with open(FIXTURE_PATH) as f:
+    FIXTURE = json.load(f)
+_accounts = itertools.cycle(FIXTURE["users"])
+_accounts_lock = threading.Lock()
+
+# Generations in progress, shared so pollers watch what generators started
+active_generations = set()
+
+
+def _next_account():
+    with _accounts_lock:
+        return next(_accounts)
+
+
+class _AppUser(HttpUser):
+    abstract = True
+
+    def on_start(self):
+        account = _next_account()
+        self.episodes = account["episodes"]
+        self.client.post(
+            "/login",
+            data={"username": account["username"], "password": FIXTURE["password"]},
+            name="/login",
+        )
+
+    def _episode(self):
+        return random.choice(self.episodes)
+
+    def _json(self, method, url, name, **kwargs):
+        """Sends a request and marks it failed unless it returns {"success": true}."""
+        with self.client.request(method, url, name=name, catch_response=True, **kwargs) as response:
+            try:
+                body = response.json()
+            except ValueError:
+                response.failure(f"HTTP {response.status_code}, not JSON")
+                return None
+            if not body.get("success"):
+                response.failure(body.get("message") or f"HTTP {response.status_code}")
+                return None
+            return body
+
+
+class EditorUser(_AppUser):
+    weight = 6
+    wait_time = between(2, 8)
+
+    @task(1)
+    def dashboard(self):
+        self.client.get("/", name="/")
+
+    @task(3)
+    def view_episode(self):
+        self.client.get(f"/episode/{self._episode()['id']}", name="/episode/[id]")
+
+    @task(2)
+    def save_scenario(self):
+        episode_id = self._episode()["id"]
+        blocks = [f"Load test block {b}" for b in range(10)]
+        blocks[random.randrange(len(blocks))] += f" edit {random.randrange(10**6)}"
+        self._json(
+            "POST",
+            f"/episode/{episode_id}/update",
+            "/episode/[id]/update",
+            json={"scenario": "\n\n".join(blocks)},
+        )
+
+    @task(1)
+    def add_comment(self):
+        self._json(
+            "POST",
+            f"/episode/{self._episode()['id']}/comments",
+            "/episode/[id]/comments [POST]",
+            json={"block_index": random.randrange(10), "text": "load test comment"},
+        )
+
+    @task(2)
+    def read_comments(self):
+        self._json(
+            "GET",
+            f"/episode/{self._episode()['id']}/comments?block={random.randrange(10)}",
+            "/episode/[id]/comments",
+        )
+
+    @task(1)
+    def activity(self):
+        self._json(
+            "GET", f"/api/episodes/{self._episode()['id']}/activity", "/api/episodes/[id]/activity"
+        )
+
+    @task(1)
+    def search(self):
+        self._json("GET", f"/api/search?q=block+{random.randrange(10)}", "/api/search")
+
+
+class PollerUser(_AppUser):
+    weight = 3
+    wait_time = constant(5)
+
+    @task(1)
+    def credits(self):
+        self._json("GET", "/api/credits", "/api/credits")
+
+    @task(4)
+    def poll_generations(self):
+        for gen_id in random.sample(sorted(active_generations), min(3, len(active_generations))):
+            body = self._json("GET", f"/api/generations/{gen_id}/status", "/api/generations/[id]/status")
+            if body and body["generation"]["status"] in TERMINAL_STATUSES:
+                active_generations.discard(gen_id)
+
+
+class GeneratorUser(_AppUser):
+    weight = 1
+    wait_time = between(10, 30)
+    poll_interval = float(os.environ.get("LOADTEST_POLL_SECONDS", "5"))
+    max_wait = float(os.environ.get("LOADTEST_MAX_RENDER_SECONDS", "600"))
+
+    @task
+    def generate_video(self):
+        episode = self._episode()
+        if not episode.get("scene"):
+            return
+        body = self._json(
+            "POST",
+            f"/api/scenes/{episode['scene']}/generations",
+            "/api/scenes/[id]/generations",
+            json={"prompt": "A load test scene", "model": MODEL, "duration": 4},
+        )
+        if body is None:
+            return
+        gen_id = body["generation"]["id"]
+        active_generations.add(gen_id)
+        try:
+            status = self._wait_for(gen_id)
+        finally:
+            active_generations.discard(gen_id)
+        if status != "completed":
+            return
+        if self._json("POST", f"/api/generations/{gen_id}/download", "/api/generations/[id]/download") is None:
+            return
+        if self._json(
+            "POST", f"/api/generations/{gen_id}/save-to-drive", "/api/generations/[id]/save-to-drive"
+        ) is None:
+            return
+        # The <video> element's first range request
+        self.client.get(
+            f"/api/generations/{gen_id}/stream",
+            headers={"Range": "bytes=0-1048575"},
+            name="/api/generations/[id]/stream",
+        )
+
+    def _wait_for(self, gen_id):
+        deadline = time.time() + self.max_wait
+        while time.time() < deadline:
+            time.sleep(self.poll_interval)
+            body = self._json("GET", f"/api/generations/{gen_id}/status", "/api/generations/[id]/status")
+            if body and body["generation"]["status"] in TERMINAL_STATUSES:
+                return body["generation"]["status"]
+        return None
@@ -0,0 +1,111 @@
+# loadtest/seed.py
+# Adds load-test users, episodes and scenes to the app's database and writes
+# loadtest/fixture.json, the accounts and ids locustfile.py uses. Safe to run
+# again: existing load-test users and episodes are reused.
+#
+#   python loadtest/seed.py --users 50 --episodes 100
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+from app import create_app  # noqa: E402
+from commands import _create_db_and_seed  # noqa: E402
+from models import db, Assignment, Episode, Maslak, Scene, User  # noqa: E402
+
+PASSWORD = "loadtest"
+
+
+def seed(user_count, episode_count, assignees):
+    rng = random.Random(7)
+    with contextlib.redirect_stdout(io.StringIO()):
+        _create_db_and_seed()
+    password_hash = generate_password_hash(PASSWORD, method="pbkdf2:sha256")
+    users = []
+    for i in range(user_count):
+        username = f"loadtest_{i}"
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            user = User(username=username, password=password_hash, is_admin=False)
+            db.session.add(user)
+        users.append(user)
+    maslak = Maslak.query.order_by(Maslak.id).first()
+    episodes = []
+    for i in range(episode_count):
+        title = f"Load test {i}"
+        episode = Episode.query.filter_by(title=title, maslak_id=maslak.id).first()
+        if episode is None:
+            episode = Episode(
+                title=title,
+                maslak_id=maslak.id,
+                scenario="\n\n".join(f"Load test block {b}" for b in range(10)),
+                display_order=10000 + i,
+            )
+            db.session.add(episode)
+            db.session.flush()
+            db.session.add(Scene(episode_id=episode.id, number=1))
+        episodes.append(episode)
+    db.session.flush()
+
+    for episode in episodes:
+        for user in rng.sample(users, min(assignees, len(users))):
+            if not Assignment.query.filter_by(user_id=user.id, episode_id=episode.id).first():
+                db.session.add(Assignment(user_id=user.id, episode_id=episode.id))
+    db.session.commit()
+
+    usernames = {user.id: user.username for user in users}
+    episode_ids = [episode.id for episode in episodes]
+    assigned = {}
+    for user_id, episode_id in db.session.query(Assignment.user_id, Assignment.episode_id).filter(
+        Assignment.user_id.in_(usernames), Assignment.episode_id.in_(episode_ids)
+    ):
+        assigned.setdefault(usernames[user_id], []).append(episode_id)
+
+    scenes = {
+        episode_id: scene_id
+        for scene_id, episode_id in db.session.query(Scene.id, Scene.episode_id).filter(
+            Scene.episode_id.in_(episode_ids)
+        )
+    }
+    return {
+        "password": PASSWORD,
+        "users": [
+            {
+                "username": user.username,
+                "episodes": [
+                    {"id": episode_id, "scene": scenes.get(episode_id)}
+                    for episode_id in sorted(assigned[user.username])
+                ],
+            }
+            for user in users
+            if user.username in assigned
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seeds data for the load test.")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--episodes", type=int, default=100)
+    parser.add_argument("--assignees", type=int, default=5, help="Users per episode.")
+    parser.add_argument("--out", default=os.path.join(HERE, "fixture.json"))
+    args = parser.parse_args()
+    app = create_app()
+    with app.app_context():
+        fixture = seed(args.users, args.episodes, args.assignees)
+    with open(args.out, "w") as f:
+        json.dump(fixture, f, indent=2)
+    print(f"Wrote {args.out}: {len(fixture['users'])} users.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+# metrics.py
+# Request instrumentation: wall time, SQL query count and time, and time spent
+# waiting on upstream HTTP services (OpenRouter, Google Drive, frankfurter,
+# the backup host), per request.
+#
+# Each response carries a Server-Timing header with its own numbers (shown in
+# the browser's network panel), and /metrics exposes the totals per route in
+# the Prometheus text format. SQL is counted with SQLAlchemy engine events;
+# upstream calls through `requests` are timed by wrapping Session.send, and
+# Google API calls through timed_google_request_class(); both also hand a
+# span of each call to tracing.py.
+#
+# /metrics lists every route and upstream host, so it needs the METRICS_TOKEN
+# bearer token or an admin login; only the development config serves it to
+# anyone (METRICS_PUBLIC).
+#
+# Totals are per process: with several gunicorn workers each scrape sees the
+# worker that answered it (the default config runs one worker).
+# For streamed responses the wall time ends at the first byte.
+
+import functools
+import hmac
+import threading
+import time
+from urllib.parse import urlsplit
+
+from flask import Response, current_app, g, has_request_context, request
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from tracing import record_span
+
+# Histogram buckets (Prometheus "le" bounds)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+# --- Metric types ---
+class _Metric:
+    def __init__(self, name, help_text, kind):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self._lock = threading.Lock()
+        self._values = {}  # sorted label tuple -> value
+
+    @staticmethod
+    def _labels(labels):
+        return tuple(sorted(labels.items()))
+
+    @staticmethod
+    def _format_labels(labels, extra=()):
+        pairs = [*labels, *extra]
+        if not pairs:
+            return ""
+        body = ",".join(
+            '{}="{}"'.format(
+                key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            )
+            for key, value in pairs
+        )
+        return "{" + body + "}"
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._sample_lines(items))
+        return lines
+
+
+class Counter(_Metric):
+    def __init__(self, name, help_text):
+        super().__init__(name, help_text, "counter")
+
+    def inc(self, amount=1, **labels):
+        key = self._labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _sample_lines(self, items):
+        return [f"{self.name}{self._format_labels(key)} {value}" for key, value in items]
+
+
+class Histogram(_Metric):
+    def __init__(self, name, help_text, buckets):
+        super().__init__(name, help_text, "histogram")
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = self._labels(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def _sample_lines(self, items):
+        lines = []
+        for key, (counts, total, count) in items:
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(
+                    f"{self.name}_bucket{self._format_labels(key, [('le', f'{bound:g}')])} {bucket_count}"
+                )
+            lines.append(f"{self.name}_bucket{self._format_labels(key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {count}")
+        return lines
+
+
+REQUESTS = Counter("http_requests_total", "Requests served, by route, method and status.")
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Request wall time, by route.", DURATION_BUCKETS
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_sql_queries", "SQL queries run by one request, by route.", QUERY_COUNT_BUCKETS
+)
+SQL_SECONDS = Counter("sql_query_duration_seconds_total", "Time spent in SQL queries, by route.")
+UPSTREAM_SECONDS = Histogram(
+    "upstream_request_duration_seconds",
+    "Time waiting on upstream HTTP calls, by host (all threads).",
+    DURATION_BUCKETS,
+)
+UPSTREAM_ERRORS = Counter("upstream_request_errors_total", "Upstream HTTP calls that raised, by host.")
+METRICS = (REQUESTS, REQUEST_SECONDS, REQUEST_QUERIES, SQL_SECONDS, UPSTREAM_SECONDS, UPSTREAM_ERRORS)
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.expose())
+    return "\n".join(lines) + "\n"
+
+
+# --- Per-request recording ---
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.upstream = {}  # host -> [calls, seconds]
+
+
+def _current_timings():
+    return g.get("timings") if has_request_context() else None
+
+
+def record_upstream(host, seconds, failed=False):
+    """Counts one upstream HTTP call (any thread; per request when in one)."""
+    host = host or "unknown"
+    UPSTREAM_SECONDS.observe(seconds, host=host)
+    if failed:
+        UPSTREAM_ERRORS.inc(host=host)
+    timings = _current_timings()
+    if timings is not None:
+        calls = timings.upstream.setdefault(host, [0, 0.0])
+        calls[0] += 1
+        calls[1] += seconds
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    timings = _current_timings()
+    if timings is not None:
+        timings.sql_count += 1
+        timings.sql_seconds += time.perf_counter() - started
+
+
+def _handle_error(exception_context):
+    # The query failed: drop its start time so the stack stays balanced
+    connection = exception_context.connection
+    started = connection.info.get("query_started") if connection is not None else None
+    if started:
+        started.pop()
+
+
+def _response_size(response, streamed):
+    if not streamed:
+        return len(response.content)
+    length = response.headers.get("Content-Length")
+    return int(length) if length and length.isdigit() else None
+
+
+def _timed_send(send):
+    @functools.wraps(send)
+    def wrapper(self, prepared_request, **kwargs):
+        started = time.perf_counter()
+        response = error = None
+        try:
+            response = send(self, prepared_request, **kwargs)
+            return response
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"[:300]
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            url = urlsplit(prepared_request.url)
+            record_upstream(url.hostname, seconds, failed=error is not None)
+            retries = getattr(getattr(response, "raw", None), "retries", None)
+            record_span(
+                url.hostname,
+                prepared_request.method,
+                url.path,
+                response.status_code if response is not None else None,
+                seconds,
+                retries=len(retries.history) if retries is not None else 0,
+                size=_response_size(response, kwargs.get("stream")) if response is not None else None,
+                error=error,
+            )
+
+    wrapper._timed = True
+    return wrapper
+
+
+def instrument_requests():
+    """Times every call made with the `requests` library."""
+    import requests
+
+    if not getattr(requests.Session.send, "_timed", False):
+        requests.Session.send = _timed_send(requests.Session.send)
+
+
+class _RecordingHttp:
+    """Wraps a Google client http object to see each attempt's status and size."""
+
+    def __init__(self, http, attempts):
+        self._http = http
+        self._attempts = attempts
+
+    def request(self, uri, method="GET", *args, **kwargs):
+        response, content = self._http.request(uri, method, *args, **kwargs)
+        self._attempts.append((method, uri, response.status, len(content or b"")))
+        return response, content
+
+    def __getattr__(self, name):
+        return getattr(self._http, name)
+
+
+@functools.lru_cache(maxsize=None)
+def timed_google_request_class():
+    """googleapiclient HttpRequest that records its time and span; pass it to
+    build(..., requestBuilder=...). Imports the Google client, so call it only
+    where that is loaded anyway."""
+    from googleapiclient.http import HttpRequest
+
+    class TimedHttpRequest(HttpRequest):
+        def execute(self, http=None, num_retries=0):
+            attempts = []
+            http = _RecordingHttp(http or self.http, attempts)
+            started = time.perf_counter()
+            error = None
+            try:
+                return super().execute(http=http, num_retries=num_retries)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"[:300]
+                raise
+            finally:
+                seconds = time.perf_counter() - started
+                url = urlsplit(self.uri)
+                record_upstream(url.hostname, seconds, failed=error is not None)
+                _, _, status, size = attempts[-1] if attempts else (None, None, None, None)
+                # Repeats of one URL are retries; a resumable upload's chunks go
+                # to another URL
+                first = attempts[0][:2] if attempts else None
+                record_span(
+                    url.hostname,
+                    self.method,
+                    url.path,
+                    status,
+                    seconds,
+                    retries=sum(1 for attempt in attempts[1:] if attempt[:2] == first),
+                    size=size,
+                    error=error,
+                )
+
+    return TimedHttpRequest
+
+
+# --- Flask hooks ---
+def _start_timing():
+    g.timings = RequestTimings()
+
+
+def _server_timing(timings, total):
+    parts = [
+        f"total;dur={total * 1000:.1f}",
+        f'db;dur={timings.sql_seconds * 1000:.1f};desc="{timings.sql_count} queries"',
+    ]
+    for host, (calls, seconds) in timings.upstream.items():
+        parts.append(f'upstream;dur={seconds * 1000:.1f};desc="{host} x{calls}"')
+    return ", ".join(parts)
+
+
+def _finish_timing(response):
+    timings = g.pop("timings", None)
+    if timings is None or request.endpoint == "metrics":
+        return response
+    total = time.perf_counter() - timings.started
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+    REQUEST_SECONDS.observe(total, route=route)
+    REQUEST_QUERIES.observe(timings.sql_count, route=route)
+    SQL_SECONDS.inc(timings.sql_seconds, route=route)
+    response.headers["Server-Timing"] = _server_timing(timings, total)
+
+    if total * 1000 >= current_app.config["SLOW_REQUEST_MS"]:
+        upstream = ", ".join(
+            f"{host} {calls}x {seconds * 1000:.0f}ms"
+            for host, (calls, seconds) in timings.upstream.items()
+        )
+        current_app.logger.warning(
+            "Slow request %s %s: %.0fms, %d queries (%.0fms)%s",
+            request.method,
+            request.path,
+            total * 1000,
+            timings.sql_count,
+            timings.sql_seconds * 1000,
+            f", upstream {upstream}" if upstream else "",
+        )
+    return response
+
+
+def _may_read_metrics():
+    token = current_app.config.get("METRICS_TOKEN")
+    if token and hmac.compare_digest(
+        request.headers.get("Authorization", "").encode(), f"Bearer {token}".encode()
+    ):
+        return True
+    if current_user.is_authenticated and current_user.is_admin:
+        return True
+    return current_app.config.get("METRICS_PUBLIC", False)
+
+
+def metrics_view():
+    if not _may_read_metrics():
+        return Response(
+            "Unauthorized\n",
+            status=401,
+            mimetype="text/plain",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
+def init_metrics(app):
+    """Installs the hooks and the /metrics endpoint on the app."""
+    for name, listener in (
+        ("before_cursor_execute", _before_cursor_execute),
+        ("after_cursor_execute", _after_cursor_execute),
+        ("handle_error", _handle_error),
+    ):
+        if not event.contains(Engine, name, listener):
+            event.listen(Engine, name, listener)
+    instrument_requests()
+    app.before_request(_start_timing)
+    app.after_request(_finish_timing)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
@@ -0,0 +1,66 @@
+"""keep original text in search index
+
+Revision ID: 3c5e0b7d4a18
+Revises: 8e3d5a1f0c92
+Create Date: 2026-10-20 10:05:17.402981
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c5e0b7d4a18'
+down_revision = '8e3d5a1f0c92'
+branch_labels = None
+depends_on = None
+
+COLUMNS = (
+    "kind UNINDEXED, episode_id UNINDEXED, title, body, "
+    "raw_title UNINDEXED, raw_body UNINDEXED, "
+    "tokenize = 'unicode61 remove_diacritics 2'"
+)
+OLD_COLUMNS = (
+    "kind UNINDEXED, episode_id UNINDEXED, title, body, "
+    "tokenize = 'unicode61 remove_diacritics 2'"
+)
+# The body the app indexes for an episode: plan and scenario, blank ones left out
+EPISODE_BODY = (
+    "CASE WHEN COALESCE(e.plan, '') <> '' AND COALESCE(e.scenario, '') <> '' "
+    "THEN e.plan || char(10, 10) || e.scenario "
+    "ELSE COALESCE(NULLIF(e.plan, ''), e.scenario, '') END"
+)
+
+
+def upgrade():
+    # FTS5 tables cannot gain columns: build the new one next to the old and
+    # copy the normalized text over, taking the original from its source rows.
+    op.execute("DROP TABLE IF EXISTS search_index_new")
+    op.execute(f"CREATE VIRTUAL TABLE search_index_new USING fts5({COLUMNS})")
+    op.execute(
+        "INSERT INTO search_index_new "
+        "(rowid, kind, episode_id, title, body, raw_title, raw_body) "
+        f"SELECT s.rowid, s.kind, s.episode_id, s.title, s.body, e.title, {EPISODE_BODY} "
+        "FROM search_index s JOIN episode e ON s.rowid = e.id * 2 "
+        "WHERE s.kind = 'episode'"
+    )
+    op.execute(
+        "INSERT INTO search_index_new "
+        "(rowid, kind, episode_id, title, body, raw_title, raw_body) "
+        "SELECT s.rowid, s.kind, s.episode_id, s.title, s.body, '', COALESCE(c.text, '') "
+        "FROM search_index s JOIN comment c ON s.rowid = c.id * 2 + 1 "
+        "WHERE s.kind = 'comment'"
+    )
+    op.execute("DROP TABLE search_index")
+    op.execute("ALTER TABLE search_index_new RENAME TO search_index")
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS search_index_old")
+    op.execute(f"CREATE VIRTUAL TABLE search_index_old USING fts5({OLD_COLUMNS})")
+    op.execute(
+        "INSERT INTO search_index_old (rowid, kind, episode_id, title, body) "
+        "SELECT rowid, kind, episode_id, title, body FROM search_index"
+    )
+    op.execute("DROP TABLE search_index")
+    op.execute("ALTER TABLE search_index_old RENAME TO search_index")
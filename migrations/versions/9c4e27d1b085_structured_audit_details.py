@@ -0,0 +1,108 @@
+"""structured audit details with indexed generated columns
+
+Revision ID: 9c4e27d1b085
+Revises: 6b1f0c2d9a37
+Create Date: 2026-10-19 13:05:37.618204
+
+"""
+import json
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c4e27d1b085'
+down_revision = '6b1f0c2d9a37'
+branch_labels = None
+depends_on = None
+
+
+def _generated(key):
+    return sa.Computed(
+        f"CASE WHEN json_valid(details) THEN json_extract(details, '$.{key}') END",
+        persisted=False,
+    )
+
+
+# Free-text details written before details became JSON objects
+_LEGACY_PATTERNS = [
+    (re.compile(r"^New Status: (?P<new_status>.*)$"), {}),
+    (re.compile(r"^New Maslak ID: (?P<new_maslak_id>\d+)$"), {"new_maslak_id": int}),
+    (re.compile(r"^Block: (?P<block_index>-?\d+)$"), {"block_index": int}),
+    (re.compile(r"^Comment ID: (?P<comment_id>\d+)$"), {"comment_id": int}),
+    (re.compile(r"^Assigned User ID: (?P<assigned_user_id>\d+)$"), {"assigned_user_id": int}),
+    (re.compile(r"^Old: '(?P<old_title>.*)', New: '(?P<new_title>.*)'$", re.S), {}),
+    (re.compile(r"^Username: (?P<username>.*)$"), {}),
+    (re.compile(r"^Admin action by (?P<admin>.*)$"), {}),
+    (re.compile(r"^(?P<rows_deleted>\d+) rows deleted\.$"), {"rows_deleted": int}),
+]
+
+
+def _legacy_details(text, target_type, target_id):
+    data = None
+    try:
+        parsed = json.loads(text) if text else {}
+        if isinstance(parsed, dict):
+            data = parsed
+    except ValueError:
+        pass
+    if data is None:
+        data = {"message": text}
+        if text.startswith("Updated: "):
+            fields = [f.strip() for f in text[len("Updated: "):].split(",") if f.strip()]
+            data = {"fields": fields}
+            if len(fields) == 1:
+                data["field"] = fields[0]
+        else:
+            for pattern, casts in _LEGACY_PATTERNS:
+                match = pattern.match(text)
+                if match:
+                    data = {
+                        key: casts.get(key, str)(value)
+                        for key, value in match.groupdict().items()
+                    }
+                    break
+    if target_type == "Episode" and target_id is not None:
+        data.setdefault("episode_id", target_id)
+    return data
+
+
+def upgrade():
+    with op.batch_alter_table('audit_log', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('detail_episode_id', sa.Integer(), _generated('episode_id'), nullable=True))
+        batch_op.add_column(sa.Column('detail_field', sa.String(length=50), _generated('field'), nullable=True))
+        batch_op.add_column(sa.Column('detail_old_status', sa.String(length=50), _generated('old_status'), nullable=True))
+        batch_op.add_column(sa.Column('detail_new_status', sa.String(length=50), _generated('new_status'), nullable=True))
+
+    # Normalize existing rows into JSON objects
+    connection = op.get_bind()
+    rows = connection.execute(
+        sa.text("SELECT id, details, target_type, target_id FROM audit_log")
+    ).fetchall()
+    for row_id, details, target_type, target_id in rows:
+        data = _legacy_details(details, target_type, target_id)
+        normalized = json.dumps(data, ensure_ascii=False) if data else None
+        if normalized != details:
+            connection.execute(
+                sa.text("UPDATE audit_log SET details = :details WHERE id = :id"),
+                {"details": normalized, "id": row_id},
+            )
+
+    with op.batch_alter_table('audit_log', schema=None) as batch_op:
+        batch_op.create_index('ix_audit_log_episode', ['detail_episode_id', 'timestamp'], unique=False)
+        batch_op.create_index('ix_audit_log_field', ['detail_field', 'detail_episode_id', 'timestamp'], unique=False)
+        batch_op.create_index('ix_audit_log_status', ['detail_new_status', 'detail_old_status', 'timestamp'], unique=False)
+
+
+def downgrade():
+    # Details stay JSON text; only the generated columns and indexes go.
+    with op.batch_alter_table('audit_log', schema=None) as batch_op:
+        batch_op.drop_index('ix_audit_log_status')
+        batch_op.drop_index('ix_audit_log_field')
+        batch_op.drop_index('ix_audit_log_episode')
+        batch_op.drop_column('detail_new_status')
+        batch_op.drop_column('detail_old_status')
+        batch_op.drop_column('detail_field')
+        batch_op.drop_column('detail_episode_id')
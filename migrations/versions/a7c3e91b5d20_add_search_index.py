@@ -0,0 +1,30 @@
+"""add full-text search index
+
+Revision ID: a7c3e91b5d20
+Revises: f355712d0426
+Create Date: 2026-10-19 09:12:41.520113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e91b5d20'
+down_revision = 'f355712d0426'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # FTS5 virtual tables are not handled by autogenerate. The index is filled
+    # afterwards with `flask search-reindex` and kept current by the app.
+    op.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+        "kind UNINDEXED, episode_id UNINDEXED, title, body, "
+        "tokenize = 'unicode61 remove_diacritics 2')"
+    )
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS search_index")
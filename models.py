@@ -137,14 +137,57 @@ class Comment(db.Model):
         db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), nullable=False
     )
     block_index = db.Column(db.Integer, nullable=False)
+    # Content hash of the scenario block the comment was attached to; lets
+    # comments be re-attached when blocks move (see comment_anchors.py).
+    anchor_hash = db.Column(db.String(16), nullable=True)
     text = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     author = db.relationship("User", backref=db.backref("comments", lazy="dynamic"))
 
+    __table_args__ = (
+        db.Index("ix_comment_episode_id_block_index", "episode_id", "block_index"),
+        db.Index("ix_comment_episode_id_timestamp", "episode_id", "timestamp"),
+    )
+
     def __repr__(self):
         return f"<Comment by User {self.user_id} on Episode {self.episode_id} Block {self.block_index}>"
 
 
+# Episode revision (one row per save of plan or scenario, see revisions.py)
+class EpisodeRevision(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    episode_id = db.Column(
+        db.Integer, db.ForeignKey("episode.id", ondelete="CASCADE"), nullable=False
+    )
+    field = db.Column(db.String(20), nullable=False)  # 'plan' or 'scenario'
+    number = db.Column(db.Integer, nullable=False)
+    # Snapshots hold the full text; other rows hold a delta against number - 1.
+    is_snapshot = db.Column(db.Boolean, nullable=False, default=False)
+    data = db.Column(db.LargeBinary, nullable=False)  # zlib-compressed JSON
+    text_length = db.Column(db.Integer, nullable=False, default=0)
+    user_id = db.Column(
+        db.Integer, db.ForeignKey("user.id", ondelete="SET NULL"), nullable=True
+    )
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    episode = db.relationship(
+        "Episode",
+        backref=db.backref(
+            "revisions", lazy="dynamic", cascade="all, delete-orphan"
+        ),
+    )
+    user = db.relationship("User")
+
+    __table_args__ = (
+        db.UniqueConstraint(
+            "episode_id", "field", "number", name="_episode_field_revision_uc"
+        ),
+    )
+
+    def __repr__(self):
+        return f"<EpisodeRevision {self.field}@{self.number} of Episode {self.episode_id}>"
+
+
 # --- NEW: Audit Log Model ---
 class AuditLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -157,19 +200,58 @@ class AuditLog(db.Model):
         db.String(100), nullable=False, index=True
     )  # e.g., 'login', 'create_episode', 'update_plan'
     target_type = db.Column(
-        db.String(50), nullable=True, index=True
+        db.String(50), nullable=True
     )  # e.g., 'Episode', 'Comment', 'User'
     target_id = db.Column(db.Integer, nullable=True)
     details = db.Column(
         db.Text, nullable=True
-    )  # e.g., JSON string of changes, or simple description
+    )  # JSON object, e.g. {"episode_id": 3, "field": "scenario"}
+    # Common details keys as generated columns, so they can be indexed (audit_query.py)
+    detail_episode_id = db.Column(db.Integer, db.Computed(
+        "CASE WHEN json_valid(details) THEN json_extract(details, '$.episode_id') END",
+        persisted=False,
+    ))
+    detail_field = db.Column(db.String(50), db.Computed(
+        "CASE WHEN json_valid(details) THEN json_extract(details, '$.field') END",
+        persisted=False,
+    ))
+    detail_old_status = db.Column(db.String(50), db.Computed(
+        "CASE WHEN json_valid(details) THEN json_extract(details, '$.old_status') END",
+        persisted=False,
+    ))
+    detail_new_status = db.Column(db.String(50), db.Computed(
+        "CASE WHEN json_valid(details) THEN json_extract(details, '$.new_status') END",
+        persisted=False,
+    ))
 
     user = db.relationship("User", backref=db.backref("audit_logs", lazy="dynamic"))
 
+    __table_args__ = (
+        # History of one episode/comment/user, newest first
+        db.Index("ix_audit_log_target", "target_type", "target_id", "timestamp"),
+        db.Index("ix_audit_log_episode", "detail_episode_id", "timestamp"),
+        db.Index("ix_audit_log_field", "detail_field", "detail_episode_id", "timestamp"),
+        db.Index("ix_audit_log_status", "detail_new_status", "detail_old_status", "timestamp"),
+    )
+
     def __repr__(self):
         return f"<AuditLog {self.timestamp} User:{self.user_id} Action:{self.action}>"
 
 
+# Archived audit rows: one gzip JSONL blob per month (see audit_archive.py)
+class AuditArchiveSegment(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(7), nullable=False, index=True)  # 'YYYY-MM'
+    first_at = db.Column(db.DateTime, nullable=False)
+    last_at = db.Column(db.DateTime, nullable=False)
+    row_count = db.Column(db.Integer, nullable=False, default=0)
+    data = db.Column(db.LargeBinary, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<AuditArchiveSegment {self.period} ({self.row_count} rows)>"
+
+
 # --- End Audit Log Model ---
 
 
@@ -179,6 +261,7 @@ class Scene(db.Model):
     episode_id = db.Column(db.Integer, db.ForeignKey("episode.id", ondelete="CASCADE"), nullable=False, index=True)
     number = db.Column(db.Integer, nullable=False, default=1)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # Draft fields — let user save prompt + params without generating
     draft_prompt = db.Column(db.Text, nullable=True)
@@ -231,8 +314,38 @@ class VideoGeneration(db.Model):
     created_by = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="SET NULL"), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     completed_at = db.Column(db.DateTime, nullable=True)
+    # Any change (status, Drive upload, local copy); page validators use it
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     creator = db.relationship("User", backref=db.backref("video_generations", lazy="dynamic"))
 
+    __table_args__ = (
+        db.Index("ix_video_generation_scene_id_created_at", "scene_id", "created_at"),
+    )
+
     def __repr__(self):
         return f"<VideoGeneration {self.id} status={self.status}>"
+
+
+# SpendRollup model: cost of video generations per day, episode, model and
+# user, kept current by spend.py so reports never scan video_generation.
+class SpendRollup(db.Model):
+    __tablename__ = "spend_rollup"
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    # No foreign keys: money spent stays on the books after an episode or a
+    # user is deleted.
+    episode_id = db.Column(db.Integer, nullable=False)
+    model = db.Column(db.String(100), nullable=False)
+    user_id = db.Column(db.Integer, nullable=False, default=0)  # 0: unknown creator
+    generation_count = db.Column(db.Integer, nullable=False, default=0)
+    cost = db.Column(db.Float, nullable=False, default=0.0)  # USD
+
+    __table_args__ = (
+        # Also the day-range index of the reports
+        db.UniqueConstraint("day", "episode_id", "model", "user_id", name="uq_spend_rollup_key"),
+        db.Index("ix_spend_rollup_episode_id_day", "episode_id", "day"),
+    )
+
+    def __repr__(self):
+        return f"<SpendRollup {self.day} episode={self.episode_id} {self.model} ${self.cost:.4f}>"
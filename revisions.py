@@ -0,0 +1,190 @@
+# revisions.py
+# Revision history for episode plan/scenario stored as compressed line deltas.
+#
+# Each save becomes an EpisodeRevision row. Most rows hold a zlib-compressed
+# delta against the previous revision; every SNAPSHOT_INTERVAL-th row holds the
+# full text so that rebuilding any revision replays a bounded number of deltas.
+# A save whose "before" text differs from the last stored revision (the field
+# was written without recording one) first gets a revision for that change.
+
+import difflib
+import json
+import zlib
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from models import db, EpisodeRevision
+
+REVISION_FIELDS = ("plan", "scenario")
+SNAPSHOT_INTERVAL = 20
+_COMPRESSION_LEVEL = 6
+_INSERT_ATTEMPTS = 3  # Against concurrent saves taking the same number
+
+
+def _split_lines(text):
+    return (text or "").splitlines(keepends=True)
+
+
+def encode_delta(old_text, new_text):
+    """Encodes new_text as ops against old_text's lines: [start, end] copies
+    old lines, a string inserts text."""
+    old_lines = _split_lines(old_text)
+    new_lines = _split_lines(new_text)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif tag in ("replace", "insert"):
+            ops.append("".join(new_lines[j1:j2]))
+    return ops
+
+
+def apply_delta(old_text, ops):
+    old_lines = _split_lines(old_text)
+    parts = []
+    for op in ops:
+        if isinstance(op, str):
+            parts.append(op)
+        else:
+            parts.extend(old_lines[op[0] : op[1]])
+    return "".join(parts)
+
+
+def _pack(payload):
+    return zlib.compress(
+        json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+        _COMPRESSION_LEVEL,
+    )
+
+
+def _unpack(data):
+    return json.loads(zlib.decompress(data).decode("utf-8"))
+
+
+def _latest_revision(episode_id, field):
+    return (
+        EpisodeRevision.query.filter_by(episode_id=episode_id, field=field)
+        .order_by(EpisodeRevision.number.desc())
+        .first()
+    )
+
+
+def latest_numbers(episode_id):
+    """{field: number of its latest revision}, 0 for a field without history.
+    Pages send these back with whole-field saves to detect lost updates."""
+    numbers = dict.fromkeys(REVISION_FIELDS, 0)
+    numbers.update(
+        db.session.query(EpisodeRevision.field, func.max(EpisodeRevision.number))
+        .filter(EpisodeRevision.episode_id == episode_id)
+        .group_by(EpisodeRevision.field)
+    )
+    return numbers
+
+
+def _add_revision(episode_id, field, number, base_text, text, user_id):
+    # A delta needs its base; without one (broken history) store the full text
+    is_snapshot = base_text is None or (number - 1) % SNAPSHOT_INTERVAL == 0
+    payload = text if is_snapshot else encode_delta(base_text, text)
+    revision = EpisodeRevision(
+        episode_id=episode_id,
+        field=field,
+        number=number,
+        is_snapshot=is_snapshot,
+        data=_pack(payload),
+        text_length=len(text),
+        user_id=user_id,
+    )
+    db.session.add(revision)
+    return revision
+
+
+def _add_revisions(episode, field, old_text, new_text, user):
+    latest = _latest_revision(episode.id, field)
+    if latest is None:
+        # History starts from what was there before tracking began
+        number = _add_revision(episode.id, field, 1, None, old_text, None).number
+    else:
+        number = latest.number
+        stored_text = reconstruct(episode.id, field, number)
+        if stored_text != old_text:
+            # The text was changed without a revision (e.g. flask update-plans
+            # or a direct database edit): record that change first, unattributed
+            number += 1
+            _add_revision(episode.id, field, number, stored_text, old_text, None)
+    return _add_revision(
+        episode.id, field, number + 1, old_text, new_text, user.id if user else None
+    )
+
+
+def record_revision(episode, field, old_text, new_text, user=None):
+    """Adds a revision for a save of `field` (the caller commits). Call it
+    after setting the new text, so that its savepoint nests in the save's
+    transaction.
+
+    Deltas are built against the stored history, never trusted from the
+    caller. Two saves racing for the same revision number collide on the
+    unique constraint; the loser re-reads the history and tries again.
+    """
+    if field not in REVISION_FIELDS:
+        raise ValueError(f"Unknown revision field: {field}")
+    old_text, new_text = old_text or "", new_text or ""
+    for attempt in range(_INSERT_ATTEMPTS):
+        try:
+            with db.session.begin_nested():
+                return _add_revisions(episode, field, old_text, new_text, user)
+        except IntegrityError:
+            if attempt == _INSERT_ATTEMPTS - 1:
+                raise
+
+
+def reconstruct(episode_id, field, number):
+    """Returns the full text of revision `number`, or None if it does not
+    exist. Replays at most SNAPSHOT_INTERVAL - 1 deltas."""
+    snapshot = (
+        EpisodeRevision.query.filter(
+            EpisodeRevision.episode_id == episode_id,
+            EpisodeRevision.field == field,
+            EpisodeRevision.is_snapshot.is_(True),
+            EpisodeRevision.number <= number,
+        )
+        .order_by(EpisodeRevision.number.desc())
+        .first()
+    )
+    if snapshot is None:
+        return None
+    deltas = (
+        EpisodeRevision.query.filter(
+            EpisodeRevision.episode_id == episode_id,
+            EpisodeRevision.field == field,
+            EpisodeRevision.number > snapshot.number,
+            EpisodeRevision.number <= number,
+        )
+        .order_by(EpisodeRevision.number)
+        .all()
+    )
+    if snapshot.number + len(deltas) != number:
+        return None
+    text = _unpack(snapshot.data)
+    for revision in deltas:
+        payload = _unpack(revision.data)
+        text = payload if revision.is_snapshot else apply_delta(text, payload)
+    return text
+
+
+def diff_revisions(episode_id, field, from_number, to_number, context=3):
+    """Unified diff between two revisions, or None if either is missing."""
+    old_text = reconstruct(episode_id, field, from_number)
+    new_text = reconstruct(episode_id, field, to_number)
+    if old_text is None or new_text is None:
+        return None
+    return "".join(
+        difflib.unified_diff(
+            _split_lines(old_text),
+            _split_lines(new_text),
+            fromfile=f"{field}@{from_number}",
+            tofile=f"{field}@{to_number}",
+            n=context,
+        )
+    )
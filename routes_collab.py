@@ -0,0 +1,123 @@
+# routes_collab.py
+# Live co-editing channel for episode plan/scenario (see collab.py).
+from flask import Blueprint, request, jsonify, current_app, Response
+from flask_login import login_required, current_user
+from models import db, Episode, Assignment
+from collab import EDITABLE_FIELDS, CollabError, StreamLimitReached, collab_hub
+from revisions import latest_numbers
+
+collab_bp = Blueprint("collab", __name__, url_prefix="/api")
+
+
+def _is_assigned(episode_id):
+    return (
+        Assignment.query.filter_by(
+            user_id=current_user.id, episode_id=episode_id
+        ).count()
+        > 0
+    )
+
+
+def _episode_exists(episode_id):
+    return db.session.query(Episode.query.filter_by(id=episode_id).exists()).scalar()
+
+
+def _own_client_id(client_id):
+    """Client ids embed the user id, so a page can only act as itself."""
+    return isinstance(client_id, str) and client_id.startswith(f"u{current_user.id}-")
+
+
+@collab_bp.route("/episodes/<int:episode_id>/live/stream", methods=["GET"])
+@login_required
+def live_stream(episode_id):
+    if not _episode_exists(episode_id):
+        return jsonify({"success": False, "message": "الحلقة غير موجودة."}), 404
+    client_id = request.args.get("client_id")
+    if not _own_client_id(client_id):
+        client_id = collab_hub.new_client_id(current_user.id)
+    since = {
+        field: request.args.get(f"{field}_rev") for field in EDITABLE_FIELDS
+    }
+    try:
+        stream = collab_hub.open_stream(
+            episode_id,
+            client_id,
+            current_user.id,
+            current_user.username,
+            since,
+            # What whole-field saves from this page are based on from now on
+            extra={"stored_revisions": latest_numbers(episode_id)},
+        )
+    except StreamLimitReached as e:
+        # Every stream holds a worker thread; keep the rest for normal requests.
+        # The page retries, and its save buttons post whole fields meanwhile.
+        current_app.logger.warning(f"Live stream refused for episode {episode_id}: {e}")
+        response = jsonify({"success": False, "message": "التحرير المباشر مشغول حاليًا، أعد المحاولة لاحقًا."})
+        response.status_code = 503
+        response.headers["Retry-After"] = "30"
+        return response
+    # The generator runs after this request's database session is released.
+    db.session.remove()
+    return Response(
+        stream,
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@collab_bp.route("/episodes/<int:episode_id>/live/op", methods=["POST"])
+@login_required
+def live_operation(episode_id):
+    if not _is_assigned(episode_id):
+        return (
+            jsonify(
+                {"success": False, "message": "غير مصرح لك. يجب أن تكون معينًا للتعديل."}
+            ),
+            403,
+        )
+    data = request.get_json(silent=True) or {}
+    client_id = data.get("client_id")
+    revision = data.get("revision")
+    if not _own_client_id(client_id) or not isinstance(revision, int):
+        return jsonify({"success": False, "message": "طلب غير صالح."}), 400
+    try:
+        new_revision = collab_hub.submit(
+            episode_id,
+            data.get("field"),
+            client_id,
+            revision,
+            data.get("operation"),
+            current_user.id,
+        )
+    except CollabError as e:
+        # The page is out of step; it reconnects and resyncs.
+        current_app.logger.info(f"Rejected live edit on episode {episode_id}: {e}")
+        return jsonify({"success": False, "message": "يجب إعادة المزامنة."}), 409
+    return jsonify({"success": True, "revision": new_revision})
+
+
+@collab_bp.route("/episodes/<int:episode_id>/live/presence", methods=["POST"])
+@login_required
+def live_presence(episode_id):
+    data = request.get_json(silent=True) or {}
+    client_id = data.get("client_id")
+    field = data.get("field")
+    if not _own_client_id(client_id) or field not in (None, *EDITABLE_FIELDS):
+        return jsonify({"success": False, "message": "طلب غير صالح."}), 400
+    if not collab_hub.touch(episode_id, client_id, field):
+        return jsonify({"success": False, "message": "الاتصال غير موجود."}), 404
+    return jsonify({"success": True})
+
+
+@collab_bp.route("/episodes/<int:episode_id>/live/flush", methods=["POST"])
+@login_required
+def live_flush(episode_id):
+    """Saves this episode's live edits now instead of waiting for the next batch."""
+    if not _is_assigned(episode_id):
+        return jsonify({"success": False, "message": "غير مصرح لك."}), 403
+    try:
+        saved = collab_hub.flush(episode_id)
+    except Exception as e:
+        current_app.logger.error(f"Live flush error for episode {episode_id}: {e}", exc_info=True)
+        return jsonify({"success": False, "message": "خطأ في حفظ التعديلات"}), 500
+    return jsonify({"success": True, "saved": saved.get(episode_id, [])})
@@ -0,0 +1,1153 @@
+# routes_main.py
+# Pages and JSON endpoints of the scenario writer: login, dashboard, episodes,
+# comments, revisions, audit queries and PDF export.
+
+import io
+from datetime import datetime
+from flask import (
+    Blueprint,
+    render_template,
+    request,
+    redirect,
+    url_for,
+    flash,
+    jsonify,
+    abort,
+    current_app,
+    send_file,
+)
+from flask_login import login_user, logout_user, login_required, current_user
+from sqlalchemy.orm import joinedload
+from werkzeug.security import check_password_hash
+
+from models import (
+    db,
+    User,
+    Episode,
+    Assignment,
+    Comment,
+    Maslak,
+    AuditLog,
+    Scene,
+    VideoGeneration,
+    EpisodeRevision,
+    EPISODE_STATUS_DRAFT,
+    EPISODE_STATUS_REVIEW,
+    EPISODE_STATUS_COMPLETE,
+    EPISODE_STATUS_CHOICES,
+)
+from collab import StaleDocument, collab_hub
+from backup_scheduler import backup_scheduler
+from search_service import SearchService
+from comment_anchors import block_hash, reanchor_comments, split_blocks
+from revisions import (
+    REVISION_FIELDS,
+    diff_revisions,
+    latest_numbers,
+    reconstruct,
+    record_revision,
+)
+from audit_archive import archive_audit_log
+from audit_query import audit_entry, encode_cursor, log_activity, query_audit
+from activity_feed import MAX_PAGE_SIZE, PAGE_SIZE, activity_cache
+from conditional import block_comments_version, conditional, dashboard_version, episode_version
+
+main_bp = Blueprint("main", __name__)
+
+
+# --- Content Saves (editor and live editing) ---
+def _record_content_changes(episode, old_values, changed_fields, user=None):
+    """Revision history, comment re-anchoring and audit entries for a save of
+    plan/scenario. The audit entries commit the session."""
+    for field in changed_fields:
+        record_revision(episode, field, old_values[field], getattr(episode, field), user)
+    if "scenario" in changed_fields:
+        # Keep comment threads on their paragraphs.
+        reanchor_comments(episode.id, old_values["scenario"], episode.scenario)
+    for field in changed_fields:
+        # One entry per field, so "who changed the scenario" is an index lookup
+        log_activity("update_content", user=user, target=episode, details={"field": field})
+
+
+# --- Live Editing Persistence (called by collab.py's batch flush) ---
+def _load_live_field(episode_id, field):
+    return db.session.query(getattr(Episode, field)).filter_by(id=episode_id).scalar()
+
+
+def _persist_live_changes(episode_id, changes, user_id):
+    episode = Episode.query.get(episode_id)
+    if episode is None:
+        return None
+    user = User.query.get(user_id) if user_id else None
+    old_values = {field: getattr(episode, field) for field in changes}
+    stale = {
+        field: old_values[field] or ""
+        for field, (base_text, _) in changes.items()
+        if (old_values[field] or "") != base_text
+    }
+    if stale:
+        # Saved outside the live channel since the document was loaded
+        raise StaleDocument(stale)
+    changed_fields = []
+    for field, (_, new_text) in changes.items():
+        if new_text != old_values[field]:
+            setattr(episode, field, new_text)
+            changed_fields.append(field)
+    if not changed_fields:
+        return None
+    try:
+        _record_content_changes(episode, old_values, changed_fields, user)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    extra = {"stored_revisions": latest_numbers(episode_id)}
+    if "scenario" in changed_fields:
+        extra["comment_counts"] = _comment_counts(episode_id)
+    return extra
+
+
+# --- Routes ---
+@main_bp.route("/login", methods=["GET", "POST"])
+def login():
+    if current_user.is_authenticated:
+        return redirect(url_for("main.dashboard"))
+    if request.method == "POST":
+        username = request.form.get("username")
+        password = request.form.get("password")
+        user = User.query.filter_by(username=username).first()
+        if user and check_password_hash(user.password, password):
+            remember_me = bool(request.form.get("remember"))
+            login_user(user, remember=remember_me)
+            try:
+                user.last_login = datetime.utcnow()
+                # Log activity *after* potential commit for last_login
+                # db.session.add(user) # No need to re-add
+                db.session.commit()  # Commit last_login first
+                log_activity("login", user=user)  # Now log
+            except Exception as e:
+                db.session.rollback()
+                current_app.logger.error(
+                    f"Error updating last_login/logging for user {user.id}: {e}",
+                    exc_info=True,
+                )
+            flash("تم تسجيل الدخول بنجاح.", "success")
+            next_page = request.args.get("next")
+            if next_page and next_page.startswith(url_for("admin.index")):
+                if hasattr(user, "is_admin") and user.is_admin:
+                    return redirect(next_page)
+                else:
+                    flash("ليس لديك صلاحية الوصول للوحة التحكم.", "warning")
+                    return redirect(url_for("main.dashboard"))
+            return redirect(next_page or url_for("main.dashboard"))
+        else:
+            flash("اسم المستخدم أو كلمة المرور غير صالحة.", "danger")
+            log_activity("login_failed", details={"username": username})
+    return render_template("login.html")
+
+
+# ... (Other routes remain largely the same, but with log_activity calls added) ...
+
+
+@main_bp.route("/logout")
+@login_required
+def logout():
+    log_activity("logout")
+    logout_user()
+    flash("تم تسجيل خروجك.", "success")
+    return redirect(url_for("main.login"))
+
+
+@main_bp.route("/")
+@login_required
+@conditional(dashboard_version)
+def dashboard():
+    # ... (dashboard logic remains the same) ...
+    current_app.logger.info(f"Accessing dashboard route for user: {current_user.username}")
+    try:
+        selected_maslak_id_str = request.args.get("maslak", default="", type=str)
+        selected_status = request.args.get("status", default="")
+        selected_maslak_id = None
+        if selected_maslak_id_str:
+            try:
+                selected_maslak_id = int(selected_maslak_id_str)
+                if not Maslak.query.get(selected_maslak_id):
+                    selected_maslak_id = None
+            except ValueError:
+                selected_maslak_id = None
+        valid_statuses = [choice[0] for choice in EPISODE_STATUS_CHOICES]
+        if selected_status and selected_status not in valid_statuses:
+            selected_status = ""
+        episode_query = Episode.query.options(joinedload(Episode.assignees))
+        if selected_maslak_id:
+            episode_query = episode_query.filter(
+                Episode.maslak_id == selected_maslak_id
+            )
+        if selected_status:
+            episode_query = episode_query.filter(Episode.status == selected_status)
+        filtered_episodes = episode_query.order_by(
+            Episode.display_order, Episode.id
+        ).all()
+        total_episodes_in_view = len(filtered_episodes)
+        draft_episodes = sum(
+            1 for ep in filtered_episodes if ep.status == EPISODE_STATUS_DRAFT
+        )
+        review_episodes = sum(
+            1 for ep in filtered_episodes if ep.status == EPISODE_STATUS_REVIEW
+        )
+        complete_episodes = sum(
+            1 for ep in filtered_episodes if ep.status == EPISODE_STATUS_COMPLETE
+        )
+        metrics = {
+            "total_episodes": total_episodes_in_view,
+            "draft_episodes": draft_episodes,
+            "review_episodes": review_episodes,
+            "complete_episodes": complete_episodes,
+        }
+        all_maslaks = Maslak.query.order_by(Maslak.name).all()
+        collaborators = (
+            User.query.filter(User.id != current_user.id).order_by(User.username).all()
+        )
+        status_filter_options = EPISODE_STATUS_CHOICES
+        return render_template(
+            "dashboard.html",
+            all_episodes=filtered_episodes,
+            all_maslaks=all_maslaks,
+            selected_maslak_id=selected_maslak_id,
+            selected_status=selected_status,
+            status_filter_options=status_filter_options,
+            collaborators=collaborators,
+            metrics=metrics,
+        )
+    except Exception as e:
+        current_app.logger.error(f"Error in dashboard route: {e}", exc_info=True)
+        abort(500)
+
+
+@main_bp.route("/test")
+@login_required
+def test_route():
+    return "Test route is working!"
+
+
+@main_bp.route("/create_episode", methods=["POST"])
+@login_required
+def create_episode():
+    title = request.form.get("title")
+    maslak_id = request.form.get("maslak_id", type=int)
+    if not title:
+        flash("عنوان الحلقة لا يمكن أن يكون فارغًا.", "danger")
+        return redirect(url_for("main.dashboard"))
+    if not maslak_id:
+        flash("يجب اختيار مسلك للحلقة.", "danger")
+        return redirect(url_for("main.dashboard"))
+    maslak = Maslak.query.get(maslak_id)
+    if not maslak:
+        flash("المسلك المحدد غير صالح.", "danger")
+        return redirect(url_for("main.dashboard"))
+    existing_episode = Episode.query.filter_by(title=title, maslak_id=maslak_id).first()
+    if existing_episode:
+        flash(f'حلقة بعنوان "{title}" موجودة بالفعل في هذا المسلك.', "warning")
+        return redirect(url_for("main.dashboard", maslak=maslak_id))
+    try:
+        last_episode_in_maslak = (
+            Episode.query.filter_by(maslak_id=maslak_id)
+            .order_by(Episode.display_order.desc())
+            .first()
+        )
+        initial_order = (
+            (last_episode_in_maslak.display_order + 1) if last_episode_in_maslak else 0
+        )
+        new_episode = Episode(
+            title=title, maslak_id=maslak_id, display_order=initial_order
+        )
+        db.session.add(new_episode)
+        db.session.flush()
+        assignment = Assignment(user_id=current_user.id, episode_id=new_episode.id)
+        db.session.add(assignment)
+        log_activity("create_episode", target=new_episode)
+        db.session.commit()
+        flash(
+            f'تم إنشاء الحلقة "{title}" بنجاح في مسلك "{maslak.name}" وتم تعيينك لها.',
+            "success",
+        )
+    except Exception as e:
+        db.session.rollback()
+        flash(f"خطأ في إنشاء الحلقة: {e}", "danger")
+        current_app.logger.error(f"Error creating episode: {e}", exc_info=True)
+    return redirect(url_for("main.dashboard", maslak=maslak_id))
+
+
+@main_bp.route("/delete_episode/<int:episode_id>", methods=["POST"])
+@login_required
+def delete_episode(episode_id):
+    episode = Episode.query.get_or_404(episode_id)
+    is_assigned = (
+        Assignment.query.filter_by(
+            user_id=current_user.id, episode_id=episode.id
+        ).count()
+        > 0
+    )
+    if not is_assigned and not (
+        hasattr(current_user, "is_admin") and current_user.is_admin
+    ):
+        flash("يمكن فقط للمستخدمين المعينين أو المسؤولين حذف الحلقات.", "warning")
+        return redirect(url_for("main.dashboard"))
+    try:
+        log_activity("delete_episode", target=episode)
+        Assignment.query.filter_by(episode_id=episode.id).delete()
+        db.session.delete(episode)
+        db.session.commit()
+        flash(f'تم حذف الحلقة "{episode.title}" بنجاح.', "success")
+    except Exception as e:
+        db.session.rollback()
+        flash(f"خطأ في حذف الحلقة: {e}", "danger")
+        current_app.logger.error(f"Error deleting episode {episode_id}: {e}", exc_info=True)
+    return redirect(url_for("main.dashboard"))
+
+
+@main_bp.route("/episode/<int:episode_id>/change_maslak", methods=["POST"])
+@login_required
+def change_episode_maslak(episode_id):
+    episode = Episode.query.get_or_404(episode_id)
+    new_maslak_id = request.form.get("new_maslak_id", type=int)
+    is_assigned = (
+        Assignment.query.filter_by(
+            user_id=current_user.id, episode_id=episode.id
+        ).count()
+        > 0
+    )
+    user_is_admin = hasattr(current_user, "is_admin") and current_user.is_admin
+    if not is_assigned and not user_is_admin:
+        flash("فقط المستخدمون المعينون أو المسؤولون يمكنهم تغيير المسلك.", "danger")
+        return redirect(url_for("main.view_episode", episode_id=episode_id))
+    if not new_maslak_id:
+        flash("لم يتم اختيار مسلك جديد.", "warning")
+        return redirect(url_for("main.view_episode", episode_id=episode_id))
+    new_maslak = Maslak.query.get(new_maslak_id)
+    if not new_maslak:
+        flash("المسلك الجديد المحدد غير صالح.", "danger")
+        return redirect(url_for("main.view_episode", episode_id=episode_id))
+    if episode.maslak_id == new_maslak_id:
+        flash("الحلقة موجودة بالفعل في هذا المسلك.", "info")
+        return redirect(url_for("main.view_episode", episode_id=episode_id))
+    try:
+        old_maslak_name = episode.maslak.name if episode.maslak else "غير محدد"
+        old_maslak_id = episode.maslak_id
+        episode.maslak_id = new_maslak_id
+        db.session.add(episode)
+        log_activity(
+            "change_maslak",
+            target=episode,
+            details={"old_maslak_id": old_maslak_id, "new_maslak_id": new_maslak_id},
+        )
+        db.session.commit()
+        flash(
+            f'تم نقل الحلقة "{episode.title}" من مسلك "{old_maslak_name}" إلى مسلك "{new_maslak.name}" بنجاح.',
+            "success",
+        )
+    except Exception as e:
+        db.session.rollback()
+        flash(f"حدث خطأ أثناء تغيير المسلك: {e}", "danger")
+        current_app.logger.error(
+            f"Error changing maslak for episode {episode_id}: {e}", exc_info=True
+        )
+    return redirect(url_for("main.view_episode", episode_id=episode_id))
+
+
+@main_bp.route("/episode/<int:episode_id>/change_status", methods=["POST"])
+@login_required
+def change_episode_status(episode_id):
+    episode = Episode.query.get_or_404(episode_id)
+    new_status = request.form.get("new_status")
+    is_assigned = (
+        Assignment.query.filter_by(
+            user_id=current_user.id, episode_id=episode.id
+        ).count()
+        > 0
+    )
+    user_is_admin = hasattr(current_user, "is_admin") and current_user.is_admin
+    if not is_assigned and not user_is_admin:
+        flash("فقط المستخدمون المعينون أو المسؤولون يمكنهم تغيير الحالة.", "danger")
+        return redirect(url_for("main.view_episode", episode_id=episode_id))
+    valid_statuses = [choice[0] for choice in EPISODE_STATUS_CHOICES]
+    if not new_status or new_status not in valid_statuses:
+        flash("الحالة المحددة غير صالحة.", "warning")
+        return redirect(url_for("main.view_episode", episode_id=episode_id))
+    if episode.status == new_status:
+        flash("الحلقة لديها هذه الحالة بالفعل.", "info")
+        return redirect(url_for("main.view_episode", episode_id=episode_id))
+    try:
+        old_status = episode.status
+        episode.status = new_status
+        db.session.add(episode)
+        log_activity(
+            "change_status",
+            target=episode,
+            details={"old_status": old_status, "new_status": new_status},
+        )
+        db.session.commit()
+        flash(
+            f'تم تغيير حالة الحلقة "{episode.title}" إلى "{new_status}" بنجاح.',
+            "success",
+        )
+    except Exception as e:
+        db.session.rollback()
+        flash(f"حدث خطأ أثناء تغيير الحالة: {e}", "danger")
+        current_app.logger.error(
+            f"Error changing status for episode {episode_id}: {e}", exc_info=True
+        )
+    return redirect(url_for("main.view_episode", episode_id=episode_id))
+
+
+@main_bp.route("/admin/backup/status")
+@login_required
+def backup_status():
+    """Backup metrics (last success, duration, size, scheduler state). Admin only."""
+    if not (hasattr(current_user, "is_admin") and current_user.is_admin):
+        return jsonify({"success": False, "message": "غير مصرح لك."}), 403
+    return jsonify(backup_scheduler.status())
+
+
+@main_bp.route("/api/audit")
+@login_required
+def query_audit_log():
+    """Audit entries filtered by indexed details keys, newest first. Admin only.
+
+    Query args: episode_id, field, action, user_id, old_status, new_status,
+    since/until (ISO dates, UTC), limit (max 200) and cursor (from next_cursor).
+    """
+    if not (hasattr(current_user, "is_admin") and current_user.is_admin):
+        return jsonify({"success": False, "message": "غير مصرح لك."}), 403
+    try:
+        since = request.args.get("since")
+        until = request.args.get("until")
+        query = query_audit(
+            episode_id=request.args.get("episode_id", type=int),
+            field=request.args.get("field"),
+            action=request.args.get("action"),
+            user_id=request.args.get("user_id", type=int),
+            old_status=request.args.get("old_status"),
+            new_status=request.args.get("new_status"),
+            since=datetime.fromisoformat(since) if since else None,
+            until=datetime.fromisoformat(until) if until else None,
+            before=request.args.get("cursor"),
+        )
+    except ValueError:
+        return jsonify({"success": False, "message": "تاريخ غير صالح."}), 400
+    limit = min(max(request.args.get("limit", 50, type=int), 1), 200)
+    logs = query.options(joinedload(AuditLog.user)).limit(limit + 1).all()
+    has_more = len(logs) > limit
+    logs = logs[:limit]
+    return jsonify(
+        {
+            "success": True,
+            "entries": [audit_entry(log) for log in logs],
+            "next_cursor": encode_cursor(logs[-1]) if has_more else None,
+        }
+    )
+
+
+# --- NEW: Route to Clear Audit Log ---
+@main_bp.route("/admin/clear_audit_log", methods=["POST"])
+@login_required
+def clear_audit_log():
+    """Clears all entries from the AuditLog table. Admin only."""
+    if not (hasattr(current_user, "is_admin") and current_user.is_admin):
+        flash("غير مصرح لك بهذا الإجراء.", "danger")
+        return redirect(url_for("admin.index"))  # Redirect back to admin index
+
+    try:
+        num_rows_deleted = db.session.query(AuditLog).delete()
+        log_activity(
+            "clear_audit_log", details={"rows_deleted": num_rows_deleted}
+        )  # Log the clear action itself
+        db.session.commit()
+        flash(f"تم حذف جميع سجلات النشاط ({num_rows_deleted} سجل).", "success")
+    except Exception as e:
+        db.session.rollback()
+        flash(f"حدث خطأ أثناء حذف السجلات: {e}", "danger")
+        current_app.logger.error(f"Error clearing audit log: {e}", exc_info=True)
+
+    # Redirect back to the audit log view
+    return redirect(url_for("auditlog.index_view"))
+
+
+# --- End Clear Audit Log Route ---
+
+
+@main_bp.route("/admin/archive_audit_log", methods=["POST"])
+@login_required
+def archive_audit_log_now():
+    """Moves audit rows older than the retention window into the archive. Admin only."""
+    if not (hasattr(current_user, "is_admin") and current_user.is_admin):
+        flash("غير مصرح لك بهذا الإجراء.", "danger")
+        return redirect(url_for("admin.index"))
+
+    try:
+        archived = archive_audit_log()
+        log_activity("archive_audit_log", details={"rows_archived": archived})
+        flash(f"تمت أرشفة {archived} سجل.", "success")
+    except Exception as e:
+        db.session.rollback()
+        flash(f"حدث خطأ أثناء أرشفة السجلات: {e}", "danger")
+        current_app.logger.error(f"Error archiving audit log: {e}", exc_info=True)
+    return redirect(url_for("auditlog.index_view"))
+
+
+@main_bp.route("/api/update_episode_order", methods=["POST"])
+@login_required
+def update_episode_order():
+    # ... (update_episode_order logic remains the same, but now logs) ...
+    data = request.get_json()
+    if not data or "ordered_ids" not in data:
+        return jsonify({"success": False, "message": "بيانات غير صالحة"}), 400
+    ordered_ids = data["ordered_ids"]
+    current_app.logger.info(f"Received new episode order: {ordered_ids}")
+    try:
+        # Loads the listed episodes in one query instead of one per id
+        episode_ids = []
+        for episode_id_str in ordered_ids:
+            try:
+                episode_ids.append(int(episode_id_str))
+            except ValueError:
+                pass
+        episodes = {
+            episode.id: episode
+            for episode in Episode.query.filter(Episode.id.in_(episode_ids))
+        }
+        for index, episode_id_str in enumerate(ordered_ids):
+            try:
+                episode_id = int(episode_id_str)
+                episode = episodes.get(episode_id)
+                if episode:
+                    episode.display_order = index
+                    db.session.add(episode)
+                else:
+                    current_app.logger.warning(
+                        f"Episode ID {episode_id} not found during reorder."
+                    )
+            except ValueError:
+                current_app.logger.warning(f"Invalid episode ID received: {episode_id_str}")
+                continue
+        log_activity("reorder_episodes", details={"order": ordered_ids})
+        db.session.commit()
+        current_app.logger.info("Episode order updated successfully.")
+        return jsonify({"success": True, "message": "تم تحديث ترتيب الحلقات."})
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error updating episode order: {e}", exc_info=True)
+        return (
+            jsonify({"success": False, "message": "حدث خطأ أثناء تحديث الترتيب."}),
+            500,
+        )
+
+
+@main_bp.route("/api/search", methods=["GET"])
+@login_required
+def search_episodes():
+    query = request.args.get("q", default="", type=str).strip()
+    limit = min(max(request.args.get("limit", default=20, type=int), 1), 50)
+    if not query:
+        return jsonify({"success": True, "results": []})
+    try:
+        results = SearchService.search(query, limit=limit)
+    except Exception as e:
+        current_app.logger.error(f"Search error for query '{query}': {e}", exc_info=True)
+        return jsonify({"success": False, "message": "تعذر تنفيذ البحث."}), 500
+    for result in results:
+        result["url"] = url_for("main.view_episode", episode_id=result["episode_id"])
+    return jsonify({"success": True, "results": results})
+
+
+@main_bp.route("/assign_user", methods=["POST"])
+@login_required
+def assign_user_to_episode():
+    # ... (validation) ...
+    episode_id = request.form.get("episode_id")
+    user_to_assign_id = request.form.get("user_to_assign_id")
+    if not episode_id or not user_to_assign_id:
+        flash("معرّف الحلقة أو المستخدم مفقود.", "danger")
+        return redirect(request.referrer or url_for("main.dashboard"))
+    try:
+        episode_id = int(episode_id)
+        user_to_assign_id = int(user_to_assign_id)
+    except ValueError:
+        flash("صيغة معرّف الحلقة أو المستخدم غير صالحة.", "danger")
+        return redirect(request.referrer or url_for("main.dashboard"))
+    episode = Episode.query.get(episode_id)
+    user_to_assign = User.query.get(user_to_assign_id)
+    if not episode or not user_to_assign:
+        flash("الحلقة أو المستخدم غير موجود.", "danger")
+        return redirect(url_for("main.dashboard"))
+    existing_assignment = Assignment.query.filter_by(
+        user_id=user_to_assign.id, episode_id=episode.id
+    ).first()
+    if existing_assignment:
+        flash(
+            f'المستخدم "{user_to_assign.username}" معين بالفعل للحلقة "{episode.title}".',
+            "info",
+        )
+        return redirect(url_for("main.view_episode", episode_id=episode_id))
+    try:
+        new_assignment = Assignment(user_id=user_to_assign.id, episode_id=episode.id)
+        db.session.add(new_assignment)
+        log_activity(
+            "assign_user",
+            target=episode,
+            details={"assigned_user_id": user_to_assign.id},
+        )
+        db.session.commit()
+        flash(
+            f'تم تعيين المستخدم "{user_to_assign.username}" بنجاح للحلقة "{episode.title}".',
+            "success",
+        )
+    except Exception as e:
+        db.session.rollback()
+        flash(f"خطأ في تعيين المستخدم: {e}", "danger")
+        current_app.logger.error(f"Error assigning user to episode {episode_id}: {e}", exc_info=True)
+    return redirect(url_for("main.view_episode", episode_id=episode_id))
+
+
+@main_bp.route("/unassign_self/<int:episode_id>", methods=["POST"])
+@login_required
+def unassign_self_from_episode(episode_id):
+    # ... (validation) ...
+    episode = Episode.query.get_or_404(episode_id)
+    assignment = Assignment.query.filter_by(
+        user_id=current_user.id, episode_id=episode.id
+    ).first()
+    if assignment:
+        try:
+            log_activity("unassign_self", target=episode)
+            db.session.delete(assignment)
+            db.session.commit()
+            flash(
+                f'لقد قمت بإلغاء تعيين نفسك بنجاح من الحلقة "{episode.title}".',
+                "success",
+            )
+        except Exception as e:
+            db.session.rollback()
+            flash(f"خطأ في إلغاء تعيين نفسك: {e}", "danger")
+            current_app.logger.error(f"Error unassigning from episode {episode_id}: {e}", exc_info=True)
+            return redirect(url_for("main.view_episode", episode_id=episode_id))
+    else:
+        flash("لم تكن معينًا لهذه الحلقة.", "info")
+        return redirect(url_for("main.view_episode", episode_id=episode_id))
+    return redirect(url_for("main.dashboard"))
+
+
+@main_bp.route("/delete_comment/<int:comment_id>", methods=["POST"])
+@login_required
+def delete_comment(comment_id):
+    comment = Comment.query.get_or_404(comment_id)
+    # ... (permission check) ...
+    if comment.user_id != current_user.id and not (
+        hasattr(current_user, "is_admin") and current_user.is_admin
+    ):
+        return (
+            jsonify({"success": False, "message": "غير مصرح لك بحذف هذا التعليق."}),
+            403,
+        )
+    try:
+        episode_id = comment.episode_id
+        deleted_block_index = comment.block_index
+        log_activity(
+            "delete_comment",
+            target=comment.episode,
+            details={"comment_id": comment_id, "block_index": deleted_block_index},
+        )
+        db.session.delete(comment)
+        db.session.commit()
+        return jsonify(
+            {
+                "success": True,
+                "message": "تم حذف التعليق بنجاح.",
+                "deleted_comment_id": comment_id,
+                "deleted_block_index": deleted_block_index,
+            }
+        )
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error deleting comment {comment_id}: {e}", exc_info=True)
+        return jsonify({"success": False, "message": "حدث خطأ أثناء حذف التعليق."}), 500
+
+
+def _comment_counts(episode_id):
+    """Returns {block_index: comment_count} with a single GROUP BY."""
+    rows = (
+        db.session.query(Comment.block_index, db.func.count(Comment.id))
+        .filter(Comment.episode_id == episode_id)
+        .group_by(Comment.block_index)
+        .all()
+    )
+    return {block_index: count for block_index, count in rows}
+
+
+def _serialize_comment(comment):
+    return {
+        "id": comment.id,
+        "block_index": comment.block_index,
+        "text": comment.text,
+        "author": comment.author.username if comment.author else "مستخدم غير معروف",
+        "author_id": comment.author.id if comment.author else None,
+        "timestamp": comment.timestamp.strftime("%Y-%m-%d %H:%M"),
+    }
+
+
+@main_bp.route("/episode/<int:episode_id>", methods=["GET"])
+@login_required
+@conditional(episode_version)
+def view_episode(episode_id):
+    # ... (view_episode logic remains the same) ...
+    episode = Episode.query.options(
+        joinedload(Episode.assignees), joinedload(Episode.maslak)
+    ).get_or_404(episode_id)
+    current_user_is_assigned = any(
+        assignee.id == current_user.id for assignee in episode.assignees
+    )
+    all_users = User.query.order_by(User.username).all()
+    all_maslaks = Maslak.query.order_by(Maslak.name).all()
+    # Only per-block counts are shipped; threads load on demand.
+    comment_counts = _comment_counts(episode.id)
+    # Build scenes with generations
+    scenes_data = []
+    # All generations of the episode in one query, not one per scene
+    generations_by_scene = {}
+    for gen in (
+        VideoGeneration.query.join(Scene)
+        .filter(Scene.episode_id == episode.id)
+        .order_by(VideoGeneration.created_at.desc())
+    ):
+        generations_by_scene.setdefault(gen.scene_id, []).append(gen)
+    for scene in episode.scenes.order_by(Scene.number).all():
+        gens = []
+        for gen in generations_by_scene.get(scene.id, []):
+            gens.append({
+                "id": gen.id,
+                "attempt_number": gen.attempt_number,
+                "prompt": gen.prompt,
+                "model": gen.model,
+                "resolution": gen.resolution,
+                "aspect_ratio": gen.aspect_ratio,
+                "generate_audio": gen.generate_audio,
+                "duration": gen.duration,
+                "status": gen.status,
+                "unsigned_url": gen.unsigned_url,
+                "drive_file_id": gen.drive_file_id,
+                "drive_view_url": gen.drive_view_url,
+                "local_path": gen.local_path,
+                "error_message": gen.error_message,
+                "cost": gen.cost,
+                "created_at": gen.created_at.isoformat() if gen.created_at else None,
+                "completed_at": gen.completed_at.isoformat() if gen.completed_at else None,
+            })
+        scenes_data.append({
+            "id": scene.id,
+            "number": scene.number,
+            "generations": gens,
+            "draft_prompt": scene.draft_prompt,
+            "draft_model": scene.draft_model,
+            "draft_resolution": scene.draft_resolution,
+            "draft_aspect_ratio": scene.draft_aspect_ratio,
+            "draft_generate_audio": scene.draft_generate_audio,
+            "draft_duration": scene.draft_duration,
+        })
+
+    user_is_admin = hasattr(current_user, "is_admin") and current_user.is_admin
+    return render_template(
+        "episode.html",
+        episode=episode,
+        comment_counts=comment_counts,
+        is_assigned=current_user_is_assigned,
+        all_users=all_users,
+        all_maslaks=all_maslaks,
+        user_is_admin=user_is_admin,
+        status_choices=EPISODE_STATUS_CHOICES,
+        scenes=scenes_data,
+        stored_revisions=latest_numbers(episode.id),
+    )
+
+
+@main_bp.route("/episode/<int:episode_id>/update", methods=["POST"])
+@login_required
+def update_episode(episode_id):
+    episode = Episode.query.get_or_404(episode_id)
+    is_assigned = (
+        Assignment.query.filter_by(
+            user_id=current_user.id, episode_id=episode.id
+        ).count()
+        > 0
+    )
+    if not is_assigned:
+        return (
+            jsonify(
+                {"success": False, "message": "غير مصرح لك. يجب أن تكون معينًا للتعديل."}
+            ),
+            403,
+        )
+    data = request.json
+    old_values = {field: getattr(episode, field) for field in REVISION_FIELDS}
+    details_log = [
+        field for field in REVISION_FIELDS if field in data and data[field] != old_values[field]
+    ]
+    # The page sends the revision each field had when its edit started (also
+    # when the save was queued offline); a newer one means the save would
+    # silently undo someone else's work.
+    stored_revisions = latest_numbers(episode.id)
+    base_revisions = data.get("base_revisions")
+    if isinstance(base_revisions, dict):
+        stale = [
+            field
+            for field in details_log
+            if field in base_revisions and base_revisions[field] != stored_revisions[field]
+        ]
+        if stale:
+            current_app.logger.info(
+                f"Rejected stale save of episode {episode_id} {stale}: "
+                f"based on {base_revisions}, stored {stored_revisions}"
+            )
+            return (
+                jsonify(
+                    {
+                        "success": False,
+                        "conflict": True,
+                        "fields": stale,
+                        "stored_revisions": stored_revisions,
+                        "message": "تغيّر النص على الخادم بعد أن بدأت تعديلك، فلم يُحفظ تعديلك حتى لا يمحو التغييرات الأحدث.",
+                    }
+                ),
+                409,
+            )
+    if details_log:
+        try:
+            for field in details_log:
+                setattr(episode, field, data[field])
+            db.session.add(episode)
+            _record_content_changes(episode, old_values, details_log, current_user)
+            db.session.commit()
+            stored_revisions = latest_numbers(episode.id)
+            for field in details_log:
+                # Open live editors switch to the saved text.
+                collab_hub.reset_field(
+                    episode.id,
+                    field,
+                    getattr(episode, field),
+                    extra={"stored_revisions": stored_revisions},
+                )
+            response = {
+                "success": True,
+                "message": "تم تحديث الحلقة بنجاح",
+                "stored_revisions": stored_revisions,
+            }
+            if "scenario" in details_log:
+                # Comments may have moved to other blocks.
+                response["comment_counts"] = _comment_counts(episode.id)
+            return jsonify(response)
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Error updating episode {episode_id}: {e}", exc_info=True)
+            return jsonify({"success": False, "message": "خطأ في تحديث الحلقة"}), 500
+    else:
+        return jsonify(
+            {
+                "success": True,
+                "message": "لم يتم اكتشاف أي تغييرات",
+                "stored_revisions": stored_revisions,
+            }
+        )
+
+
+@main_bp.route("/api/episode/<int:episode_id>/update_title", methods=["POST"])
+@login_required
+def update_episode_title(episode_id):
+    # ... (validation, permission check) ...
+    episode = Episode.query.get_or_404(episode_id)
+    data = request.get_json()
+    if not data or "new_title" not in data:
+        return jsonify({"success": False, "message": "بيانات غير صالحة"}), 400
+    new_title = data["new_title"].strip()
+    if not new_title:
+        return (
+            jsonify({"success": False, "message": "العنوان لا يمكن أن يكون فارغًا"}),
+            400,
+        )
+    is_assigned = (
+        Assignment.query.filter_by(
+            user_id=current_user.id, episode_id=episode.id
+        ).count()
+        > 0
+    )
+    user_is_admin = hasattr(current_user, "is_admin") and current_user.is_admin
+    if not is_assigned and not user_is_admin:
+        return (
+            jsonify({"success": False, "message": "غير مصرح لك بتعديل هذا العنوان"}),
+            403,
+        )
+    existing = Episode.query.filter(
+        Episode.maslak_id == episode.maslak_id,
+        Episode.title == new_title,
+        Episode.id != episode_id,
+    ).first()
+    if existing:
+        return (
+            jsonify(
+                {
+                    "success": False,
+                    "message": f'عنوان الحلقة "{new_title}" مستخدم بالفعل في هذا المسلك.',
+                }
+            ),
+            400,
+        )
+    try:
+        old_title = episode.title
+        episode.title = new_title
+        log_activity(
+            "update_title",
+            target=episode,
+            details={"old_title": old_title, "new_title": new_title},
+        )
+        db.session.commit()
+        current_app.logger.info(
+            f"Updated title for episode {episode_id} to '{new_title}' by user {current_user.username}"
+        )
+        return jsonify(
+            {
+                "success": True,
+                "message": "تم تحديث العنوان بنجاح",
+                "new_title": new_title,
+            }
+        )
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(
+            f"Error updating title for episode {episode_id}: {e}", exc_info=True
+        )
+        return (
+            jsonify({"success": False, "message": "حدث خطأ أثناء تحديث العنوان"}),
+            500,
+        )
+
+
+@main_bp.route("/episode/<int:episode_id>/comments", methods=["POST"])
+@login_required
+def add_comment(episode_id):
+    # ... (validation, permission check) ...
+    episode = Episode.query.get_or_404(episode_id)
+    is_assigned = (
+        Assignment.query.filter_by(
+            user_id=current_user.id, episode_id=episode.id
+        ).count()
+        > 0
+    )
+    if not is_assigned:
+        return (
+            jsonify(
+                {"success": False, "message": "غير مصرح لك. يجب أن تكون معينًا للتعليق."}
+            ),
+            403,
+        )
+    data = request.json
+    block_index = data.get("block_index")
+    text = data.get("text")
+    if block_index is None or not isinstance(text, str) or not text.strip():
+        return (
+            jsonify(
+                {
+                    "success": False,
+                    "message": "معرّف الفقرة أو نص التعليق مفقود أو غير صالح",
+                }
+            ),
+            400,
+        )
+    try:
+        block_index = int(block_index)
+        # Comments anchor to the saved scenario: save pending live edits
+        # first, so that a paragraph typed a moment ago exists
+        try:
+            if collab_hub.flush(episode.id):
+                db.session.refresh(episode)
+        except Exception as e:
+            current_app.logger.error(f"Live flush before comment on episode {episode_id} failed: {e}", exc_info=True)
+        blocks = split_blocks(episode.scenario)
+        if not 0 <= block_index < len(blocks):
+            # An anchorless comment would drift on every re-anchoring
+            return jsonify({"success": False, "message": "معرّف الفقرة غير صالح"}), 400
+        comment = Comment(
+            episode_id=episode.id,
+            user_id=current_user.id,
+            block_index=block_index,
+            anchor_hash=block_hash(blocks[block_index]),
+            text=text.strip(),
+        )
+        db.session.add(comment)
+        db.session.flush()  # Assigns comment.id for the audit entry
+        log_activity(
+            "add_comment",
+            target=episode,
+            details={"comment_id": comment.id, "block_index": block_index},
+        )
+        db.session.commit()
+        return (
+            jsonify(
+                {
+                    "success": True,
+                    "message": "تمت إضافة التعليق",
+                    "comment": _serialize_comment(comment),
+                }
+            ),
+            201,
+        )
+    except ValueError:
+        return jsonify({"success": False, "message": "صيغة معرّف الفقرة غير صالحة"}), 400
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error adding comment to episode {episode_id}: {e}", exc_info=True)
+        return jsonify({"success": False, "message": "خطأ في إضافة التعليق"}), 500
+
+
+@main_bp.route("/episode/<int:episode_id>/comments", methods=["GET"])
+@login_required
+@conditional(block_comments_version)
+def list_block_comments(episode_id):
+    """Paginated comment thread of one scenario block."""
+    block_index = request.args.get("block", type=int)
+    if block_index is None or block_index < 0:
+        return jsonify({"success": False, "message": "معرّف الفقرة غير صالح"}), 400
+    page = max(request.args.get("page", default=1, type=int), 1)
+    per_page = min(max(request.args.get("per_page", default=20, type=int), 1), 100)
+    if not db.session.query(Episode.query.filter_by(id=episode_id).exists()).scalar():
+        abort(404)
+    pagination = (
+        Comment.query.options(joinedload(Comment.author))
+        .filter_by(episode_id=episode_id, block_index=block_index)
+        .order_by(Comment.timestamp, Comment.id)
+        .paginate(page=page, per_page=per_page, error_out=False)
+    )
+    return jsonify(
+        {
+            "success": True,
+            "block_index": block_index,
+            "comments": [_serialize_comment(c) for c in pagination.items],
+            "page": pagination.page,
+            "total": pagination.total,
+            "has_more": pagination.has_next,
+        }
+    )
+
+
+# --- Activity Feed API ---
+@main_bp.route("/api/episodes/<int:episode_id>/activity", methods=["GET"])
+@login_required
+def episode_activity(episode_id):
+    """Newest-first activity of an episode (audit log, comments, video
+    generations). Pass `cursor` from `next_cursor` for the next page."""
+    if db.session.query(Episode.id).filter_by(id=episode_id).scalar() is None:
+        abort(404)
+    limit = min(max(request.args.get("limit", PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    page = activity_cache.get(episode_id, request.args.get("cursor"), limit)
+    return jsonify({"success": True, **page})
+
+
+# --- Revision History API ---
+@main_bp.route("/api/episode/<int:episode_id>/revisions/<field>", methods=["GET"])
+@login_required
+def list_episode_revisions(episode_id, field):
+    if field not in REVISION_FIELDS:
+        abort(404)
+    Episode.query.get_or_404(episode_id)
+    revisions = (
+        EpisodeRevision.query.options(joinedload(EpisodeRevision.user))
+        .filter_by(episode_id=episode_id, field=field)
+        .order_by(EpisodeRevision.number.desc())
+        .all()
+    )
+    return jsonify(
+        {
+            "success": True,
+            "revisions": [
+                {
+                    "number": r.number,
+                    "is_snapshot": r.is_snapshot,
+                    "text_length": r.text_length,
+                    "stored_bytes": len(r.data),
+                    "username": r.user.username if r.user else None,
+                    "created_at": r.created_at.strftime("%Y-%m-%d %H:%M"),
+                }
+                for r in revisions
+            ],
+        }
+    )
+
+
+@main_bp.route(
+    "/api/episode/<int:episode_id>/revisions/<field>/<int:number>", methods=["GET"]
+)
+@login_required
+def get_episode_revision(episode_id, field, number):
+    if field not in REVISION_FIELDS:
+        abort(404)
+    text = reconstruct(episode_id, field, number)
+    if text is None:
+        return jsonify({"success": False, "message": "النسخة غير موجودة"}), 404
+    return jsonify({"success": True, "number": number, "text": text})
+
+
+@main_bp.route("/api/episode/<int:episode_id>/revisions/<field>/diff", methods=["GET"])
+@login_required
+def diff_episode_revisions(episode_id, field):
+    if field not in REVISION_FIELDS:
+        abort(404)
+    from_number = request.args.get("from", type=int)
+    to_number = request.args.get("to", type=int)
+    if from_number is None or to_number is None:
+        return jsonify({"success": False, "message": "يجب تحديد النسختين"}), 400
+    diff = diff_revisions(episode_id, field, from_number, to_number)
+    if diff is None:
+        return jsonify({"success": False, "message": "النسخة غير موجودة"}), 404
+    return jsonify(
+        {"success": True, "from": from_number, "to": to_number, "diff": diff}
+    )
+
+
+# --- PDF Export Route ---
+@main_bp.route("/episode/<int:episode_id>/export/pdf")
+@login_required
+def export_episode_pdf(episode_id):
+    # ... (export_episode_pdf logic remains the same) ...
+    # Only this route needs them, and WeasyPrint alone takes longer to import
+    # than the rest of the app.
+    import markdown
+    from weasyprint import HTML
+
+    episode = Episode.query.get_or_404(episode_id)
+    plan_html = markdown.markdown(
+        episode.plan or "", extensions=["extra", "tables", "fenced_code"]
+    )
+    scenario_html = markdown.markdown(
+        episode.scenario or "", extensions=["extra", "tables", "fenced_code"]
+    )
+    html_string = f""" <!DOCTYPE html> <html lang="ar" dir="rtl"> <head> <meta charset="UTF-8"> <title>Export: {episode.title}</title> <link rel="preconnect" href="https://fonts.googleapis.com"> <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin> <link href="https://fonts.googleapis.com/css2?family=Tajawal:wght@400;700&family=IBM+Plex+Sans+Arabic:wght@400;500;700&display=swap" rel="stylesheet"> <style> @page {{ margin: 1.5cm; }} body {{ font-family: 'Tajawal', sans-serif; direction: rtl; text-align: right; line-height: 1.5; }} h1, h2 {{ font-family: 'Tajawal', sans-serif; font-weight: bold; margin-top: 1.5em; margin-bottom: 0.5em; color: #1f2937; border-bottom: 1px solid #eee; padding-bottom: 0.2em; }} h1 {{ font-size: 20pt; }} h2 {{ font-size: 16pt; }} p, li, td, th {{ font-family: 'IBM Plex Sans Arabic', sans-serif; font-size: 11pt; margin-bottom: 0.6em; }} ul, ol {{ padding-right: 25px; margin-bottom: 1em; }} li {{ margin-bottom: 0.3em; }} strong {{ font-weight: bold; }} em {{ font-style: italic; }} hr {{ margin: 2em 0; border-top: 1px solid #ccc; }} table {{ border-collapse: collapse; width: 100%; margin-bottom: 1em; font-size: 10pt; }} th, td {{ border: 1px solid #ccc; padding: 8px; text-align: right; }} th {{ background-color: #f2f2f2; font-weight: bold; font-family: 'Tajawal', sans-serif; }} pre {{ background-color: #f8f8f8; border: 1px solid #ddd; padding: 10px; font-family: monospace; white-space: pre-wrap; word-wrap: break-word; direction: ltr; text-align: left; margin-bottom: 1em; }} code {{ font-family: monospace; }} blockquote {{ border-right: 3px solid #ccc; padding-right: 10px; margin-right: 0; margin-left: 0; color: #666; font-style: italic; }} </style> </head> <body> <h1>{episode.title or 'بيانات الحلقة'}</h1> <h2>خطة الحلقة</h2> <div>{plan_html or '<p><i>(لا توجد خطة)</i></p>'}</div> <hr> <h2>السيناريو</h2> <div>{scenario_html or '<p><i>(لا يوجد سيناريو)</i></p>'}</div> </body> </html> """
+    try:
+        html = HTML(string=html_string)
+        pdf_bytes = html.write_pdf()
+        pdf_io = io.BytesIO(pdf_bytes)
+        safe_title = (
+            (episode.title or "episode")
+            .replace(" ", "_")
+            .replace("/", "_")
+            .replace("\\", "_")
+        )
+        filename = f"episode_{episode.id}_{safe_title}.pdf"
+        return send_file(
+            pdf_io,
+            mimetype="application/pdf",
+            as_attachment=True,
+            download_name=filename,
+        )
+    except Exception as e:
+        current_app.logger.error(
+            f"Error generating PDF for episode {episode_id}: {e}", exc_info=True
+        )
+        flash("حدث خطأ أثناء إنشاء ملف PDF.", "danger")
+        return redirect(url_for("main.view_episode", episode_id=episode_id))
@@ -4,6 +4,7 @@ from flask_login import login_required, current_user
 from datetime import datetime
 from models import db, Episode, Scene, VideoGeneration, Assignment
 from video_service import VideoService
+from spend import report_args, spend_report
 import os
 
 video_bp = Blueprint("video", __name__, url_prefix="/api")
@@ -35,13 +36,27 @@ def get_video_models():
 @login_required
 def get_credits():
     try:
-        credits = VideoService.get_credits()
+        # ?refresh=1 (the refresh button) waits for a fresh balance
+        credits = VideoService.get_credits(refresh=request.args.get("refresh") == "1")
         return jsonify({"success": True, **credits})
     except Exception as e:
         current_app.logger.error(f"Credits fetch error: {e}", exc_info=True)
         return jsonify({"success": False, "message": f"تعذر جلب الرصيد: {e}"}), 502
 
 
+# --- Spend (from the rollup, see spend.py) ---
+@video_bp.route("/spend", methods=["GET"])
+@login_required
+def get_spend():
+    if not current_user.is_admin:
+        return jsonify({"success": False, "message": "غير مصرح لك."}), 403
+    try:
+        kwargs = report_args(request.args)
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"معاملات غير صالحة: {e}"}), 400
+    return jsonify({"success": True, "group_by": kwargs["group_by"], **spend_report(**kwargs)})
+
+
 # --- Scenes ---
 @video_bp.route("/episodes/<int:episode_id>/scenes", methods=["POST"])
 @login_required
@@ -130,7 +145,7 @@ def create_generation(scene_id):
             generate_audio=data.get("generate_audio", True),
             duration=data.get("duration"),
         )
-        current_app.logger.info(f"[OpenRouter] submit_generation response: {result}")
+        current_app.logger.debug(f"[OpenRouter] submit_generation response: {result}")
     except Exception as e:
         current_app.logger.error(f"OpenRouter submit error: {e}", exc_info=True)
         return jsonify({"success": False, "message": f"خطأ في إرسال الطلب: {e}"}), 500
@@ -171,7 +186,7 @@ def get_generation_status(gen_id):
     if gen.status not in terminal_statuses and gen.polling_url:
         try:
             status_data = VideoService.poll_status(gen.polling_url)
-            current_app.logger.info(f"[OpenRouter] poll_status gen={gen_id} response: {status_data}")
+            current_app.logger.debug(f"[OpenRouter] poll_status gen={gen_id} response: {status_data}")
             new_status = status_data.get("status", gen.status)
             if new_status != gen.status:
                 gen.status = new_status
@@ -182,6 +197,7 @@ def get_generation_status(gen_id):
                 gen.cost = usage.get("cost")
                 gen.completed_at = datetime.utcnow()
                 db.session.commit()
+                VideoService.record_spend(gen.cost)
             elif gen.status == "failed":
                 gen.error_message = status_data.get("error", status_data.get("error_message"))
                 db.session.commit()
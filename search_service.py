@@ -0,0 +1,364 @@
+# search_service.py
+# Full-text search over episodes and comments using an SQLite FTS5 index.
+#
+# The index matches on Arabic-normalized text (title, body) and keeps the
+# original text beside it (raw_title, raw_body, not indexed). Snippets are cut
+# from the original, so users see the spelling as written: highlight() marks
+# the matched tokens in the normalized text and those are mapped back.
+
+import bisect
+import html
+import re
+
+from sqlalchemy import event, inspect, text
+
+from models import db, Episode, Comment
+
+SEARCH_TABLE = "search_index"
+
+# Arabic diacritics (tashkeel), Quranic annotation marks and tatweel.
+_ARABIC_MARKS_RE = re.compile("[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]")
+_ARABIC_FOLDS = str.maketrans(
+    {
+        "أ": "ا",
+        "إ": "ا",
+        "آ": "ا",
+        "ٱ": "ا",
+        "ى": "ي",
+        "ة": "ه",
+    }
+)
+_QUERY_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Clitics that attach to the front of Arabic words ("الصلاه", "بالصلاه",
+# "وصلاه"...). Query words are stripped of them and re-expanded with each one
+# so that a search for one form finds the others.
+_ARABIC_PREFIXES = ("وال", "بال", "فال", "كال", "لل", "ال", "و", "ب", "ف", "ل", "ك")
+_MIN_STEM_LENGTH = 2
+_ARABIC_LETTER_RE = re.compile("[\u0621-\u064A]")
+
+# Markers used by highlight(); stripped again when mapping matches back.
+_HL_START = "\x02"
+_HL_END = "\x03"
+_SNIPPET_WORDS = 16
+# A word of the original text, diacritics and tatweel included
+_RAW_WORD_RE = re.compile(r"(?:\w|[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640])+")
+
+# bm25 weights per column: kind, episode_id (unindexed), title, body, raw_title
+# and raw_body (unindexed).
+_RANK_EXPR = f"bm25({SEARCH_TABLE}, 0.0, 0.0, 10.0, 1.0, 0.0, 0.0)"
+_TABLE_COLUMNS = (
+    "kind UNINDEXED, episode_id UNINDEXED, title, body, "
+    "raw_title UNINDEXED, raw_body UNINDEXED, "
+    "tokenize = 'unicode61 remove_diacritics 2'"
+)
+
+KIND_EPISODE = "episode"
+KIND_COMMENT = "comment"
+
+# Becomes True once the FTS table is known to exist in this process.
+_index_ready = False
+
+
+def normalize_arabic(value):
+    """Folds Arabic spelling variants so that search ignores diacritics and
+    alef/ya/ta-marbuta differences."""
+    if not value:
+        return ""
+    value = _ARABIC_MARKS_RE.sub("", value)
+    return value.translate(_ARABIC_FOLDS).lower()
+
+
+# Row ids interleave episodes and comments so each source row maps to one
+# FTS row and can be replaced without scanning the index.
+def _episode_rowid(episode_id):
+    return episode_id * 2
+
+
+def _comment_rowid(comment_id):
+    return comment_id * 2 + 1
+
+
+def _strip_arabic_prefix(token):
+    for prefix in _ARABIC_PREFIXES:
+        if token.startswith(prefix) and len(token) - len(prefix) >= _MIN_STEM_LENGTH:
+            return token[len(prefix):]
+    return token
+
+
+def _build_match_query(raw_query):
+    """Turns free text into a safe FTS5 MATCH expression: every word must
+    match (in any of its prefixed forms), the last one as a prefix for
+    type-ahead."""
+    tokens = _QUERY_TOKEN_RE.findall(normalize_arabic(raw_query))
+    if not tokens:
+        return None
+    groups = []
+    for position, token in enumerate(tokens):
+        suffix = "*" if position == len(tokens) - 1 else ""
+        variants = [token]
+        if _ARABIC_LETTER_RE.match(token):
+            stem = _strip_arabic_prefix(token)
+            bases = [stem]
+            if len(token) - len(stem) == 1:
+                # A single leading letter may belong to the word itself
+                # ("وضوء"), so expand the unstripped form as well.
+                bases.append(token)
+            variants = list(
+                dict.fromkeys(
+                    [token, *bases] + [prefix + base for base in bases for prefix in _ARABIC_PREFIXES]
+                )
+            )
+        quoted = ['"{}"{}'.format(v.replace('"', '""'), suffix) for v in variants]
+        groups.append("(" + " OR ".join(quoted) + ")")
+    return " AND ".join(groups)
+
+
+def _normalized_offsets(raw):
+    """Position in `raw` of each character of normalize_arabic(raw)."""
+    offsets = []
+    for position, char in enumerate(raw):
+        if not _ARABIC_MARKS_RE.match(char):
+            offsets.extend([position] * len(char.translate(_ARABIC_FOLDS).lower()))
+    return offsets
+
+
+def _match_starts(highlighted):
+    """Positions, in the unmarked text, where highlight() opened a match."""
+    starts = []
+    position = 0
+    for char in highlighted or "":
+        if char == _HL_START:
+            starts.append(position)
+        elif char != _HL_END:
+            position += 1
+    return starts
+
+
+def _render_snippet(raw, highlighted):
+    """HTML snippet of about _SNIPPET_WORDS words of the original text around
+    the densest group of matches, matched words in <mark>."""
+    raw = raw or ""
+    words = [match.span() for match in _RAW_WORD_RE.finditer(raw)]
+    if not words:
+        return ""
+    word_starts = [start for start, _ in words]
+    offsets = _normalized_offsets(raw)
+    hits = set()
+    for start in _match_starts(highlighted):
+        if start < len(offsets):
+            index = bisect.bisect_right(word_starts, offsets[start]) - 1
+            if index >= 0 and offsets[start] < words[index][1]:
+                hits.add(index)
+    # The window of words holding the most matches, the first of them about
+    # a quarter in (the start of the text when nothing is marked)
+    def window_score(first):
+        inside = sorted(hit for hit in hits if first <= hit < first + _SNIPPET_WORDS)
+        if not inside:
+            return (0, -first)
+        return (len(inside), -abs(inside[0] - first - _SNIPPET_WORDS // 4))
+
+    first = max(range(max(len(words) - _SNIPPET_WORDS, 0) + 1), key=window_score)
+    last = min(first + _SNIPPET_WORDS, len(words)) - 1
+    parts = ["…"] if first > 0 else []
+    position = words[first][0] if first > 0 else 0
+    for index in range(first, last + 1):
+        start, end = words[index]
+        parts.append(html.escape(raw[position:start]))
+        word = html.escape(raw[start:end])
+        parts.append(f"<mark>{word}</mark>" if index in hits else word)
+        position = end
+    if last < len(words) - 1:
+        parts.append("…")
+    else:
+        parts.append(html.escape(raw[position:]))
+    return "".join(parts)
+
+
+class SearchService:
+    @staticmethod
+    def ensure_index(connection=None):
+        """Creates the FTS5 table if it does not exist yet."""
+        global _index_ready
+        conn = connection or db.session.connection()
+        conn.execute(
+            text(f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5({_TABLE_COLUMNS})")
+        )
+        _index_ready = True
+
+    @staticmethod
+    def is_available(connection):
+        global _index_ready
+        if not _index_ready:
+            row = connection.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {"name": SEARCH_TABLE},
+            ).first()
+            _index_ready = row is not None
+        return _index_ready
+
+    # --- Incremental writes ---
+    @staticmethod
+    def _upsert(connection, rowid, kind, episode_id, title, body):
+        connection.execute(
+            text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = :rowid"), {"rowid": rowid}
+        )
+        connection.execute(
+            text(
+                f"INSERT INTO {SEARCH_TABLE} "
+                "(rowid, kind, episode_id, title, body, raw_title, raw_body) "
+                "VALUES (:rowid, :kind, :episode_id, :title, :body, :raw_title, :raw_body)"
+            ),
+            {
+                "rowid": rowid,
+                "kind": kind,
+                "episode_id": episode_id,
+                "title": normalize_arabic(title),
+                "body": normalize_arabic(body),
+                "raw_title": title or "",
+                "raw_body": body or "",
+            },
+        )
+
+    @staticmethod
+    def index_episode(connection, episode):
+        body = "\n\n".join(part for part in (episode.plan, episode.scenario) if part)
+        SearchService._upsert(
+            connection,
+            _episode_rowid(episode.id),
+            KIND_EPISODE,
+            episode.id,
+            episode.title,
+            body,
+        )
+
+    @staticmethod
+    def index_comment(connection, comment):
+        SearchService._upsert(
+            connection,
+            _comment_rowid(comment.id),
+            KIND_COMMENT,
+            comment.episode_id,
+            "",
+            comment.text,
+        )
+
+    @staticmethod
+    def remove_episode(connection, episode_id):
+        # Comments are usually removed by the ORM cascade as well, but raw
+        # deletes (ondelete=CASCADE) would leave them behind otherwise.
+        connection.execute(
+            text(f"DELETE FROM {SEARCH_TABLE} WHERE episode_id = :episode_id"),
+            {"episode_id": episode_id},
+        )
+
+    @staticmethod
+    def remove_comment(connection, comment_id):
+        connection.execute(
+            text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = :rowid"),
+            {"rowid": _comment_rowid(comment_id)},
+        )
+
+    @staticmethod
+    def rebuild_index():
+        """Drops and refills the whole index. Returns (episodes, comments)."""
+        conn = db.session.connection()
+        SearchService.ensure_index(conn)
+        conn.execute(text(f"DELETE FROM {SEARCH_TABLE}"))
+        episode_count = 0
+        for episode in Episode.query.yield_per(100):
+            SearchService.index_episode(conn, episode)
+            episode_count += 1
+        comment_count = 0
+        for comment in Comment.query.yield_per(500):
+            SearchService.index_comment(conn, comment)
+            comment_count += 1
+        conn.execute(
+            text(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+        )
+        db.session.commit()
+        return episode_count, comment_count
+
+    # --- Queries ---
+    @staticmethod
+    def search(raw_query, limit=20):
+        """Returns ranked hits with HTML-safe highlighted snippets."""
+        match = _build_match_query(raw_query)
+        if not match:
+            return []
+        conn = db.session.connection()
+        if not SearchService.is_available(conn):
+            return []
+        rows = conn.execute(
+            text(
+                # Rank first and mark matches only in the rows kept;
+                # highlight() is by far the most expensive part of the query.
+                f"WITH top AS (SELECT rowid, {_RANK_EXPR} AS score FROM {SEARCH_TABLE} "
+                f"WHERE {SEARCH_TABLE} MATCH :match ORDER BY score LIMIT :limit) "
+                f"SELECT s.rowid, s.kind, s.episode_id, e.title, top.score, "
+                f"s.raw_title, s.raw_body, "
+                f"highlight({SEARCH_TABLE}, 2, :hl_start, :hl_end) AS title_marked, "
+                f"highlight({SEARCH_TABLE}, 3, :hl_start, :hl_end) AS body_marked "
+                f"FROM {SEARCH_TABLE} s JOIN top ON top.rowid = s.rowid "
+                f"JOIN episode e ON e.id = s.episode_id "
+                f"WHERE {SEARCH_TABLE} MATCH :match ORDER BY top.score"
+            ),
+            {
+                "hl_start": _HL_START,
+                "hl_end": _HL_END,
+                "match": match,
+                "limit": limit,
+            },
+        ).all()
+        results = []
+        for row in rows:
+            # Like snippet(): the column with the most matches, title on ties
+            if row.body_marked.count(_HL_START) > row.title_marked.count(_HL_START):
+                snippet = _render_snippet(row.raw_body, row.body_marked)
+            else:
+                snippet = _render_snippet(row.raw_title, row.title_marked)
+            results.append(
+                {
+                    "kind": row.kind,
+                    "episode_id": row.episode_id,
+                    "episode_title": row.title,
+                    "comment_id": (row.rowid - 1) // 2 if row.kind == KIND_COMMENT else None,
+                    "snippet": snippet,
+                    "score": round(-row.score, 4),
+                }
+            )
+        return results
+
+
+# --- Session hooks (keep the index in step with ORM writes) ---
+def _episode_text_changed(episode):
+    state = inspect(episode)
+    return any(
+        state.attrs[name].history.has_changes() for name in ("title", "plan", "scenario")
+    )
+
+
+def _sync_search_index(session, flush_context):
+    connection = session.connection()
+    if not SearchService.is_available(connection):
+        return
+    for obj in session.new:
+        if isinstance(obj, Episode):
+            SearchService.index_episode(connection, obj)
+        elif isinstance(obj, Comment):
+            SearchService.index_comment(connection, obj)
+    for obj in session.dirty:
+        if isinstance(obj, Episode) and _episode_text_changed(obj):
+            SearchService.index_episode(connection, obj)
+        elif isinstance(obj, Comment) and inspect(obj).attrs.text.history.has_changes():
+            SearchService.index_comment(connection, obj)
+    for obj in session.deleted:
+        if isinstance(obj, Episode):
+            SearchService.remove_episode(connection, obj.id)
+        elif isinstance(obj, Comment):
+            SearchService.remove_comment(connection, obj.id)
+
+
+def register_search_hooks():
+    if not event.contains(db.session, "after_flush", _sync_search_index):
+        event.listen(db.session, "after_flush", _sync_search_index)
@@ -0,0 +1,243 @@
+# spend.py
+# Local cost ledger: what video generations cost, per day, episode, model and
+# user, from VideoGeneration.cost.
+#
+# SpendRollup holds the running totals. A session hook applies each change
+# of a generation's cost (or of the day/model/episode/user it counts for) as
+# a delta in the same transaction, so the rollup always matches the
+# generations. Deleting a generation, scene or episode leaves its spend in
+# the ledger. Reports read only the rollup table.
+
+from datetime import date, datetime
+
+from sqlalchemy import event, inspect
+from sqlalchemy.dialects.sqlite import insert
+
+from models import db, Episode, Scene, SpendRollup, User, VideoGeneration
+
+# Attributes that decide whether and where a generation is counted
+_COUNTED_ATTRS = ("cost", "completed_at", "created_at", "model", "created_by", "scene_id")
+
+# group_by name -> rollup column
+GROUPS = {
+    "day": SpendRollup.day,
+    "episode": SpendRollup.episode_id,
+    "model": SpendRollup.model,
+    "user": SpendRollup.user_id,
+}
+
+
+def _key(day_source, episode_id, model, user_id):
+    day = (day_source or datetime.utcnow()).date()
+    return (day, episode_id, model, user_id or 0)
+
+
+def _episode_id_of_scene(connection, scene_id):
+    return connection.execute(
+        db.select(Scene.episode_id).where(Scene.id == scene_id)
+    ).scalar()
+
+
+# --- Session hooks (old contribution before the flush, delta after it) ---
+def _stored_contributions(session, flush_context, instances):
+    """Before a flush: what the changed generations count for in the database now."""
+    changed = [
+        gen.id
+        for gen in session.dirty
+        if isinstance(gen, VideoGeneration)
+        and any(inspect(gen).attrs[attr].history.has_changes() for attr in _COUNTED_ATTRS)
+    ]
+    if not changed:
+        return
+    rows = session.connection().execute(
+        db.select(
+            VideoGeneration.id,
+            VideoGeneration.cost,
+            VideoGeneration.completed_at,
+            VideoGeneration.created_at,
+            Scene.episode_id,
+            VideoGeneration.model,
+            VideoGeneration.created_by,
+        )
+        .join(Scene, VideoGeneration.scene_id == Scene.id)
+        .where(VideoGeneration.id.in_(changed), VideoGeneration.cost.isnot(None))
+    )
+    stored = session.info.setdefault("spend_stored", {})
+    for gen_id, cost, completed_at, created_at, episode_id, model, user_id in rows:
+        stored[gen_id] = (_key(completed_at or created_at, episode_id, model, user_id), cost)
+
+
+def _apply_deltas(session, flush_context):
+    """After a flush: moves each changed generation's cost in the rollup."""
+    stored = session.info.pop("spend_stored", {})
+    deltas = {}  # key -> [cost, count]
+    for gen in list(session.new) + list(session.dirty):
+        if not isinstance(gen, VideoGeneration):
+            continue
+        if gen in session.dirty and not any(
+            inspect(gen).attrs[attr].history.has_changes() for attr in _COUNTED_ATTRS
+        ):
+            continue
+        old = stored.get(gen.id)
+        if old is not None:
+            delta = deltas.setdefault(old[0], [0.0, 0])
+            delta[0] -= old[1]
+            delta[1] -= 1
+        if gen.cost is not None:
+            episode_id = _episode_id_of_scene(session.connection(), gen.scene_id)
+            key = _key(gen.completed_at or gen.created_at, episode_id, gen.model, gen.created_by)
+            delta = deltas.setdefault(key, [0.0, 0])
+            delta[0] += gen.cost
+            delta[1] += 1
+    for (day, episode_id, model, user_id), (cost, count) in deltas.items():
+        if cost or count:
+            _add(session.connection(), day, episode_id, model, user_id, cost, count)
+
+
+def _forget_stored(session, previous_transaction):
+    session.info.pop("spend_stored", None)
+
+
+def _add(connection, day, episode_id, model, user_id, cost, count):
+    table = SpendRollup.__table__
+    stmt = insert(table).values(
+        day=day,
+        episode_id=episode_id,
+        model=model,
+        user_id=user_id,
+        cost=cost,
+        generation_count=count,
+    )
+    connection.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["day", "episode_id", "model", "user_id"],
+            set_={
+                "cost": table.c.cost + stmt.excluded.cost,
+                "generation_count": table.c.generation_count + stmt.excluded.generation_count,
+            },
+        )
+    )
+
+
+def register_spend_hooks():
+    for name, listener in (
+        ("before_flush", _stored_contributions),
+        ("after_flush", _apply_deltas),
+        ("after_soft_rollback", _forget_stored),
+    ):
+        if not event.contains(db.session, name, listener):
+            event.listen(db.session, name, listener)
+
+
+# --- Rebuild ---
+def rebuild_spend_rollup():
+    """Recomputes the rollup from the generations still in the database.
+    Spend of deleted generations is lost. Returns the number of rows."""
+    day = db.func.date(db.func.coalesce(VideoGeneration.completed_at, VideoGeneration.created_at))
+    user_id = db.func.coalesce(VideoGeneration.created_by, 0)
+    select = (
+        db.select(
+            day,
+            Scene.episode_id,
+            VideoGeneration.model,
+            user_id,
+            db.func.count(VideoGeneration.id),
+            db.func.sum(VideoGeneration.cost),
+        )
+        .join(Scene, VideoGeneration.scene_id == Scene.id)
+        .where(VideoGeneration.cost.isnot(None))
+        .group_by(day, Scene.episode_id, VideoGeneration.model, user_id)
+    )
+    try:
+        db.session.execute(db.delete(SpendRollup))
+        db.session.execute(
+            db.insert(SpendRollup).from_select(
+                ["day", "episode_id", "model", "user_id", "generation_count", "cost"], select
+            )
+        )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return db.session.query(SpendRollup).count()
+
+
+# --- Reports (rollup only) ---
+def report_args(args):
+    """spend_report() arguments from query parameters (group_by, since, until,
+    episode_id, model, user_id). Raises ValueError on a malformed value."""
+    group_by = args.get("group_by", "day")
+    if group_by not in GROUPS:
+        raise ValueError(f"group_by must be one of {', '.join(GROUPS)}")
+    kwargs = {"group_by": group_by}
+    for name in ("since", "until"):
+        if args.get(name):
+            kwargs[name] = datetime.strptime(args[name], "%Y-%m-%d").date()
+    for name in ("episode_id", "user_id"):
+        if args.get(name):
+            kwargs[name] = int(args[name])
+    if args.get("model"):
+        kwargs["model"] = args["model"]
+    return kwargs
+
+
+def _filtered(query, since=None, until=None, episode_id=None, model=None, user_id=None):
+    if since is not None:
+        query = query.filter(SpendRollup.day >= since)
+    if until is not None:
+        query = query.filter(SpendRollup.day <= until)
+    if episode_id is not None:
+        query = query.filter(SpendRollup.episode_id == episode_id)
+    if model is not None:
+        query = query.filter(SpendRollup.model == model)
+    if user_id is not None:
+        query = query.filter(SpendRollup.user_id == user_id)
+    return query
+
+
+def _labels(group_by, keys):
+    if group_by == "episode":
+        rows = db.session.query(Episode.id, Episode.title).filter(Episode.id.in_(keys))
+    elif group_by == "user":
+        rows = db.session.query(User.id, User.username).filter(User.id.in_(keys))
+    else:
+        return {key: str(key) for key in keys}
+    return dict(rows)
+
+
+def spend_report(group_by="day", since=None, until=None, **filters):
+    """
+    Spend grouped by day, episode, model or user, biggest first (days:
+    newest first).
+
+    Args:
+        since/until: dates (inclusive).
+        filters: episode_id, model, user_id.
+
+    Returns:
+        {"rows": [{"key", "label", "generations", "cost_usd"}],
+         "total": {"generations", "cost_usd"}}
+    """
+    column = GROUPS[group_by]
+    cost = db.func.sum(SpendRollup.cost)
+    count = db.func.sum(SpendRollup.generation_count)
+    query = _filtered(db.session.query(column, count, cost), since, until, **filters)
+    query = query.group_by(column).having(count > 0)
+    query = query.order_by(column.desc() if group_by == "day" else cost.desc())
+    rows = query.all()
+    labels = _labels(group_by, [key for key, _, _ in rows])
+    total_count, total_cost = _filtered(
+        db.session.query(count, cost), since, until, **filters
+    ).one()
+    return {
+        "rows": [
+            {
+                "key": key.isoformat() if isinstance(key, date) else key,
+                "label": labels.get(key) or ("—" if group_by in ("episode", "user") else str(key)),
+                "generations": generations,
+                "cost_usd": round(total, 6),
+            }
+            for key, generations, total in rows
+        ],
+        "total": {"generations": total_count or 0, "cost_usd": round(total_cost or 0.0, 6)},
+    }
@@ -0,0 +1,97 @@
+# startup_bench.py
+# Reports how long loading the app takes and which modules it is spent in,
+# using Python's `-X importtime`. Each run starts a fresh interpreter, so the
+# numbers match a worker (re)spawn or a `flask` command.
+#
+#   python startup_bench.py                    # worker and CLI, 5 runs each
+#   python startup_bench.py worker --top 40    # one scenario, more modules
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SCENARIOS = {
+    # What a gunicorn worker or `python app.py` loads
+    "worker": ["-c", "import app; app.create_app()"],
+    # What any of the app's own flask commands loads before running
+    "cli": ["-m", "flask", "--app", "app", "--help"],
+}
+
+
+def _run(args):
+    """(wall seconds, {module: (self_us, cumulative_us)}) of one fresh interpreter."""
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        cwd=HERE,
+        capture_output=True,
+        text=True,
+    )
+    wall = time.perf_counter() - started
+    if result.returncode != 0:
+        sys.exit(f"Failed to start ({' '.join(args)}):\n{result.stderr[-2000:]}")
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return wall, modules
+
+
+def _package(module):
+    return module.split(".")[0]
+
+
+def bench(name, runs, top):
+    walls = []
+    per_package = {}  # package -> [self time of each run]
+    per_module = {}  # module -> [cumulative time of each run]
+    for _ in range(runs):
+        wall, modules = _run(SCENARIOS[name])
+        walls.append(wall)
+        totals = {}
+        for module, (self_us, cumulative_us) in modules.items():
+            totals[_package(module)] = totals.get(_package(module), 0) + self_us
+            per_module.setdefault(module, []).append(cumulative_us)
+        for package, total in totals.items():
+            per_package.setdefault(package, []).append(total)
+
+    import_ms = sum(statistics.median(times) for times in per_package.values()) / 1000
+    print(f"== {name}: {' '.join(SCENARIOS[name])}")
+    print(
+        f"   wall {statistics.median(walls) * 1000:.0f} ms (median of {runs}), "
+        f"imports {import_ms:.0f} ms, {len(per_module)} modules"
+    )
+    print(f"   {'package (self time of all its modules)':<48}{'ms':>8}")
+    ranked = sorted(per_package.items(), key=lambda item: -statistics.median(item[1]))
+    for package, times in ranked[:top]:
+        print(f"   {package:<48}{statistics.median(times) / 1000:>8.1f}")
+    # The app's own modules, with everything they pull in
+    print(f"   {'app module (cumulative)':<48}{'ms':>8}")
+    own = sorted(
+        (module for module in per_module if os.path.exists(os.path.join(HERE, module + ".py"))),
+        key=lambda module: -statistics.median(per_module[module]),
+    )
+    for module in own:
+        print(f"   {module:<48}{statistics.median(per_module[module]) / 1000:>8.1f}")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time of the app, per module.")
+    parser.add_argument("scenarios", nargs="*", choices=[[], *SCENARIOS], default=[])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=20, help="Packages to list.")
+    args = parser.parse_args()
+    for name in args.scenarios or SCENARIOS:
+        bench(name, args.runs, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,430 @@
+// static/js/live_edit.js
+// Live co-editing client for the episode plan/scenario (server side: collab.py).
+//
+// Operations use the ot.js format: positive number = retain, string =
+// insert, negative number = delete. Lengths count Unicode code points so
+// they agree with Python string lengths on the server.
+
+const LiveOT = (() => {
+  function isRetain(c) { return typeof c === 'number' && c > 0; }
+  function isDelete(c) { return typeof c === 'number' && c < 0; }
+  function isInsert(c) { return typeof c === 'string'; }
+
+  function cpLength(str) {
+    let count = 0;
+    for (let i = 0; i < str.length; i++) {
+      const code = str.charCodeAt(i);
+      if (code < 0xDC00 || code > 0xDFFF) count++;  // Skip low surrogates
+    }
+    return count;
+  }
+
+  // UTF-16 index reached after moving `count` code points from `from`.
+  function advance(str, from, count) {
+    let i = from;
+    while (count > 0 && i < str.length) {
+      const code = str.charCodeAt(i);
+      i += (code >= 0xD800 && code <= 0xDBFF && i + 1 < str.length) ? 2 : 1;
+      count--;
+    }
+    return i;
+  }
+
+  function push(ops, c) {
+    if (c === 0 || c === '') return;
+    const last = ops[ops.length - 1];
+    if (ops.length) {
+      if (isInsert(c) && isInsert(last)) { ops[ops.length - 1] = last + c; return; }
+      if (isRetain(c) && isRetain(last)) { ops[ops.length - 1] = last + c; return; }
+      if (isDelete(c) && isDelete(last)) { ops[ops.length - 1] = last + c; return; }
+      if (isInsert(c) && isDelete(last)) {
+        // Inserts go before deletes, as on the server.
+        if (ops.length > 1 && isInsert(ops[ops.length - 2])) {
+          ops[ops.length - 2] += c;
+        } else {
+          ops.splice(ops.length - 1, 0, c);
+        }
+        return;
+      }
+    }
+    ops.push(c);
+  }
+
+  function apply(str, op) {
+    const parts = [];
+    let pos = 0;
+    for (const c of op) {
+      if (isInsert(c)) {
+        parts.push(c);
+      } else if (c > 0) {
+        const end = advance(str, pos, c);
+        parts.push(str.slice(pos, end));
+        pos = end;
+      } else {
+        pos = advance(str, pos, -c);
+      }
+    }
+    return parts.join('');
+  }
+
+  // Operation turning `oldText` into `newText` (one changed region, which is
+  // what a single textarea input event produces).
+  function diff(oldText, newText) {
+    let prefix = 0;
+    const limit = Math.min(oldText.length, newText.length);
+    while (prefix < limit && oldText.charCodeAt(prefix) === newText.charCodeAt(prefix)) prefix++;
+    if (prefix > 0 && /[\uD800-\uDBFF]/.test(oldText[prefix - 1])) prefix--;
+    let suffix = 0;
+    while (suffix < limit - prefix &&
+           oldText.charCodeAt(oldText.length - 1 - suffix) ===
+               newText.charCodeAt(newText.length - 1 - suffix)) {
+      suffix++;
+    }
+    if (suffix > 0 && /[\uDC00-\uDFFF]/.test(oldText[oldText.length - suffix])) suffix--;
+    const ops = [];
+    push(ops, cpLength(oldText.slice(0, prefix)));
+    push(ops, newText.slice(prefix, newText.length - suffix));
+    push(ops, -cpLength(oldText.slice(prefix, oldText.length - suffix)));
+    push(ops, cpLength(oldText.slice(oldText.length - suffix)));
+    return ops;
+  }
+
+  function transform(a, b) {
+    const aPrime = [], bPrime = [];
+    let ia = 0, ib = 0;
+    let ca = a[ia], cb = b[ib];
+    while (ca !== undefined || cb !== undefined) {
+      if (isInsert(ca)) {
+        push(aPrime, ca); push(bPrime, cpLength(ca));
+        ca = a[++ia];
+        continue;
+      }
+      if (isInsert(cb)) {
+        push(aPrime, cpLength(cb)); push(bPrime, cb);
+        cb = b[++ib];
+        continue;
+      }
+      if (ca === undefined || cb === undefined) throw new Error('Cannot transform operations');
+      let step;
+      if (isRetain(ca) && isRetain(cb)) {
+        step = Math.min(ca, cb);
+        push(aPrime, step); push(bPrime, step);
+      } else if (isDelete(ca) && isDelete(cb)) {
+        step = Math.min(-ca, -cb);
+      } else if (isDelete(ca)) {
+        step = Math.min(-ca, cb);
+        push(aPrime, -step);
+      } else {
+        step = Math.min(ca, -cb);
+        push(bPrime, -step);
+      }
+      ca = ca > 0 ? ca - step : ca + step;
+      cb = cb > 0 ? cb - step : cb + step;
+      if (ca === 0) ca = a[++ia];
+      if (cb === 0) cb = b[++ib];
+    }
+    return [aPrime, bPrime];
+  }
+
+  // Single operation equivalent to applying `a` then `b`.
+  function compose(a, b) {
+    const ops = [];
+    let ia = 0, ib = 0;
+    let ca = a[ia], cb = b[ib];
+    while (ca !== undefined || cb !== undefined) {
+      if (isDelete(ca)) { push(ops, ca); ca = a[++ia]; continue; }
+      if (isInsert(cb)) { push(ops, cb); cb = b[++ib]; continue; }
+      if (ca === undefined || cb === undefined) throw new Error('Cannot compose operations');
+      if (isRetain(ca) && isRetain(cb)) {
+        const step = Math.min(ca, cb);
+        push(ops, step);
+        ca -= step; cb -= step;
+      } else if (isInsert(ca) && isDelete(cb)) {
+        const len = cpLength(ca);
+        const step = Math.min(len, -cb);
+        ca = ca.slice(advance(ca, 0, step));
+        cb += step;
+        if (ca === '') ca = 0;
+      } else if (isInsert(ca) && isRetain(cb)) {
+        const len = cpLength(ca);
+        const step = Math.min(len, cb);
+        const cut = advance(ca, 0, step);
+        push(ops, ca.slice(0, cut));
+        ca = ca.slice(cut);
+        cb -= step;
+        if (ca === '') ca = 0;
+      } else {  // a retains, b deletes
+        const step = Math.min(ca, -cb);
+        push(ops, -step);
+        ca -= step; cb += step;
+      }
+      if (ca === 0) ca = a[++ia];
+      if (cb === 0) cb = b[++ib];
+    }
+    return ops;
+  }
+
+  // Where a cursor (code point index) ends up after `op`.
+  function transformIndex(op, index) {
+    let newIndex = index;
+    let remaining = index;
+    for (const c of op) {
+      if (isRetain(c)) {
+        remaining -= c;
+      } else if (isInsert(c)) {
+        newIndex += cpLength(c);
+      } else {
+        newIndex -= Math.min(remaining, -c);
+        remaining += c;
+      }
+      if (remaining < 0) break;
+    }
+    return newIndex;
+  }
+
+  return {apply, diff, transform, compose, transformIndex, cpLength, advance};
+})();
+
+
+// One SSE connection per page carrying both fields. `fields` maps a field
+// name to {textarea, onRemoteChange}; textarea is null for read-only pages.
+// onStoredRevisions receives the stored revision of each field whenever the
+// server reports it (snapshot, reset, saved).
+function createLiveSession(
+    {episodeId, fields, canEdit, onStatus, onPresence, onSaved, onStoredRevisions}) {
+  const PRESENCE_INTERVAL_MS = 20000;
+  const RECONNECT_DELAY_MS = 3000;
+  const state = {};
+  let clientId = null;
+  let source = null;
+  let connected = false;
+  let presenceTimer = null;
+  let focusedField = null;
+
+  Object.keys(fields).forEach(name => {
+    state[name] = {
+      revision: null,
+      text: null,        // Local document as last synced into the textarea
+      outstanding: null, // Sent, waiting for its broadcast
+      buffer: null,      // Typed while waiting
+      epoch: null,       // Identifies the server's copy of the document
+      inFlight: false,
+      desynced: false,
+      ...fields[name],
+    };
+  });
+
+  function setStatus(status) { if (onStatus) onStatus(status); }
+
+  function sendOperation(name) {
+    const s = state[name];
+    s.inFlight = true;
+    fetch(`/api/episodes/${episodeId}/live/op`, {
+      method: 'POST',
+      headers: {'Content-Type': 'application/json'},
+      body: JSON.stringify({
+        client_id: clientId,
+        field: name,
+        revision: s.revision,
+        operation: s.outstanding,
+      }),
+    }).then(response => {
+      s.inFlight = false;
+      if (response.status === 409) s.desynced = true;
+      if (!response.ok) throw new Error(`HTTP ${response.status}`);
+    }).catch(error => {
+      s.inFlight = false;
+      console.error(`Live edit of ${name} rejected:`, error);
+      reconnect();
+    });
+  }
+
+  // Puts text into the textarea, keeping the user's selection in place.
+  function setTextareaValue(s, newText, op) {
+    const textarea = s.textarea;
+    if (!textarea) return;
+    const oldText = textarea.value;
+    const hasFocus = document.activeElement === textarea;
+    const start = LiveOT.cpLength(oldText.slice(0, textarea.selectionStart));
+    const end = LiveOT.cpLength(oldText.slice(0, textarea.selectionEnd));
+    textarea.value = newText;
+    if (hasFocus) {
+      const newStart = op ? LiveOT.transformIndex(op, start) : start;
+      const newEnd = op ? LiveOT.transformIndex(op, end) : end;
+      textarea.setSelectionRange(
+          LiveOT.advance(newText, 0, newStart), LiveOT.advance(newText, 0, newEnd));
+    }
+  }
+
+  function handleLocalInput(name) {
+    const s = state[name];
+    if (!connected || s.revision === null) return;
+    const newText = s.textarea.value;
+    if (newText === s.text) return;
+    const op = LiveOT.diff(s.text, newText);
+    s.text = newText;
+    if (s.outstanding === null) {
+      s.outstanding = op;
+      sendOperation(name);
+    } else {
+      s.buffer = s.buffer === null ? op : LiveOT.compose(s.buffer, op);
+    }
+  }
+
+  function applyRemote(name, op) {
+    const s = state[name];
+    // Fold in any keystrokes not yet turned into an operation.
+    if (s.textarea && s.textarea.value !== s.text) handleLocalInput(name);
+    if (s.outstanding !== null) {
+      [s.outstanding, op] = LiveOT.transform(s.outstanding, op);
+      if (s.buffer !== null) [s.buffer, op] = LiveOT.transform(s.buffer, op);
+    }
+    s.text = LiveOT.apply(s.text, op);
+    setTextareaValue(s, s.text, op);
+    if (s.onRemoteChange) s.onRemoteChange(s.text);
+  }
+
+  function handleOperation(data) {
+    const s = state[data.field];
+    if (!s) return;
+    if (data.client_id === clientId) {
+      // Our own edit came back: it is now part of the shared document.
+      s.revision = data.revision;
+      s.outstanding = s.buffer;
+      s.buffer = null;
+      if (s.outstanding !== null) sendOperation(data.field);
+      return;
+    }
+    s.revision = data.revision;
+    applyRemote(data.field, data.operation);
+  }
+
+  function loadField(name, snapshot) {
+    const s = state[name];
+    const wasSynced = s.revision !== null;
+    if (wasSynced && snapshot.missed && !s.desynced) {
+      // Reconnected while the server still had our history: replay what we
+      // missed (our own edits among it count as acks), then catch up on
+      // anything typed while offline.
+      snapshot.missed.forEach(entry => handleOperation({
+        field: name,
+        client_id: entry.client_id,
+        operation: entry.operation,
+        revision: s.revision + 1,
+      }));
+      if (s.outstanding !== null && !s.inFlight) sendOperation(name);
+      handleLocalInput(name);
+      return;
+    }
+    const localText = s.textarea ? s.textarea.value : s.text;
+    const pending = wasSynced &&
+        (s.outstanding !== null || localText !== s.text || s.desynced);
+    s.revision = snapshot.revision;
+    s.epoch = snapshot.epoch;
+    s.outstanding = null;
+    s.buffer = null;
+    s.desynced = false;
+    s.text = snapshot.text;
+    if (pending && s.textarea && localText !== snapshot.text) {
+      // The server no longer has our history (restart, outside save):
+      // re-apply our text on top of its copy as one edit.
+      handleLocalInput(name);
+    } else {
+      setTextareaValue(s, snapshot.text, null);
+    }
+    if (s.onRemoteChange) s.onRemoteChange(s.textarea ? s.textarea.value : s.text);
+  }
+
+  function reportStoredRevisions(data) {
+    if (onStoredRevisions && data.stored_revisions) onStoredRevisions(data.stored_revisions);
+  }
+
+  function sendPresence() {
+    if (!connected) return;
+    fetch(`/api/episodes/${episodeId}/live/presence`, {
+      method: 'POST',
+      headers: {'Content-Type': 'application/json'},
+      body: JSON.stringify({client_id: clientId, field: focusedField}),
+    }).catch(() => {});
+  }
+
+  function connect() {
+    const params = new URLSearchParams();
+    if (clientId) params.set('client_id', clientId);
+    Object.keys(state).forEach(name => {
+      const s = state[name];
+      if (s.revision !== null) params.set(`${name}_rev`, `${s.epoch}:${s.revision}`);
+    });
+    setStatus('connecting');
+    source = new EventSource(`/api/episodes/${episodeId}/live/stream?${params}`);
+    source.addEventListener('snapshot', event => {
+      const data = JSON.parse(event.data);
+      clientId = data.client_id;
+      connected = true;
+      Object.keys(state).forEach(name => loadField(name, data.fields[name]));
+      if (onPresence) onPresence(data.users);
+      reportStoredRevisions(data);
+      setStatus('live');
+    });
+    source.addEventListener('op', event => handleOperation(JSON.parse(event.data)));
+    source.addEventListener('reset', event => {
+      const data = JSON.parse(event.data);
+      const s = state[data.field];
+      if (!s) return;
+      s.revision = data.revision;
+      s.outstanding = null;
+      s.buffer = null;
+      s.text = data.text;
+      setTextareaValue(s, data.text, null);
+      if (s.onRemoteChange) s.onRemoteChange(data.text);
+      reportStoredRevisions(data);
+    });
+    source.addEventListener('presence', event => {
+      if (onPresence) onPresence(JSON.parse(event.data).users);
+    });
+    source.addEventListener('saved', event => {
+      const data = JSON.parse(event.data);
+      reportStoredRevisions(data);
+      if (onSaved) onSaved(data);
+    });
+    source.onerror = () => {
+      // EventSource retries by itself with the old URL; reconnect with ours
+      // so the server can replay what we missed.
+      reconnect();
+    };
+  }
+
+  function reconnect() {
+    connected = false;
+    if (source) source.close();
+    source = null;
+    setStatus('offline');
+    setTimeout(connect, RECONNECT_DELAY_MS);
+  }
+
+  Object.keys(state).forEach(name => {
+    const textarea = state[name].textarea;
+    if (!textarea || !canEdit) return;
+    textarea.addEventListener('input', () => handleLocalInput(name));
+    textarea.addEventListener('focus', () => { focusedField = name; sendPresence(); });
+    textarea.addEventListener('blur', () => { focusedField = null; sendPresence(); });
+  });
+
+  connect();
+  presenceTimer = setInterval(sendPresence, PRESENCE_INTERVAL_MS);
+
+  return {
+    isConnected: () => connected,
+    // Saves pending live edits now (the server otherwise batches them).
+    flush: async () => {
+      const response = await fetch(`/api/episodes/${episodeId}/live/flush`, {method: 'POST'});
+      const data = await response.json();
+      if (!response.ok || !data.success) throw new Error(data.message || 'فشل الحفظ');
+      return data;
+    },
+    close: () => {
+      clearInterval(presenceTimer);
+      if (source) source.close();
+    },
+  };
+}
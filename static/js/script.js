@@ -1,5 +1,14 @@
 // static/js/script.js (Arabic Version - Register Service Worker)
 
+// Stored revision of each episode field, sent with whole-field saves (also
+// when the service worker queues them offline) so that the server refuses a
+// save based on text someone else has changed since.
+const storedRevisions = Object.assign(
+    {}, typeof INITIAL_STORED_REVISIONS !== 'undefined' ? INITIAL_STORED_REVISIONS : {});
+function noteStoredRevisions(revisions) {
+  Object.assign(storedRevisions, revisions || {});
+}
+
 document.addEventListener('DOMContentLoaded', () => {
   console.log('DOM fully loaded and parsed - Main script.js running.');
 
@@ -59,6 +68,9 @@ document.addEventListener('DOMContentLoaded', () => {
   const filterForm = document.getElementById('filter-form');
   const filterMaslakSelect = document.getElementById('filter_maslak_id');
   const filterStatusSelect = document.getElementById('filter_status');
+  const searchInput = document.getElementById('search-input');
+  const searchStatus = document.getElementById('search-status');
+  const searchResults = document.getElementById('search-results');
 
 
   let currentEditingBlock = null;
@@ -99,6 +111,68 @@ document.addEventListener('DOMContentLoaded', () => {
     });
   }
 
+  // --- Full-text Search on Dashboard ---
+  if (searchInput && searchResults) {
+    let searchTimer = null;
+    let latestSearch = 0;
+    searchInput.addEventListener('input', () => {
+      clearTimeout(searchTimer);
+      searchTimer = setTimeout(() => runSearch(searchInput.value.trim()), 250);
+    });
+
+    async function runSearch(query) {
+      const searchId = ++latestSearch;
+      if (!query) {
+        searchResults.innerHTML = '';
+        searchStatus.textContent = '';
+        return;
+      }
+      searchStatus.textContent = 'جارٍ البحث...';
+      try {
+        const response =
+            await fetch(`/api/search?q=${encodeURIComponent(query)}`);
+        const data = await response.json();
+        if (searchId !== latestSearch) return;  // A newer query is running
+        if (!response.ok || !data.success) {
+          throw new Error(data.message || 'فشل البحث');
+        }
+        renderSearchResults(data.results);
+      } catch (error) {
+        if (searchId !== latestSearch) return;
+        console.error('Search error:', error);
+        searchStatus.textContent = `خطأ: ${error.message}`;
+      }
+    }
+
+    function renderSearchResults(results) {
+      searchResults.innerHTML = '';
+      searchStatus.textContent =
+          results.length ? `${results.length} نتيجة` : 'لا توجد نتائج.';
+      results.forEach(result => {
+        const li = document.createElement('li');
+        li.classList.add(
+            'border', 'border-gray-200', 'rounded', 'p-2', 'hover:bg-gray-50');
+        const link = document.createElement('a');
+        link.href = result.url;
+        link.classList.add(
+            'text-blue-700', 'hover:text-blue-900', 'font-semibold', 'text-sm');
+        link.textContent = result.episode_title;
+        const badge = document.createElement('span');
+        badge.classList.add(
+            'mr-2', 'text-xs', 'px-2', 'py-0.5', 'rounded-full',
+            result.kind === 'comment' ? 'bg-purple-100' : 'bg-indigo-100',
+            result.kind === 'comment' ? 'text-purple-800' : 'text-indigo-800');
+        badge.textContent = result.kind === 'comment' ? 'تعليق' : 'حلقة';
+        const snippet = document.createElement('p');
+        snippet.classList.add('search-snippet', 'text-xs', 'text-gray-600', 'mt-1');
+        // Snippets are HTML-escaped server-side; only <mark> is emitted.
+        snippet.innerHTML = result.snippet;
+        li.append(link, badge, snippet);
+        searchResults.appendChild(li);
+      });
+    }
+  }
+
   // Function to save the new order via fetch
   async function saveEpisodeOrder(orderedIds) {
     // ... (saveEpisodeOrder remains the same) ...
@@ -128,29 +202,130 @@ document.addEventListener('DOMContentLoaded', () => {
       typeof IS_ADMIN !== 'undefined') {
     // ... (All episode page logic remains the same) ...
     console.log('Episode page detected. Initializing episode features.');
+    // Per-block comment counts; thread bodies are fetched when opened.
+    let commentCounts = typeof INITIAL_COMMENT_COUNTS !== 'undefined' ?
+        {...INITIAL_COMMENT_COUNTS} :
+        {};
     console.log(`User ID: ${CURRENT_USER_ID}, Is Admin: ${IS_ADMIN}`);
     if (planDisplay && typeof INITIAL_PLAN !== 'undefined')
       renderPlanMarkdown(INITIAL_PLAN);
     if (scenarioDisplay && typeof INITIAL_SCENARIO !== 'undefined')
       renderScenario(INITIAL_SCENARIO);
-    if (typeof INITIAL_COMMENTS_BY_BLOCK !== 'undefined')
-      renderComments(INITIAL_COMMENTS_BY_BLOCK);
+    renderComments(commentCounts);
     if (planEditorWrapper) planEditorWrapper.classList.add('hidden');
     if (planDisplay) planDisplay.classList.remove('hidden');
     if (scenarioEditorWrapper) scenarioEditorWrapper.classList.add('hidden');
     if (scenarioDisplay) scenarioDisplay.classList.remove('hidden');
     if (commentInstruction) commentInstruction.style.display = 'block';
+    // --- Live co-editing (static/js/live_edit.js) ---
+    // Edits are streamed as they are typed and saved by the server in
+    // batches; the save buttons only force an immediate save. Without a live
+    // connection they fall back to posting the whole field.
+    let liveSession = null;
+    const liveStatus = document.getElementById('live-status');
+    const livePresence = document.getElementById('live-presence');
+    const liveRenderTimers = {};
+    if (typeof createLiveSession === 'function' && window.EventSource) {
+      liveSession = createLiveSession({
+        episodeId: EPISODE_ID,
+        canEdit: IS_ASSIGNED,
+        fields: {
+          plan: {
+            textarea: planArea,
+            onRemoteChange: text => scheduleLiveRender('plan', text),
+          },
+          scenario: {
+            textarea: scenarioArea,
+            onRemoteChange: text => scheduleLiveRender('scenario', text),
+          },
+        },
+        onStatus: renderLiveStatus,
+        onPresence: renderLivePresence,
+        onStoredRevisions: noteStoredRevisions,
+        onSaved: data => {
+          if (data.comment_counts) {
+            // The server re-anchored comments to the edited blocks.
+            commentCounts = data.comment_counts;
+            renderComments(commentCounts);
+          }
+        },
+      });
+    }
+    function scheduleLiveRender(type, text) {
+      const display = type === 'plan' ? planDisplay : scenarioDisplay;
+      if (!display || display.classList.contains('hidden')) return;
+      clearTimeout(liveRenderTimers[type]);
+      liveRenderTimers[type] = setTimeout(() => {
+        if (type === 'plan') renderPlanMarkdown(text);
+        else renderScenario(text);
+      }, 300);
+    }
+    function renderLiveStatus(status) {
+      if (!liveStatus) return;
+      const labels = {
+        connecting: ['جارٍ الاتصال...', 'text-gray-500'],
+        live: ['● تحرير مباشر', 'text-green-600'],
+        offline: ['غير متصل - إعادة المحاولة...', 'text-red-600'],
+      };
+      const [label, color] = labels[status] || labels.offline;
+      liveStatus.textContent = label;
+      liveStatus.classList.remove('text-gray-500', 'text-green-600', 'text-red-600');
+      liveStatus.classList.add(color);
+    }
+    function renderLivePresence(users) {
+      if (!livePresence) return;
+      const fieldLabels = {plan: 'يحرر الخطة', scenario: 'يحرر السيناريو'};
+      const byName = new Map();
+      (users || []).forEach(user => {
+        // One chip per person even with several tabs open.
+        if (!byName.has(user.username) || user.field) byName.set(user.username, user.field);
+      });
+      livePresence.innerHTML = '';
+      byName.forEach((field, username) => {
+        const chip = document.createElement('span');
+        chip.className = 'inline-block px-2 py-0.5 rounded-full bg-indigo-50 text-indigo-700';
+        chip.textContent = field ? `${username} (${fieldLabels[field]})` : username;
+        livePresence.appendChild(chip);
+      });
+    }
+    async function saveField(type, statusElement) {
+      const area = type === 'plan' ? planArea : scenarioArea;
+      if (!liveSession || !liveSession.isConnected()) {
+        return saveContent(type, area.value, statusElement);
+      }
+      statusElement.textContent = 'جارٍ الحفظ...';
+      statusElement.classList.remove('text-green-600', 'text-red-600');
+      statusElement.classList.add('text-gray-500');
+      try {
+        await liveSession.flush();
+        statusElement.textContent = 'تم الحفظ بنجاح!';
+        statusElement.classList.remove('text-gray-500', 'text-red-600');
+        statusElement.classList.add('text-green-600');
+        setTimeout(() => statusElement.textContent = '', 3000);
+        return true;
+      } catch (error) {
+        if (error instanceof TypeError) {
+          // No connection yet the live session hasn't noticed: save the
+          // whole field (queued by the service worker while offline)
+          return saveContent(type, area.value, statusElement);
+        }
+        console.error(`Error saving ${type}:`, error);
+        statusElement.textContent = `خطأ: ${error.message}`;
+        statusElement.classList.remove('text-gray-500', 'text-green-600');
+        statusElement.classList.add('text-red-600');
+        return false;
+      }
+    }
     if (savePlanBtn && IS_ASSIGNED) {
       savePlanBtn.addEventListener('click', () => {
-        saveContent('plan', planArea.value, planStatus).then(success => {
+        saveField('plan', planStatus).then(success => {
           if (success) renderPlanMarkdown(planArea.value);
         });
       });
     }
     if (saveScenarioBtn && IS_ASSIGNED) {
       saveScenarioBtn.addEventListener('click', () => {
-        const newScenario = scenarioArea.value;
-        saveContent('scenario', newScenario, scenarioStatus).then(success => {
+        saveField('scenario', scenarioStatus).then(success => {
           if (success) renderScenario(scenarioArea.value);
         });
       });
@@ -275,14 +450,15 @@ document.addEventListener('DOMContentLoaded', () => {
         }
       });
     }
-    if (IS_ASSIGNED && scenarioDisplay) {
+    if (scenarioDisplay) {
       scenarioDisplay.addEventListener('click', (event) => {
         if (scenarioDisplay.classList.contains('hidden')) return;
         const targetBlock = event.target.closest('.commentable-block');
         if (targetBlock) {
           const blockIndex = parseInt(targetBlock.dataset.blockIndex, 10);
           if (!isNaN(blockIndex)) {
-            openCommentForm(blockIndex);
+            openThread(blockIndex);
+            if (IS_ASSIGNED) openCommentForm(blockIndex);
           }
         }
       });
@@ -308,7 +484,11 @@ document.addEventListener('DOMContentLoaded', () => {
         })
             .then(response => response.json())
             .then(data => {
-              if (data.success && data.comment) {
+              if (data.queued) {
+                // Offline: the service worker sends it when the connection is back
+                closeCommentForm();
+                showOutboxNotice(data.message, 'warning');
+              } else if (data.success && data.comment) {
                 addCommentToDisplay(data.comment);
                 closeCommentForm();
               } else {
@@ -333,6 +513,23 @@ document.addEventListener('DOMContentLoaded', () => {
     }
     if (commentDisplayArea) {
       commentDisplayArea.addEventListener('click', function(event) {
+        const toggleButton = event.target.closest('.comment-group-toggle');
+        if (toggleButton) {
+          const group = toggleButton.closest('.comment-group');
+          const thread = group.querySelector('.comment-thread');
+          if (thread.classList.contains('hidden')) {
+            openThread(parseInt(group.dataset.blockIndex, 10));
+          } else {
+            thread.classList.add('hidden');
+            group.querySelector('.load-more-comments').classList.add('hidden');
+          }
+          return;
+        }
+        const loadMoreButton = event.target.closest('.load-more-comments');
+        if (loadMoreButton) {
+          loadThreadPage(loadMoreButton.closest('.comment-group'));
+          return;
+        }
         const deleteButton = event.target.closest('.delete-comment-btn');
         if (deleteButton) {
           const commentElement = deleteButton.closest('.comment-item');
@@ -355,21 +552,8 @@ document.addEventListener('DOMContentLoaded', () => {
                       commentElement.style.opacity = '0';
                       setTimeout(() => {
                         commentElement.remove();
-                        if (commentGroup &&
-                            !commentGroup.querySelector('.comment-item')) {
-                          commentGroup.remove();
-                          const blockElement = scenarioDisplay.querySelector(
-                              `.commentable-block[data-block-index="${
-                                  blockIndex}"]`);
-                          if (blockElement) {
-                            removeHighlightClasses(blockElement);
-                          }
-                        }
-                        if (!commentDisplayArea.querySelector(
-                                '.comment-group')) {
-                          if (noCommentsMsg)
-                            noCommentsMsg.style.display = 'block';
-                        }
+                        setCommentCount(
+                            blockIndex, (commentCounts[blockIndex] || 1) - 1);
                       }, 300);
                     } else {
                       alert(`خطأ في حذف التعليق: ${data.message}`);
@@ -385,7 +569,8 @@ document.addEventListener('DOMContentLoaded', () => {
     }
     async function saveContent(type, content, statusElement) { /* ... */
       statusElement.textContent = 'جارٍ الحفظ...';
-      statusElement.classList.remove('text-green-600', 'text-red-600');
+      statusElement.classList.remove(
+          'text-green-600', 'text-red-600', 'text-yellow-600');
       statusElement.classList.add('text-gray-500');
       try {
         const response = await fetch(`/episode/${EPISODE_ID}/update`, {
@@ -393,12 +578,35 @@ document.addEventListener('DOMContentLoaded', () => {
           headers: {
             'Content-Type': 'application/json',
           },
-          body: JSON.stringify({[type]: content})
+          body: JSON.stringify({
+            [type]: content,
+            base_revisions: {[type]: storedRevisions[type]},
+          })
         });
         const data = await response.json();
+        // Not after a conflict: saving again must not overwrite the newer text
+        if (response.ok) noteStoredRevisions(data.stored_revisions);
+        if (response.ok && data.queued) {
+          // Offline: the service worker keeps it and sends it later
+          statusElement.textContent = data.message;
+          statusElement.classList.remove('text-gray-500', 'text-red-600');
+          statusElement.classList.add('text-yellow-600');
+          if (type === 'plan') {
+            renderPlanMarkdown(content);
+          } else if (type === 'scenario') {
+            renderScenario(content);
+          }
+          return true;
+        }
         if (response.ok && data.success) {
+          if (data.comment_counts) {
+            // The server re-anchored comments to the edited blocks.
+            commentCounts = data.comment_counts;
+            renderComments(commentCounts);
+          }
           statusElement.textContent = 'تم الحفظ بنجاح!';
-          statusElement.classList.remove('text-gray-500', 'text-red-600');
+          statusElement.classList.remove(
+              'text-gray-500', 'text-red-600', 'text-yellow-600');
           statusElement.classList.add('text-green-600');
           setTimeout(() => statusElement.textContent = '', 3000);
           if (type === 'plan') {
@@ -413,7 +621,8 @@ document.addEventListener('DOMContentLoaded', () => {
       } catch (error) {
         console.error(`Error saving ${type}:`, error);
         statusElement.textContent = `خطأ: ${error.message}`;
-        statusElement.classList.remove('text-gray-500', 'text-green-600');
+        statusElement.classList.remove(
+            'text-gray-500', 'text-green-600', 'text-yellow-600');
         statusElement.classList.add('text-red-600');
         return false;
       }
@@ -449,8 +658,7 @@ document.addEventListener('DOMContentLoaded', () => {
           blockElement.classList.add('commentable-block');
           hasCommentableBlocks = true;
           removeHighlightClasses(blockElement);
-          if (typeof INITIAL_COMMENTS_BY_BLOCK !== 'undefined' &&
-              INITIAL_COMMENTS_BY_BLOCK[i]) {
+          if (commentCounts[i]) {
             const colorClass = getColorClassForIndex(i);
             if (colorClass) blockElement.classList.add(colorClass);
           }
@@ -459,8 +667,7 @@ document.addEventListener('DOMContentLoaded', () => {
           scenarioDisplay.innerHTML =
               `<div class="commentable-block" data-block-index="0">${
                   scenarioDisplay.innerHTML}</div>`;
-          if (typeof INITIAL_COMMENTS_BY_BLOCK !== 'undefined' &&
-              INITIAL_COMMENTS_BY_BLOCK[0]) {
+          if (commentCounts[0]) {
             const colorClass = getColorClassForIndex(0);
             if (colorClass)
               scenarioDisplay.firstChild.classList.add(colorClass);
@@ -474,72 +681,129 @@ document.addEventListener('DOMContentLoaded', () => {
         scenarioDisplay.textContent = scenarioText;
       }
     }
-    function renderComments(commentsByBlock) { /* ... */
+    function renderComments(countsByBlock) {
       if (!commentDisplayArea) return;
       clearCommentsDisplay();
       let hasAnyComments = false;
-      if (commentsByBlock && typeof commentsByBlock === 'object') {
-        Object.keys(commentsByBlock)
-            .sort((a, b) => parseInt(a, 10) - parseInt(b, 10))
-            .forEach(blockIndexStr => {
-              const blockIndex = parseInt(blockIndexStr, 10);
-              const comments = commentsByBlock[blockIndex];
-              if (comments && comments.length > 0) {
-                hasAnyComments = true;
-                const blockCommentsContainer = document.createElement('div');
-                const colorClass = getColorClassForIndex(blockIndex);
-                blockCommentsContainer.classList.add(
-                    'comment-group', 'mb-3', 'border-r-4', 'pr-3',
-                    'text-right');
-                if (colorClass)
-                  blockCommentsContainer.classList.add(colorClass);
-                blockCommentsContainer.dataset.blockIndex = blockIndex;
-                const blockHeader = document.createElement('h4');
-                blockHeader.classList.add(
-                    'text-sm', 'font-semibold', 'text-gray-600', 'mb-1');
-                blockHeader.textContent =
-                    `تعليقات للفقرة رقم ${blockIndex + 1}`;
-                blockCommentsContainer.appendChild(blockHeader);
-                comments.forEach(comment => {
-                  const commentElement = createCommentElement(comment);
-                  blockCommentsContainer.appendChild(commentElement);
-                });
-                commentDisplayArea.appendChild(blockCommentsContainer);
-              }
-            });
-      }
+      Object.keys(countsByBlock || {})
+          .map(blockIndexStr => parseInt(blockIndexStr, 10))
+          .sort((a, b) => a - b)
+          .forEach(blockIndex => {
+            const count = countsByBlock[blockIndex];
+            if (count > 0) {
+              hasAnyComments = true;
+              commentDisplayArea.appendChild(
+                  createCommentGroup(blockIndex, count));
+            }
+          });
       if (noCommentsMsg) {
         noCommentsMsg.style.display = hasAnyComments ? 'none' : 'block';
       }
       console.log(
-          `Rendered comments by block. Has comments: ${hasAnyComments}`);
+          `Rendered comment counts by block. Has comments: ${hasAnyComments}`);
+    }
+    function createCommentGroup(blockIndex, count) {
+      const group = document.createElement('div');
+      const colorClass = getColorClassForIndex(blockIndex);
+      group.classList.add(
+          'comment-group', 'mb-3', 'border-r-4', 'pr-3', 'text-right');
+      if (colorClass) group.classList.add(colorClass);
+      group.dataset.blockIndex = blockIndex;
+      group.dataset.nextPage = 1;
+      group.dataset.loaded = 'false';
+      group.innerHTML = ` <button type="button" class="comment-group-toggle w-full text-right text-sm font-semibold text-gray-600 mb-1 hover:text-gray-800"> تعليقات للفقرة رقم ${
+          blockIndex + 1} <span class="comment-count text-xs text-gray-500"></span> </button> <div class="comment-thread hidden"></div> <button type="button" class="load-more-comments hidden text-xs text-blue-600 hover:text-blue-800 mt-1">تحميل المزيد</button> `;
+      group.querySelector('.comment-count').textContent = `(${count})`;
+      return group;
+    }
+    function findCommentGroup(blockIndex) {
+      return commentDisplayArea ?
+          commentDisplayArea.querySelector(
+              `.comment-group[data-block-index="${blockIndex}"]`) :
+          null;
+    }
+    function setCommentCount(blockIndex, count) {
+      const group = findCommentGroup(blockIndex);
+      if (count > 0) {
+        commentCounts[blockIndex] = count;
+        if (group)
+          group.querySelector('.comment-count').textContent = `(${count})`;
+        return;
+      }
+      delete commentCounts[blockIndex];
+      if (group) group.remove();
+      const blockElement = scenarioDisplay ?
+          scenarioDisplay.querySelector(
+              `.commentable-block[data-block-index="${blockIndex}"]`) :
+          null;
+      if (blockElement) removeHighlightClasses(blockElement);
+      if (noCommentsMsg && !commentDisplayArea.querySelector('.comment-group')) {
+        noCommentsMsg.style.display = 'block';
+      }
     }
-    function addCommentToDisplay(comment) { /* ... */
+    function openThread(blockIndex) {
+      const group = findCommentGroup(blockIndex);
+      if (!group) return;
+      group.querySelector('.comment-thread').classList.remove('hidden');
+      if (group.dataset.loaded === 'false') {
+        loadThreadPage(group);
+      } else if (group.dataset.hasMore === 'true') {
+        group.querySelector('.load-more-comments').classList.remove('hidden');
+      }
+      group.scrollIntoView({block: 'nearest', behavior: 'smooth'});
+    }
+    async function loadThreadPage(group) {
+      if (group.dataset.loading === 'true') return;
+      group.dataset.loading = 'true';
+      const blockIndex = group.dataset.blockIndex;
+      const page = group.dataset.nextPage;
+      const thread = group.querySelector('.comment-thread');
+      const loadMoreButton = group.querySelector('.load-more-comments');
+      try {
+        const response = await fetch(`/episode/${EPISODE_ID}/comments?block=${
+            blockIndex}&page=${page}`);
+        const data = await response.json();
+        if (!response.ok || !data.success) {
+          throw new Error(data.message || 'فشل تحميل التعليقات');
+        }
+        data.comments.forEach(comment => {
+          // Skip comments already shown (e.g. just added by this user).
+          if (!thread.querySelector(
+                  `.comment-item[data-comment-id="${comment.id}"]`)) {
+            thread.appendChild(createCommentElement(comment));
+          }
+        });
+        group.dataset.loaded = 'true';
+        group.dataset.nextPage = data.page + 1;
+        group.dataset.hasMore = data.has_more ? 'true' : 'false';
+        loadMoreButton.classList.toggle('hidden', !data.has_more);
+        setCommentCount(parseInt(blockIndex, 10), data.total);
+      } catch (error) {
+        console.error('Error loading comment thread:', error);
+        alert(`خطأ في تحميل التعليقات: ${error.message}`);
+      } finally {
+        group.dataset.loading = 'false';
+      }
+    }
+    function addCommentToDisplay(comment) {
       if (!commentDisplayArea || comment.block_index === undefined) return;
       if (noCommentsMsg && noCommentsMsg.style.display !== 'none') {
         noCommentsMsg.style.display = 'none';
       }
       const blockIndex = comment.block_index;
       const colorClass = getColorClassForIndex(blockIndex);
-      let blockCommentsContainer = commentDisplayArea.querySelector(
-          `.comment-group[data-block-index="${blockIndex}"]`);
       const blockElement = scenarioDisplay.querySelector(
           `.commentable-block[data-block-index="${blockIndex}"]`);
       if (blockElement) {
         removeHighlightClasses(blockElement);
         if (colorClass) blockElement.classList.add(colorClass);
       }
+      let blockCommentsContainer = findCommentGroup(blockIndex);
       if (!blockCommentsContainer) {
-        blockCommentsContainer = document.createElement('div');
-        blockCommentsContainer.classList.add(
-            'comment-group', 'mb-3', 'border-r-4', 'pr-3', 'text-right');
-        if (colorClass) blockCommentsContainer.classList.add(colorClass);
-        blockCommentsContainer.dataset.blockIndex = blockIndex;
-        const blockHeader = document.createElement('h4');
-        blockHeader.classList.add(
-            'text-sm', 'font-semibold', 'text-gray-600', 'mb-1');
-        blockHeader.textContent = `تعليقات للفقرة رقم ${blockIndex + 1}`;
-        blockCommentsContainer.appendChild(blockHeader);
+        blockCommentsContainer = createCommentGroup(blockIndex, 0);
+        // A new thread holds only this comment, so nothing to fetch.
+        blockCommentsContainer.dataset.loaded = 'true';
+        blockCommentsContainer.dataset.nextPage = 2;
         const existingGroups =
             commentDisplayArea.querySelectorAll('.comment-group');
         let inserted = false;
@@ -553,13 +817,17 @@ document.addEventListener('DOMContentLoaded', () => {
         if (!inserted) {
           commentDisplayArea.appendChild(blockCommentsContainer);
         }
-      } else {
-        removeHighlightClasses(blockCommentsContainer);
-        if (colorClass) blockCommentsContainer.classList.add(colorClass);
       }
-      const commentElement = createCommentElement(comment);
-      commentElement.classList.add('comment-item');
-      blockCommentsContainer.appendChild(commentElement);
+      setCommentCount(blockIndex, (commentCounts[blockIndex] || 0) + 1);
+      const thread = blockCommentsContainer.querySelector('.comment-thread');
+      // Unloaded threads fetch the new comment along with the rest later.
+      if (blockCommentsContainer.dataset.loaded === 'true') {
+        thread.appendChild(createCommentElement(comment));
+      }
+      thread.classList.remove('hidden');
+      if (blockCommentsContainer.dataset.loaded === 'false') {
+        loadThreadPage(blockCommentsContainer);
+      }
     }
     function createCommentElement(comment) { /* ... */
       const div = document.createElement('div');
@@ -621,10 +889,50 @@ document.addEventListener('DOMContentLoaded', () => {
 
 
 // --- NEW: Service Worker Registration ---
+// The worker (static/sw.js) is served at /sw.js so it can cache pages; see
+// the comment at its top. Saves made offline are queued by it and replayed
+// when the connection is back; it reports each replay here.
+function showOutboxNotice(text, category, action) {
+  const colors = {
+    success: 'bg-green-100 border-green-400 text-green-700',
+    warning: 'bg-yellow-100 border-yellow-400 text-yellow-700',
+    danger: 'bg-red-100 border-red-400 text-red-700',
+  };
+  const notice = document.createElement('div');
+  notice.className =
+      `flash-message fixed bottom-4 inset-x-4 sm:inset-x-auto sm:left-4 z-50 p-4 rounded border shadow text-right ${
+          colors[category]}`;
+  notice.setAttribute('role', 'status');
+  notice.textContent = text;
+  document.body.appendChild(notice);
+  if (action) {
+    // Stays until acted on
+    const button = document.createElement('button');
+    button.type = 'button';
+    button.className = 'mr-3 underline font-medium';
+    button.textContent = action.label;
+    button.addEventListener('click', () => {
+      action.onClick();
+      notice.remove();
+    });
+    notice.appendChild(button);
+    return;
+  }
+  setTimeout(() => {
+    notice.style.opacity = '0';
+    setTimeout(() => notice.remove(), 500);
+  }, 5000);
+}
+
+function flushOutbox() {
+  if (navigator.serviceWorker.controller) {
+    navigator.serviceWorker.controller.postMessage({type: 'flush-outbox'});
+  }
+}
+
 if ('serviceWorker' in navigator) {
   window.addEventListener('load', () => {
-    // Use /static/sw.js as the path since sw.js is in the static folder
-    navigator.serviceWorker.register('/static/sw.js')
+    navigator.serviceWorker.register('/sw.js')
         .then(registration => {
           console.log(
               'ServiceWorker registration successful with scope: ',
@@ -633,6 +941,42 @@ if ('serviceWorker' in navigator) {
         .catch(error => {
           console.log('ServiceWorker registration failed: ', error);
         });
+    // Earlier versions registered /static/sw.js, which only saw /static/
+    navigator.serviceWorker.getRegistrations().then(registrations => {
+      registrations
+          .filter(registration => registration.scope.endsWith('/static/'))
+          .forEach(registration => registration.unregister());
+    });
+    flushOutbox();
+  });
+  // Browsers without Background Sync replay the outbox from here
+  window.addEventListener('online', flushOutbox);
+  navigator.serviceWorker.addEventListener('message', event => {
+    const data = event.data || {};
+    const what = data.kind === 'comment' ? 'التعليق' : 'التعديل';
+    if (data.type === 'outbox-sent') {
+      if (typeof EPISODE_ID !== 'undefined' && data.url &&
+          new URL(data.url).pathname === `/episode/${EPISODE_ID}/update`) {
+        noteStoredRevisions(data.stored_revisions);  // Our page's own save
+      }
+      showOutboxNotice(`عاد الاتصال وتم إرسال ${what} المحفوظ على الجهاز.`, 'success');
+    } else if (data.type === 'outbox-conflict') {
+      // Someone saved the field after the offline edit started: the queued
+      // text was not saved. Offer it back so that the work is not lost.
+      showOutboxNotice(
+          `لم يُحفظ ${what} المحفوظ على الجهاز: ${data.message}`, 'danger', {
+            label: 'نسخ نصّي',
+            onClick: () => navigator.clipboard.writeText(data.text || ''),
+          });
+    } else if (data.type === 'outbox-failed') {
+      showOutboxNotice(
+          `تعذّر إرسال ${what} المحفوظ على الجهاز: ${data.message || 'خطأ'}`,
+          'danger');
+    } else if (data.type === 'outbox-login') {
+      showOutboxNotice(
+          'انتهت الجلسة. سجّل الدخول لإرسال التعديلات المحفوظة على الجهاز.',
+          'warning');
+    }
   });
 } else {
   console.log('Service workers are not supported by this browser.');
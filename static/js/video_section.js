@@ -150,11 +150,12 @@ function videoSection() {
             });
         },
 
-        async fetchCredits() {
-            this.creditsLoading = true;
+        async fetchCredits(refresh = false) {
+            // The cached balance comes back at once; only the refresh button waits for OpenRouter
+            this.creditsLoading = refresh || !this.credits;
             this.creditsError = null;
             try {
-                const resp = await fetch('/api/credits');
+                const resp = await fetch(refresh ? '/api/credits?refresh=1' : '/api/credits');
                 const data = await resp.json();
                 if (data.success) {
                     this.credits = {
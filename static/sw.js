@@ -1,98 +1,326 @@
 // static/sw.js
+// Served at /sw.js (assets.py) so that it controls every page, with
+// ASSET_VERSION and PRECACHE_URLS from the asset manifest prepended.
+//
+// - Fingerprinted assets (/static/dist/) are precached and served cache-first;
+//   other static files stale-while-revalidate.
+// - The dashboard, episode pages and the episode JSON reads (comment threads,
+//   activity, revisions, model list) are served stale-while-revalidate: from
+//   the cache at once, refreshed in the background for the next visit. A
+//   write that goes through (any POST/PUT/DELETE) empties that cache.
+// - Plan/scenario saves and new comments made without a connection go to an
+//   outbox in IndexedDB and are replayed in order by Background Sync, or when
+//   a page reports that the connection is back (browsers without it). A save
+//   carries the revision it was based on; one the server refuses with a 409
+//   because the field changed meanwhile is handed back to the page.
+//
+// Both caches carry ASSET_VERSION: a new `flask build-assets` changes this
+// script, and the new worker drops the old caches when it activates.
 
-const CACHE_NAME = 'red-notebook-cache-v1';
-// Add paths to your core static assets here
-const urlsToCache = [
-  // We cache the root path cautiously. If it changes frequently or requires
-  // authentication state not available offline, caching it might cause issues.
-  // '/', // Let's skip caching root for now to avoid complexity
-  '/static/css/style.css', '/static/js/script.js',
-  // Add paths to any other essential local static assets (e.g., logo if not
-  // inline)
-  // '/static/images/icon-192x192.png', // Example: Cache icons if desired
-  // '/static/images/icon-512x512.png'
+/* global ASSET_VERSION, PRECACHE_URLS */
+const ASSET_CACHE = `saleh-assets-${ASSET_VERSION}`;
+const RUNTIME_CACHE = `saleh-runtime-${ASSET_VERSION}`;
+
+const OUTBOX_DB = 'saleh-outbox';
+const OUTBOX_STORE = 'requests';
+const OUTBOX_SYNC_TAG = 'outbox';
+const OUTBOX_MAX_ATTEMPTS = 5;  // Server errors before a queued save is dropped
+
+// Same-origin GETs served stale-while-revalidate (path only)
+const PAGE_PATTERNS = [/^\/$/, /^\/episode\/\d+$/];
+const JSON_PATTERNS = [
+  /^\/episode\/\d+\/comments$/,
+  /^\/api\/episodes\/\d+\/activity$/,
+  /^\/api\/episode\/\d+\/revisions\//,
+  /^\/api\/models$/,
+];
+// Writes that are queued when offline: path -> kind
+const OUTBOX_PATTERNS = [
+  [/^\/episode\/(\d+)\/update$/, 'save'],
+  [/^\/episode\/(\d+)\/comments$/, 'comment'],
 ];
+// Writes that leave the cached pages as they are (live editing traffic)
+const NON_INVALIDATING = [/\/live\//];
 
-// Install event: Cache core assets
+// --- Lifecycle ---
 self.addEventListener('install', event => {
-  console.log('[Service Worker] Installing...');
-  event.waitUntil(
-      caches.open(CACHE_NAME)
-          .then(cache => {
-            console.log('[Service Worker] Opened cache:', CACHE_NAME);
-            // AddAll will fail if any single request fails.
-            // Consider adding assets individually with error handling for
-            // robustness.
-            return cache.addAll(urlsToCache);
-          })
-          .then(() => {
-            console.log('[Service Worker] Core assets cached successfully.');
-            // Force the waiting service worker to become the active service
-            // worker.
-            return self.skipWaiting();
-          })
-          .catch(error => {
-            console.error('[Service Worker] Cache installation failed:', error);
-          }));
+  event.waitUntil(caches.open(ASSET_CACHE)
+                      .then(cache => cache.addAll(PRECACHE_URLS))
+                      .catch(error => {
+                        // Assets are then cached on first use instead
+                        console.error('[Service Worker] Precache failed:', error);
+                      })
+                      .then(() => self.skipWaiting()));
 });
 
-// Activate event: Clean up old caches
 self.addEventListener('activate', event => {
-  console.log('[Service Worker] Activating...');
-  const cacheWhitelist = [CACHE_NAME];  // Only keep the current cache version
+  const current = [ASSET_CACHE, RUNTIME_CACHE];
   event.waitUntil(
       caches.keys()
-          .then(cacheNames => {
-            return Promise.all(cacheNames.map(cacheName => {
-              if (cacheWhitelist.indexOf(cacheName) === -1) {
-                console.log('[Service Worker] Deleting old cache:', cacheName);
-                return caches.delete(cacheName);
-              }
-            }));
-          })
-          .then(() => {
-            console.log('[Service Worker] Claiming clients...');
-            // Take control of all open clients immediately.
-            return self.clients.claim();
-          }));
+          .then(names => Promise.all(
+                    names.filter(name => !current.includes(name))
+                        .map(name => caches.delete(name))))
+          .then(() => self.clients.claim())
+          .then(() => flushOutbox().catch(() => {})));
 });
 
-// Fetch event: Serve cached static assets, go to network for others
+// --- Fetch routing ---
 self.addEventListener('fetch', event => {
-  const requestUrl = new URL(event.request.url);
-
-  // Strategy: Cache falling back to network for local static assets
-  if (urlsToCache.includes(requestUrl.pathname)) {
-    event.respondWith(caches.match(event.request).then(response => {
-      // Cache hit - return response
-      if (response) {
-        // console.log(`[Service Worker] Serving from cache:
-        // ${requestUrl.pathname}`);
-        return response;
+  const request = event.request;
+  const url = new URL(request.url);
+  if (url.origin !== self.location.origin) return;  // CDNs: browser default
+
+  if (request.method !== 'GET') {
+    const outbox = OUTBOX_PATTERNS.find(([pattern]) => pattern.test(url.pathname));
+    if (outbox && request.method === 'POST') {
+      event.respondWith(sendOrQueue(request, outbox[1]));
+    } else if (!NON_INVALIDATING.some(pattern => pattern.test(url.pathname))) {
+      event.respondWith(sendAndInvalidate(request));
+    }
+    return;
+  }
+  if (url.pathname === '/logout') {
+    event.respondWith(logout(request));
+  } else if (url.pathname.startsWith('/static/dist/')) {
+    event.respondWith(cacheFirst(request));
+  } else if (url.pathname.startsWith('/static/')) {
+    event.respondWith(staleWhileRevalidate(event, ASSET_CACHE));
+  } else if (
+      (request.mode === 'navigate' &&
+       PAGE_PATTERNS.some(pattern => pattern.test(url.pathname))) ||
+      JSON_PATTERNS.some(pattern => pattern.test(url.pathname))) {
+    event.respondWith(staleWhileRevalidate(event, RUNTIME_CACHE));
+  }
+  // Everything else (login, polling, streams, exports) goes to the network
+});
+
+function cacheable(response) {
+  // Not a login redirect, an error, or a page the server marked private
+  // (e.g. one showing flashed messages)
+  return response.ok && !response.redirected && response.type === 'basic' &&
+      !(response.headers.get('Cache-Control') || '').includes('no-store');
+}
+
+async function cacheFirst(request) {
+  const cache = await caches.open(ASSET_CACHE);
+  const cached = await cache.match(request);
+  if (cached) return cached;
+  const response = await fetch(request);
+  if (cacheable(response)) await cache.put(request, response.clone());
+  return response;
+}
+
+async function staleWhileRevalidate(event, cacheName) {
+  const request = event.request;
+  const cache = await caches.open(cacheName);
+  const cached = await cache.match(request);
+  const refresh = fetch(request).then(async response => {
+    if (cacheable(response)) {
+      await cache.put(request, response.clone());
+    } else if (response.redirected || response.type === 'opaqueredirect' ||
+               response.status === 401 ||
+               response.status === 403 || response.status === 404) {
+      await cache.delete(request);  // Gone or no longer ours
+    }
+    return response;
+  });
+  if (!cached) return refresh;
+  event.waitUntil(refresh.catch(() => {}));  // Offline: the cached copy stands
+  return cached;
+}
+
+async function sendAndInvalidate(request) {
+  const response = await fetch(request);
+  await caches.delete(RUNTIME_CACHE);
+  return response;
+}
+
+async function logout(request) {
+  // The next user of this browser must not see this user's pages or saves
+  await flushOutbox().catch(() => {});
+  await Promise.all([caches.delete(RUNTIME_CACHE), clearOutbox()]);
+  return fetch(request);
+}
+
+// --- Outbox ---
+function openOutbox() {
+  return new Promise((resolve, reject) => {
+    const open = indexedDB.open(OUTBOX_DB, 1);
+    open.onupgradeneeded = () => {
+      const store = open.result.createObjectStore(
+          OUTBOX_STORE, {keyPath: 'id', autoIncrement: true});
+      store.createIndex('key', 'key');
+    };
+    open.onsuccess = () => resolve(open.result);
+    open.onerror = () => reject(open.error);
+  });
+}
+
+async function outboxTransaction(mode, work) {
+  const db = await openOutbox();
+  return new Promise((resolve, reject) => {
+    const transaction = db.transaction(OUTBOX_STORE, mode);
+    const result = work(transaction.objectStore(OUTBOX_STORE));
+    transaction.oncomplete = () => {
+      db.close();
+      resolve(result && result.result);
+    };
+    transaction.onerror = transaction.onabort = () => {
+      db.close();
+      reject(transaction.error);
+    };
+  });
+}
+
+function outboxKey(kind, url, body) {
+  // Saves of the same field replace each other; comments all go through
+  if (kind !== 'save') return null;
+  try {
+    return `${url}#${Object.keys(JSON.parse(body)).sort().join(',')}`;
+  } catch (error) {
+    return null;
+  }
+}
+
+async function dropSuperseded(key) {
+  if (key === null) return;
+  await outboxTransaction('readwrite', store => {
+    store.index('key').openCursor(IDBKeyRange.only(key)).onsuccess = event => {
+      const cursor = event.target.result;
+      if (cursor) {
+        cursor.delete();
+        cursor.continue();
       }
-      // Not in cache - fetch from network
-      // console.log(`[Service Worker] Fetching from network:
-      // ${requestUrl.pathname}`);
-      return fetch(event.request)
-          .then(networkResponse => {
-            // Optional: Cache the newly fetched static asset? Be careful with
-            // updates. For simplicity, we are only caching on install here.
-            return networkResponse;
-          })
-          .catch(error => {
-            console.error(
-                `[Service Worker] Fetch failed for ${requestUrl.pathname}:`,
-                error);
-            // Optional: Return a generic offline fallback for assets if needed
-          });
-    }));
+    };
+  });
+}
+
+async function enqueue(entry) {
+  await dropSuperseded(entry.key);
+  await outboxTransaction('readwrite', store => store.add(entry));
+}
+
+function clearOutbox() {
+  return outboxTransaction('readwrite', store => store.clear());
+}
+
+function queuedResponse(kind) {
+  const message = kind === 'comment' ?
+      'لا يوجد اتصال. حُفظ التعليق على الجهاز وسيُرسل عند عودة الاتصال.' :
+      'لا يوجد اتصال. حُفظ التعديل على الجهاز وسيُرسل عند عودة الاتصال.';
+  return new Response(
+      JSON.stringify({success: true, queued: true, message: message}),
+      {status: 202, headers: {'Content-Type': 'application/json'}});
+}
+
+async function sendOrQueue(request, kind) {
+  const body = await request.clone().text();
+  const key = outboxKey(kind, request.url, body);
+  try {
+    const response = await fetch(request);
+    // A newer save of the same field went through: older queued ones are moot
+    await dropSuperseded(key);
+    await caches.delete(RUNTIME_CACHE);
+    return response;
+  } catch (error) {
+    await enqueue({
+      url: request.url,
+      method: request.method,
+      contentType: request.headers.get('Content-Type'),
+      body: body,
+      kind: kind,
+      key: key,
+      queuedAt: Date.now(),
+      attempts: 0,
+    });
+    if (self.registration.sync) {
+      await self.registration.sync.register(OUTBOX_SYNC_TAG).catch(() => {});
+    }
+    notifyClients({type: 'outbox-queued', kind: kind});
+    return queuedResponse(kind);
+  }
+}
+
+async function notifyClients(message) {
+  const clients = await self.clients.matchAll({type: 'window'});
+  clients.forEach(client => client.postMessage(message));
+}
+
+let flushing = null;
+
+function flushOutbox() {
+  // One replay at a time, whatever triggered it
+  if (!flushing) {
+    flushing = replayOutbox().finally(() => {
+      flushing = null;
+    });
+  }
+  return flushing;
+}
+
+async function replayOutbox() {
+  const entries = await outboxTransaction('readonly', store => store.getAll());
+  for (const entry of entries) {
+    let response;
+    try {
+      response = await fetch(entry.url, {
+        method: entry.method,
+        headers: entry.contentType ? {'Content-Type': entry.contentType} : {},
+        body: entry.body,
+        credentials: 'same-origin',
+      });
+    } catch (error) {
+      throw new Error('Still offline');  // Keeps the rest; sync retries later
+    }
+    if (response.redirected && new URL(response.url).pathname === '/login') {
+      notifyClients({type: 'outbox-login'});
+      throw new Error('Session expired');
+    }
+    if (response.status >= 500 && entry.attempts + 1 < OUTBOX_MAX_ATTEMPTS) {
+      entry.attempts += 1;
+      await outboxTransaction('readwrite', store => store.put(entry));
+      throw new Error(`Server error ${response.status}`);
+    }
+    const data = await response.json().catch(() => ({}));
+    await outboxTransaction('readwrite', store => store.delete(entry.id));
+    await caches.delete(RUNTIME_CACHE);
+    if (response.status === 409 && data.conflict) {
+      // The field changed on the server after this edit started (the body
+      // carries its base_revisions): hand the text back to the page.
+      notifyClients({
+        type: 'outbox-conflict',
+        kind: entry.kind,
+        url: entry.url,
+        message: data.message || '',
+        text: conflictingText(entry.body, data.fields),
+      });
+      continue;
+    }
+    notifyClients({
+      type: response.ok ? 'outbox-sent' : 'outbox-failed',
+      kind: entry.kind,
+      url: entry.url,
+      message: data.message || '',
+      stored_revisions: data.stored_revisions,
+    });
+  }
+}
+
+function conflictingText(body, fields) {
+  try {
+    const saved = JSON.parse(body);
+    return (fields || []).map(field => saved[field]).join('\n\n');
+  } catch (error) {
+    return '';
   }
-  // Strategy: Network only for all other requests (HTML pages, API calls,
-  // external CDNs) Let the browser handle offline behavior for these.
-  else {
-    // console.log(`[Service Worker] Network request (not caching):
-    // ${requestUrl.pathname}`); Don't intercept, just let it go to the network.
-    // event.respondWith(fetch(event.request)); // Explicitly fetching
-    return;  // Or simply return to let browser handle it normally
+}
+
+self.addEventListener('sync', event => {
+  if (event.tag === OUTBOX_SYNC_TAG) event.waitUntil(flushOutbox());
+});
+
+self.addEventListener('message', event => {
+  if (event.data && event.data.type === 'flush-outbox') {
+    event.waitUntil(flushOutbox().catch(() => {}));
   }
 });
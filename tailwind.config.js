@@ -0,0 +1,13 @@
+// tailwind.config.js
+// Used by `flask build-assets` (assets.py): only the classes found in these
+// files end up in static/dist/css/tailwind.<hash>.css.
+module.exports = {
+  content: [
+    './templates/**/*.html',
+    './static/js/**/*.js',
+  ],
+  theme: {
+    extend: {},
+  },
+  plugins: [],
+};
@@ -0,0 +1,64 @@
+# tests/test_activity_feed.py
+# The activity feed cache is shared between processes and follows commits.
+
+import pytest
+
+from activity_feed import ActivityCache, load_activity
+from app import create_app
+from cache import MemoryBackend, SharedCache
+from models import db, Comment, Episode, Maslak, User
+
+
+@pytest.fixture
+def app():
+    app = create_app("testing", with_admin=False)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def episode(app):
+    maslak = Maslak(name="m")
+    user = User(username="u", password="x")
+    db.session.add_all([maslak, user])
+    db.session.flush()
+    episode = Episode(title="t", maslak_id=maslak.id)
+    db.session.add(episode)
+    db.session.commit()
+    return episode
+
+
+def _comment(episode, text):
+    author = User.query.first()
+    comment = Comment(episode_id=episode.id, user_id=author.id, block_index=0, text=text)
+    db.session.add(comment)
+    db.session.commit()
+    return comment
+
+
+def test_invalidation_reaches_other_processes(episode):
+    shared = SharedCache(MemoryBackend())
+    worker_a, worker_b = ActivityCache(shared), ActivityCache(shared)
+    _comment(episode, "أول")
+    assert len(worker_a.get(episode.id)["events"]) == 1
+    assert len(worker_b.get(episode.id)["events"]) == 1
+
+    _comment(episode, "ثان")
+    worker_a.invalidate([episode.id])  # What the commit hook of worker A does
+    assert len(worker_b.get(episode.id)["events"]) == 2
+
+
+def test_rows_without_timestamp_do_not_break_paging(episode):
+    _comment(episode, "بلا تاريخ")
+    db.session.execute(db.update(Comment).values(timestamp=None))
+    db.session.commit()
+    for text in ("أ", "ب", "ج"):
+        _comment(episode, text)
+
+    first = load_activity(episode.id, limit=2)
+    second = load_activity(episode.id, first["next_cursor"], limit=2)
+    assert [e["details"]["text"] for e in first["events"] + second["events"]] == ["ج", "ب", "أ"]
+    assert second["next_cursor"] is None
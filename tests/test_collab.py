@@ -0,0 +1,53 @@
+# tests/test_collab.py
+# Live edits are merged with saves made outside the live channel.
+
+import random
+
+import pytest
+
+from app import create_app
+from collab import CollabHub, apply_operation, diff_operation
+from models import db, Episode, Maslak, User
+from routes_main import _load_live_field, _persist_live_changes
+
+
+@pytest.fixture
+def app():
+    app = create_app("testing", with_admin=False)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def test_diff_operation_turns_old_into_new():
+    rng = random.Random(7)
+    for _ in range(200):
+        old = "".join(rng.choice("ab\nc") for _ in range(rng.randint(0, 30)))
+        new = "".join(rng.choice("ab\nc") for _ in range(rng.randint(0, 30)))
+        assert apply_operation(old, diff_operation(old, new)) == new
+
+
+def test_flush_rebases_onto_a_whole_field_save(app):
+    hub = CollabHub()
+    hub.init_app(app, load=_load_live_field, persist=_persist_live_changes)
+    maslak = Maslak(name="m")
+    user = User(username="u", password="x")
+    db.session.add_all([maslak, user])
+    db.session.flush()
+    episode = Episode(title="t", scenario="one\ntwo\nthree\n", maslak_id=maslak.id)
+    db.session.add(episode)
+    db.session.commit()
+
+    hub.snapshot(episode.id)
+    hub.submit(episode.id, "scenario", f"u{user.id}-1-a", 0, [4, "TWO ", 10], user.id)
+    # Saved by another worker (or a whole-field save) meanwhile
+    episode.scenario = "one\ntwo\nthree\nfour\n"
+    db.session.commit()
+
+    assert hub.flush(episode.id) == {episode.id: ["scenario"]}
+    db.session.expire_all()
+    expected = "one\nTWO two\nthree\nfour\n"
+    assert db.session.get(Episode, episode.id).scenario == expected
+    assert hub.snapshot(episode.id)["scenario"]["text"] == expected
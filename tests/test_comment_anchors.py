@@ -0,0 +1,62 @@
+# tests/test_comment_anchors.py
+# Comment threads follow their paragraph when a scenario is edited.
+
+import pytest
+
+from app import create_app
+from comment_anchors import block_hash, compute_block_moves, reanchor_comments, split_blocks
+from models import db, Comment, Episode, Maslak, User
+
+
+def _scenario(*paragraphs):
+    return "\n\n".join(paragraphs)
+
+
+@pytest.fixture
+def app():
+    app = create_app("testing", with_admin=False)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def test_moved_paragraph_is_followed_by_hash():
+    _, _, _, moves, _ = compute_block_moves(
+        _scenario("a", "b", "c", "d"), _scenario("a", "c", "b", "d")
+    )
+    assert moves == {1: (2, False), 2: (1, False)}
+
+
+def test_reordered_paragraphs_keep_their_comments(app):
+    old = _scenario("المقدمة", "الوضوء", "الصلاة", "الصيام", "الخاتمة")
+    new = _scenario("المقدمة", "الصيام", "الوضوء", "الخاتمة", "الصلاة")
+    maslak = Maslak(name="m")
+    user = User(username="u", password="x")
+    db.session.add_all([maslak, user])
+    db.session.flush()
+    episode = Episode(title="t", plan="", scenario=old, maslak_id=maslak.id)
+    db.session.add(episode)
+    db.session.flush()
+    blocks = split_blocks(old)
+    for index, block in enumerate(blocks):
+        db.session.add(
+            Comment(
+                episode_id=episode.id,
+                user_id=user.id,
+                block_index=index,
+                anchor_hash=block_hash(block),
+                text=block,  # Each comment names the paragraph it belongs to
+            )
+        )
+    db.session.commit()
+
+    episode.scenario = new
+    reanchor_comments(episode.id, old, new)
+    db.session.commit()
+
+    new_blocks = split_blocks(new)
+    for comment in Comment.query.filter_by(episode_id=episode.id):
+        assert new_blocks[comment.block_index] == comment.text
+        assert comment.anchor_hash == block_hash(comment.text)
@@ -0,0 +1,60 @@
+# tests/test_update_episode.py
+# Whole-field saves are refused when the field changed after the edit began.
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from app import create_app
+from models import db, Assignment, Episode, Maslak, User
+
+
+@pytest.fixture
+def app():
+    app = create_app("testing", with_admin=False)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def episode_id(app):
+    maslak = Maslak(name="m")
+    user = User(username="u", password=generate_password_hash("x"))
+    db.session.add_all([maslak, user])
+    db.session.flush()
+    episode = Episode(title="t", plan="", scenario="أ", maslak_id=maslak.id)
+    db.session.add(episode)
+    db.session.flush()
+    db.session.add(Assignment(user_id=user.id, episode_id=episode.id))
+    db.session.commit()
+    return episode.id
+
+
+@pytest.fixture
+def client(app, episode_id):
+    client = app.test_client()
+    client.post("/login", data={"username": "u", "password": "x"})
+    return client
+
+
+def _save(client, episode_id, scenario, base):
+    return client.post(
+        f"/episode/{episode_id}/update",
+        json={"scenario": scenario, "base_revisions": {"scenario": base}},
+    )
+
+
+def test_save_based_on_an_old_revision_is_refused(client, episode_id):
+    first = _save(client, episode_id, "ب", 0)
+    assert first.status_code == 200
+    revision = first.get_json()["stored_revisions"]["scenario"]
+
+    # Queued offline before the first save went through
+    stale = _save(client, episode_id, "ج", 0)
+    assert stale.status_code == 409
+    assert stale.get_json()["fields"] == ["scenario"]
+    assert db.session.get(Episode, episode_id).scenario == "ب"
+
+    assert _save(client, episode_id, "ج", revision).status_code == 200
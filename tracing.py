@@ -0,0 +1,172 @@
+# tracing.py
+# One structured span per upstream HTTP call (OpenRouter, Google Drive and
+# OAuth, frankfurter, the backup host): host, method, endpoint, status code,
+# latency, retries and response size, written as JSON lines to
+# TRACE_LOG_PATH. Calls are sampled at TRACE_SAMPLE_RATE; failed calls and
+# calls slower than TRACE_SLOW_MS are always kept. Response bodies are never
+# traced; VideoService logs them at debug level only.
+#
+# The spans come from the upstream wrappers in metrics.py. `flask
+# upstream-report` summarizes them per endpoint (p50/p95).
+#
+# Each process appends to the file; rotation (TRACE_LOG_MAX_MB) is done by
+# whichever process crosses the limit, so with several workers a rotated file
+# may be cut a few lines short.
+
+import glob
+import json
+import logging
+import logging.handlers
+import os
+import random
+import re
+import statistics
+from datetime import datetime, timedelta, timezone
+
+from flask import has_request_context, request
+
+span_logger = logging.getLogger("upstream.trace")
+span_logger.propagate = False
+
+_settings = {"sample_rate": 1.0, "slow_ms": 1000}
+
+# Path segments that name a resource rather than an endpoint: anything with
+# a digit (ids, hashes) except API versions like "v1"
+_ID_SEGMENT = re.compile(r"^(?!v\d+$).*\d.*$|^[A-Za-z0-9_-]{25,}$")
+
+
+def endpoint_of(path):
+    """/api/v1/videos/job-123 -> /api/v1/videos/{id}"""
+    return "/".join(
+        "{id}" if segment and _ID_SEGMENT.match(segment) else segment
+        for segment in (path or "/").split("/")
+    )
+
+
+class _JSONFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.span, ensure_ascii=False, separators=(",", ":"))
+
+
+def init_tracing(app):
+    """Sends spans to the app's TRACE_LOG_PATH ("-" for stderr, "" to turn
+    tracing off). The settings apply to the whole process."""
+    _settings["sample_rate"] = app.config["TRACE_SAMPLE_RATE"]
+    _settings["slow_ms"] = app.config["TRACE_SLOW_MS"]
+    path = app.config["TRACE_LOG_PATH"]
+    for handler in list(span_logger.handlers):
+        span_logger.removeHandler(handler)
+        handler.close()
+    if not path:
+        span_logger.disabled = True
+        return
+    if path == "-":
+        handler = logging.StreamHandler()
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(
+            path,
+            maxBytes=app.config["TRACE_LOG_MAX_MB"] * 1024 * 1024,
+            backupCount=3,
+            encoding="utf-8",
+            delay=True,
+        )
+    handler.setFormatter(_JSONFormatter())
+    span_logger.addHandler(handler)
+    span_logger.setLevel(logging.INFO)
+    span_logger.disabled = False
+
+
+def record_span(host, method, path, status, seconds, retries=0, size=None, error=None):
+    """Logs one upstream call if it is sampled (errors and slow calls always are)."""
+    if span_logger.disabled or not span_logger.handlers:
+        return
+    ms = seconds * 1000
+    failed = error is not None or (status or 0) >= 400
+    weight = 1  # Calls this span stands for
+    if not failed and ms < _settings["slow_ms"]:
+        rate = _settings["sample_rate"]
+        if rate <= 0 or random.random() >= rate:
+            return
+        weight = round(1 / rate, 2)
+    span = {
+        "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        "host": host,
+        "method": method,
+        "endpoint": endpoint_of(path),
+        "status": status,
+        "ms": round(ms, 1),
+        "retries": retries,
+        "bytes": size,
+        "weight": weight,
+    }
+    if error is not None:
+        span["error"] = error
+    if has_request_context() and request.url_rule is not None:
+        span["route"] = request.url_rule.rule
+    span_logger.info("upstream call", extra={"span": span})
+
+
+# --- Report ---
+def read_spans(path, since=None):
+    """Spans from the trace log and its rotated files, oldest file first."""
+    files = sorted(glob.glob(f"{path}.*"), reverse=True) + [path]
+    for name in files:
+        if not os.path.exists(name):
+            continue
+        with open(name, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    span = json.loads(line)
+                except ValueError:
+                    continue  # A line cut by a concurrent rotation
+                if since is not None and span.get("ts", "") < since:
+                    continue
+                yield span
+
+
+def _weighted_percentile(pairs, fraction):
+    """Percentile of (value, weight) pairs; sampled spans count 1/rate times."""
+    ordered = sorted(pairs)
+    target = fraction * sum(weight for _, weight in ordered)
+    seen = 0
+    for value, weight in ordered:
+        seen += weight
+        if seen >= target:
+            return value
+    return ordered[-1][0]
+
+
+def upstream_report(path, hours=None):
+    """Per (host, method, endpoint): calls (estimated from the sample),
+    errors, retries, p50/p95/max ms and median response size, slowest p95
+    first."""
+    since = None
+    if hours:
+        since = (datetime.now(timezone.utc) - timedelta(hours=hours)).isoformat(timespec="milliseconds")
+    groups = {}
+    for span in read_spans(path, since):
+        key = (span.get("host"), span.get("method"), span.get("endpoint"))
+        groups.setdefault(key, []).append(span)
+    rows = []
+    for (host, method, endpoint), spans in groups.items():
+        times = [(span["ms"], span.get("weight", 1)) for span in spans]
+        sizes = [span["bytes"] for span in spans if span.get("bytes") is not None]
+        rows.append(
+            {
+                "host": host,
+                "method": method,
+                "endpoint": endpoint,
+                "calls": round(sum(weight for _, weight in times)),
+                "errors": sum(
+                    1 for span in spans if span.get("error") or (span.get("status") or 0) >= 400
+                ),
+                "retries": sum(span.get("retries") or 0 for span in spans),
+                "p50_ms": _weighted_percentile(times, 0.5),
+                "p95_ms": _weighted_percentile(times, 0.95),
+                "max_ms": max(ms for ms, _ in times),
+                "median_bytes": int(statistics.median(sizes)) if sizes else None,
+            }
+        )
+    rows.sort(key=lambda row: -row["p95_ms"])
+    return rows
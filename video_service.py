@@ -2,30 +2,45 @@
 # Encapsulates OpenRouter video generation and Google Drive upload/download.
 
 import json
+import logging
 import os
 import requests
 from datetime import datetime, timedelta
 
-# Google Drive imports
-from google.oauth2 import service_account
-from google.oauth2.credentials import Credentials as OAuthCredentials
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+from cache import shared_cache
+from metrics import timed_google_request_class
 
-OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+logger = logging.getLogger(__name__)
 
-# In-memory cache for video models (TTL 6 hours)
-_models_cache = None
-_models_cache_timestamp = None
+# The Google client libraries are imported inside the Drive methods: they
+# are slow to import and most processes (CLI commands, workers that never
+# touch Drive) don't need them.
+
+# Upstream endpoints. Overridden only to point the app at a stand-in server
+# (loadtest/fake_upstream.py).
+OPENROUTER_BASE_URL = os.environ.get("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+FX_API_URL = os.environ.get("FX_API_URL", "https://api.frankfurter.app/latest")
+GOOGLE_API_ROOT_URL = os.environ.get("GOOGLE_API_ROOT_URL", "https://www.googleapis.com/")
+
+# Upstream lookups are kept in the shared cache (cache.py), one copy for all
+# workers. Stale values are served while a refresh runs or upstream is down.
+_MODELS_CACHE_KEY = "openrouter:video-models"
 _MODELS_CACHE_TTL = timedelta(hours=6)
+_MODELS_STALE_TTL = timedelta(days=1)
 
-# In-memory cache for USD->EUR FX rate (TTL 12 hours)
-_fx_cache = None
-_fx_cache_timestamp = None
+_FX_CACHE_KEY = "fx:usd-eur"
 _FX_CACHE_TTL = timedelta(hours=12)
+_FX_STALE_TTL = timedelta(days=7)
 _FX_FALLBACK_RATE = 0.92  # used only if frankfurter.app is unreachable
 
+# Credit balance: refreshed in the background once it is this old
+_CREDITS_CACHE_KEY = "openrouter:credits"
+CREDITS_REFRESH_SECONDS = int(os.environ.get("CREDITS_REFRESH_SECONDS", "60"))
+_CREDITS_STALE_TTL = timedelta(days=1)
+
+# How long a failed upstream call is remembered before trying again
+_UPSTREAM_ERROR_TTL = timedelta(minutes=2)
+
 
 def _get_openrouter_api_key():
     return os.environ.get("OPENROUTER_API_KEY", "")
@@ -65,24 +80,22 @@ class VideoService:
 
     # --- Model Discovery (cached) ---
     @staticmethod
-    def fetch_models():
-        global _models_cache, _models_cache_timestamp
-        if _models_cache and _models_cache_timestamp:
-            if datetime.utcnow() - _models_cache_timestamp < _MODELS_CACHE_TTL:
-                return _models_cache
-
+    def _fetch_models_upstream():
         url = f"{OPENROUTER_BASE_URL}/videos/models"
-        try:
-            resp = requests.get(url, headers=VideoService._get_headers(), timeout=15)
-            resp.raise_for_status()
-            data = resp.json()
-            models = data.get("data", [])
-            _models_cache = models
-            _models_cache_timestamp = datetime.utcnow()
-            return models
-        except Exception as e:
-            print(f"[VideoService] Failed to fetch models: {e}")
-            return []
+        resp = requests.get(url, headers=VideoService._get_headers(), timeout=15)
+        resp.raise_for_status()
+        return resp.json().get("data", [])
+
+    @staticmethod
+    def fetch_models():
+        return shared_cache.get_or_fetch(
+            _MODELS_CACHE_KEY,
+            VideoService._fetch_models_upstream,
+            ttl=_MODELS_CACHE_TTL.total_seconds(),
+            stale_ttl=_MODELS_STALE_TTL.total_seconds(),
+            error_ttl=_UPSTREAM_ERROR_TTL.total_seconds(),
+            fallback=[],
+        )
 
     @staticmethod
     def get_cached_models():
@@ -90,35 +103,60 @@ class VideoService:
         return models
 
     # --- Credits & FX ---
+    @staticmethod
+    def _fetch_usd_to_eur_rate_upstream():
+        resp = requests.get(
+            FX_API_URL,
+            params={"from": "USD", "to": "EUR"},
+            timeout=10,
+        )
+        resp.raise_for_status()
+        return float(resp.json()["rates"]["EUR"])
+
     @staticmethod
     def get_usd_to_eur_rate():
-        global _fx_cache, _fx_cache_timestamp
-        if _fx_cache and _fx_cache_timestamp:
-            if datetime.utcnow() - _fx_cache_timestamp < _FX_CACHE_TTL:
-                return _fx_cache
-        try:
-            resp = requests.get(
-                "https://api.frankfurter.app/latest",
-                params={"from": "USD", "to": "EUR"},
-                timeout=10,
-            )
-            resp.raise_for_status()
-            rate = float(resp.json()["rates"]["EUR"])
-            _fx_cache = rate
-            _fx_cache_timestamp = datetime.utcnow()
-            return rate
-        except Exception as e:
-            print(f"[VideoService] FX fetch failed, using fallback {_FX_FALLBACK_RATE}: {e}")
-            return _FX_FALLBACK_RATE
+        return shared_cache.get_or_fetch(
+            _FX_CACHE_KEY,
+            VideoService._fetch_usd_to_eur_rate_upstream,
+            ttl=_FX_CACHE_TTL.total_seconds(),
+            stale_ttl=_FX_STALE_TTL.total_seconds(),
+            error_ttl=_UPSTREAM_ERROR_TTL.total_seconds(),
+            fallback=_FX_FALLBACK_RATE,
+        )
 
     @staticmethod
-    def get_credits():
+    def _fetch_credits_upstream():
         url = f"{OPENROUTER_BASE_URL}/credits"
         resp = requests.get(url, headers=VideoService._get_management_headers(), timeout=15)
         resp.raise_for_status()
         data = resp.json().get("data", {})
-        total = float(data.get("total_credits", 0))
-        used = float(data.get("total_usage", 0))
+        return {
+            "total_credits_usd": float(data.get("total_credits", 0)),
+            "total_usage_usd": float(data.get("total_usage", 0)),
+            "fetched_at": datetime.utcnow().isoformat() + "Z",
+        }
+
+    @staticmethod
+    def get_credits(refresh=False):
+        """Credit balance from the shared cache. Once older than
+        CREDITS_REFRESH_SECONDS it is refreshed in the background, so callers
+        never wait for OpenRouter except on a cold cache or with `refresh`."""
+        cache_args = dict(
+            ttl=CREDITS_REFRESH_SECONDS,
+            stale_ttl=_CREDITS_STALE_TTL.total_seconds(),
+            error_ttl=_UPSTREAM_ERROR_TTL.total_seconds(),
+        )
+        if refresh:
+            shared_cache.refresh(
+                _CREDITS_CACHE_KEY, VideoService._fetch_credits_upstream, **cache_args
+            )
+        balance = shared_cache.get_or_fetch(
+            _CREDITS_CACHE_KEY, VideoService._fetch_credits_upstream, **cache_args
+        )
+        if balance is None:
+            raise RuntimeError("OpenRouter credits are unavailable")
+        total = balance["total_credits_usd"]
+        used = balance["total_usage_usd"]
         remaining = max(0.0, total - used)
         rate = VideoService.get_usd_to_eur_rate()
         return {
@@ -127,8 +165,22 @@ class VideoService:
             "remaining_usd": remaining,
             "remaining_eur": remaining * rate,
             "usd_to_eur_rate": rate,
+            "updated_at": balance["fetched_at"],
         }
 
+    @staticmethod
+    def record_spend(cost_usd):
+        """Counts a finished generation's cost against the cached balance right
+        away; the next refresh replaces it with OpenRouter's own figure."""
+        if not cost_usd:
+            return
+        shared_cache.update(
+            _CREDITS_CACHE_KEY,
+            lambda balance: dict(
+                balance, total_usage_usd=balance["total_usage_usd"] + float(cost_usd)
+            ),
+        )
+
     # --- Generation ---
     @staticmethod
     def submit_generation(
@@ -151,7 +203,8 @@ class VideoService:
         resp = requests.post(url, headers=VideoService._get_headers(), json=payload, timeout=30)
         resp.raise_for_status()
         data = resp.json()
-        print(f"[VideoService] submit_generation response: {data}")
+        # Bodies only at debug level: the spans (tracing.py) record every call
+        logger.debug("submit_generation response: %s", data)
         return data
 
     @staticmethod
@@ -159,7 +212,7 @@ class VideoService:
         resp = requests.get(polling_url, headers=VideoService._get_headers(), timeout=15)
         resp.raise_for_status()
         data = resp.json()
-        print(f"[VideoService] poll_status response: {data}")
+        logger.debug("poll_status response: %s", data)
         return data
 
     @staticmethod
@@ -198,6 +251,9 @@ class VideoService:
         client_config = VideoService._load_oauth_client_config()
         if not client_config:
             return None
+        from google.auth.transport.requests import Request
+        from google.oauth2.credentials import Credentials as OAuthCredentials
+
         with open(tokens_path) as f:
             tokens = json.load(f)
         creds = OAuthCredentials(
@@ -211,13 +267,35 @@ class VideoService:
         creds.refresh(Request())
         return creds
 
+    @staticmethod
+    def _build_drive(credentials):
+        from googleapiclient.discovery import build, build_from_document
+
+        request_class = timed_google_request_class()
+        if GOOGLE_API_ROOT_URL == "https://www.googleapis.com/":
+            return build(
+                "drive", "v3", credentials=credentials, cache_discovery=False,
+                requestBuilder=request_class,
+            )
+        # Stand-in server: every Drive URL, uploads included, is built from
+        # the discovery document's rootUrl
+        from googleapiclient.discovery_cache import get_static_doc
+
+        document = json.loads(get_static_doc("drive", "v3"))
+        document["rootUrl"] = GOOGLE_API_ROOT_URL
+        return build_from_document(
+            document, credentials=credentials, requestBuilder=request_class
+        )
+
     @staticmethod
     def _get_drive_service():
+        from google.oauth2 import service_account
+
         # Try OAuth first
         oauth_creds = VideoService._load_oauth_credentials()
         if oauth_creds:
-            print("[VideoService] Using OAuth credentials for Google Drive")
-            return build("drive", "v3", credentials=oauth_creds, cache_discovery=False)
+            logger.debug("Using OAuth credentials for Google Drive")
+            return VideoService._build_drive(oauth_creds)
 
         # Fallback to service account
         creds_path = _get_drive_credentials_path()
@@ -234,8 +312,8 @@ class VideoService:
                 creds_path,
                 scopes=["https://www.googleapis.com/auth/drive"],
             )
-            print("[VideoService] Using service account credentials for Google Drive")
-            return build("drive", "v3", credentials=credentials, cache_discovery=False)
+            logger.debug("Using service account credentials for Google Drive")
+            return VideoService._build_drive(credentials)
 
         raise RuntimeError(
             "Google Drive not connected. Please connect via /api/drive/auth first."
@@ -317,9 +395,10 @@ class VideoService:
             .execute()
         )
         items = results.get("files", [])
-        print(f"[VideoService] _find_or_create_folder found {len(items)} items for '{folder_name}' parent={parent_id}")
-        for item in items:
-            print(f"  - id={item['id']} name={item['name']} shared={item.get('shared')} owners={[o.get('emailAddress') for o in item.get('owners', [])]}")
+        logger.debug(
+            "_find_or_create_folder found %d items for %r parent=%s: %s",
+            len(items), folder_name, parent_id, items,
+        )
 
         if items:
             # Prefer shared/owned-by-others folders over service account's own
@@ -328,7 +407,7 @@ class VideoService:
                 for o in i.get("owners", [])
             )]
             chosen = shared_items[0] if shared_items else items[0]
-            print(f"[VideoService] Chose folder id={chosen['id']} (shared={chosen.get('shared')})")
+            logger.debug("Chose folder id=%s (shared=%s)", chosen["id"], chosen.get("shared"))
             return chosen["id"]
 
         metadata = {
@@ -341,7 +420,7 @@ class VideoService:
             .create(body=metadata, fields="id", supportsAllDrives=True)
             .execute()
         )
-        print(f"[VideoService] Created new folder '{folder_name}' id={folder['id']}")
+        logger.info("Created Drive folder %r id=%s", folder_name, folder["id"])
         return folder["id"]
 
     @staticmethod
@@ -361,6 +440,8 @@ class VideoService:
             "name": file_name,
             "parents": [scene_id],
         }
+        from googleapiclient.http import MediaFileUpload
+
         media = MediaFileUpload(local_path, mimetype="video/mp4", resumable=True)
         file = (
             service.files()
@@ -410,6 +491,9 @@ class VideoService:
                 data = json.load(f)
             if data.get("type") != "service_account":
                 raise RuntimeError("No usable Drive credentials for streaming.")
+            from google.auth.transport.requests import Request
+            from google.oauth2 import service_account
+
             sa_creds = service_account.Credentials.from_service_account_file(
                 creds_path,
                 scopes=["https://www.googleapis.com/auth/drive"],
@@ -421,7 +505,7 @@ class VideoService:
         total_size = int(meta.get("size", 0))
         mime_type = meta.get("mimeType", "video/mp4")
 
-        url = f"https://www.googleapis.com/drive/v3/files/{file_id}?alt=media&supportsAllDrives=true"
+        url = f"{GOOGLE_API_ROOT_URL}drive/v3/files/{file_id}?alt=media&supportsAllDrives=true"
         headers = {"Authorization": f"Bearer {token}"}
         if range_header:
             headers["Range"] = range_header
@@ -458,5 +542,5 @@ class VideoService:
             service.files().delete(fileId=file_id, supportsAllDrives=True).execute()
             return True
         except Exception as e:
-            print(f"[VideoService] Failed to delete drive file {file_id}: {e}")
+            logger.warning("Failed to delete drive file %s: %s", file_id, e)
             return False
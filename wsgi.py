@@ -0,0 +1,17 @@
+# wsgi.py
+# Production WSGI entry point:
+#
+#   gunicorn -c gunicorn.conf.py wsgi:application
+#
+# Other WSGI servers (uWSGI, PythonAnywhere's WSGI file) import `application`
+# from here as well. Set SECRET_KEY; APP_CONFIG selects another config class.
+# The flask command keeps using app.py through .flaskenv.
+
+import os
+
+from app import create_app, warm_up
+
+application = create_app(os.environ.get("APP_CONFIG", "production"))
+
+# With gunicorn's preload_app this runs once in the master, before the fork
+warm_up(application)